@@ -0,0 +1,182 @@
+"""Cache of output files that is shared between runs.
+
+Files are stored in the cache directory under a key that describes how they
+were made, e.g. a hash of the input files, the settings used and the
+ESMValTool version. Files are added to and restored from the cache using hard
+links where possible, so files that are also present in an output directory
+do not take up additional disk space. When the cache grows beyond its maximum
+size, the least recently used entries are removed.
+"""
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import six
+
+logger = logging.getLogger(__name__)
+
+
+def get_file_signature(filename):
+    """Get the path, size and modification time of a file."""
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return [filename, None, None]
+    return [filename, stat.st_size, stat.st_mtime]
+
+
+def _canonical(value):
+    """Convert `value` to an object with a unique json representation.
+
+    Existing files are represented by their path, size and modification time,
+    so a key changes when a file it refers to is modified.
+    """
+    if isinstance(value, dict):
+        return sorted([str(k), _canonical(v)] for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=json.dumps)
+    if isinstance(value, six.string_types):
+        if os.path.isabs(value) and os.path.isfile(value):
+            return get_file_signature(value)
+        return value
+    if value is None or isinstance(value, (bool, float) + six.integer_types):
+        return value
+    if hasattr(value, 'tolist'):
+        # numpy arrays and scalars
+        return value.tolist()
+    if callable(value) and hasattr(value, '__name__'):
+        return '{}.{}'.format(value.__module__, value.__name__)
+    return str(value)
+
+
+def get_key(*items):
+    """Compute a cache key from (nested) dictionaries, lists and values."""
+    text = json.dumps(_canonical(items), sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _link_or_copy(source, target):
+    """Hard link `source` to `target`, or copy if linking is not possible."""
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class Cache(object):
+    """Size bounded cache of files that removes least recently used entries.
+
+    Parameters
+    ----------
+    cache_dir: str
+        Directory where the cache is stored.
+    max_size: float
+        Maximum size of the cache in GB. The cache is not limited if None.
+
+    """
+
+    def __init__(self, cache_dir, max_size=None):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _get_entry_dir(self, key):
+        """Get the directory where the files stored under `key` are."""
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, targets):
+        """Restore the files stored under `key`.
+
+        Parameters
+        ----------
+        key: str
+            Key of the entry.
+        targets: dict
+            Mapping from the (base) names of the files that may be in the
+            entry to the paths they should be restored to.
+
+        Returns
+        -------
+        list or None
+            The paths of the restored files or None if the entry is not in
+            the cache.
+
+        """
+        entry = self._get_entry_dir(key)
+        try:
+            names = sorted(os.listdir(entry))
+            if not names or not set(names).issubset(targets):
+                return None
+            restored = []
+            for name in names:
+                target = targets[name]
+                if not os.path.exists(os.path.dirname(target)):
+                    os.makedirs(os.path.dirname(target))
+                _link_or_copy(os.path.join(entry, name), target)
+                restored.append(target)
+            # Mark the entry as recently used
+            os.utime(entry, None)
+        except (IOError, OSError) as exc:
+            # The entry does not exist or was removed while restoring it
+            logger.debug("Unable to restore %s from cache: %s", key, exc)
+            return None
+        logger.debug("Restored from cache %s:\n%s", entry, '\n'.join(restored))
+        return restored
+
+    def store(self, key, filenames):
+        """Store files under `key` and remove old entries if needed."""
+        entry = self._get_entry_dir(key)
+        if os.path.exists(entry):
+            os.utime(entry, None)
+            return
+        parent = os.path.dirname(entry)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+        # Create the entry in a temporary directory first, so other processes
+        # never see an incomplete entry
+        tmp_dir = tempfile.mkdtemp(prefix='.' + key, dir=parent)
+        try:
+            for filename in filenames:
+                target = os.path.join(tmp_dir, os.path.basename(filename))
+                _link_or_copy(filename, target)
+            os.rename(tmp_dir, entry)
+        except (IOError, OSError) as exc:
+            # Another process stored the same entry, or a file is missing
+            logger.debug("Unable to store %s in cache: %s", key, exc)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+        logger.debug("Stored in cache %s:\n%s", entry, '\n'.join(filenames))
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        if self.max_size is None:
+            return
+        entries = []
+        total_size = 0
+        for entry in glob.glob(os.path.join(self.cache_dir, '??', '*')):
+            try:
+                last_used = os.path.getmtime(entry)
+                size = sum(
+                    os.path.getsize(os.path.join(entry, name))
+                    for name in os.listdir(entry))
+            except OSError:
+                # Removed by another process
+                continue
+            entries.append((last_used, size, entry))
+            total_size += size
+
+        max_size = self.max_size * 2**30
+        for _, size, entry in sorted(entries):
+            if total_size <= max_size:
+                break
+            logger.debug("Removing %s from cache", entry)
+            shutil.rmtree(entry, ignore_errors=True)
+            total_size -= size
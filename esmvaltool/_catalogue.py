@@ -0,0 +1,342 @@
+"""Catalogue of the directories containing input data.
+
+Looking for input files by walking the directory trees below the root paths
+for every variable and dataset is slow on large (parallel) file systems. The
+catalogue stores the contents of all directories below the root paths on
+disk, so input files can be found without accessing the file system.
+
+The catalogue is built with::
+
+    esmvaltool catalogue build
+
+and used for all root paths it contains if ``catalogue_dir`` is set in the
+user configuration file. Running the command again updates the catalogue,
+only listing the directories that were modified since the previous build.
+
+Files are looked up by the DRS facets of a dataset, e.g. the file name
+pattern ``tas_Amon_MPI-ESM-LR_historical_r1i1p1_*.nc``. The names in each
+directory are sorted, so only the names that start with the facets at the
+start of the pattern are compared with it.
+
+The modification time of every directory that is looked up is compared
+with the catalogue. Directories that changed after the catalogue was built
+are listed on disk instead, with a warning to update the catalogue.
+"""
+import argparse
+import bisect
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import re
+import stat
+
+import six
+import yaml
+
+from ._config import _normalize_path, get_config_user_file
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = 'index.json'
+
+_CATALOGUES = {}
+
+
+def _list_directory(path):
+    """Get the sorted names of the subdirectories and files of a directory."""
+    dirs = []
+    files = []
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)):
+            dirs.append(name)
+        else:
+            files.append(name)
+    return sorted(dirs), sorted(files)
+
+
+def _match_files(names, pattern):
+    """Get the names matching a glob pattern from a sorted list of names."""
+    wildcard = re.search(r'[*?[]', pattern)
+    prefix = pattern if wildcard is None else pattern[:wildcard.start()]
+    start = bisect.bisect_left(names, prefix)
+    end = start
+    while end < len(names) and names[end].startswith(prefix):
+        end += 1
+    return fnmatch.filter(names[start:end], pattern)
+
+
+def _write_json(data, filename):
+    """Write data to a json file, replacing the file in one step."""
+    tmp_filename = filename + '.tmp{}'.format(os.getpid())
+    with open(tmp_filename, 'w') as file:
+        json.dump(data, file)
+    os.rename(tmp_filename, filename)
+
+
+class Catalogue(object):
+    """Catalogue of the directories below a number of root paths.
+
+    Paths that are not below one of the root paths in the catalogue are
+    looked up on the file system.
+
+    Parameters
+    ----------
+    catalogue_dir: str
+        Directory where the catalogue is stored.
+
+    """
+
+    def __init__(self, catalogue_dir):
+        self.catalogue_dir = catalogue_dir
+        # Mapping from root path to the file containing its directories
+        self._index = {}
+        # Mapping from root path to a dict containing the modification time,
+        # subdirectories and files of each directory by relative path
+        self._directories = {}
+        # Root paths with directories that changed after the last update
+        self._outdated = set()
+
+        filename = os.path.join(catalogue_dir, INDEX_FILE)
+        if os.path.exists(filename):
+            with open(filename, 'r') as file:
+                self._index = json.load(file)
+
+    @property
+    def roots(self):
+        """The root paths in the catalogue."""
+        return sorted(self._index)
+
+    def _load(self, root):
+        """Load the directories below root."""
+        if root not in self._directories:
+            filename = os.path.join(self.catalogue_dir, self._index[root])
+            logger.debug("Loading catalogue %s of %s", filename, root)
+            with open(filename, 'r') as file:
+                self._directories[root] = json.load(file)
+        return self._directories[root]
+
+    def _save(self, root):
+        """Save the directories below root."""
+        if not os.path.exists(self.catalogue_dir):
+            os.makedirs(self.catalogue_dir)
+        name = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16] + '.json'
+        _write_json(self._directories[root],
+                    os.path.join(self.catalogue_dir, name))
+        self._index[root] = name
+        _write_json(self._index, os.path.join(self.catalogue_dir, INDEX_FILE))
+
+    def _get_root(self, path):
+        """Get the root path in the catalogue that contains path."""
+        for root in sorted(self._index, key=len, reverse=True):
+            if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+                return root
+        return None
+
+    def _warn_outdated(self, root, path):
+        """Warn that the catalogue of root is out of date."""
+        if root in self._outdated:
+            logger.debug("Directory %s changed after it was catalogued",
+                         path)
+            return
+        self._outdated.add(root)
+        logger.warning(
+            "The catalogue of %s in %s is out of date, directory %s changed "
+            "after it was built. Directories that changed are listed on "
+            "disk, run 'esmvaltool catalogue build' to update the catalogue.",
+            root, self.catalogue_dir, path)
+
+    def _get_contents(self, path):
+        """Get the subdirectories and files of a directory.
+
+        Returns None if the directory does not exist.
+        """
+        path = os.path.normpath(path)
+        root = self._get_root(path)
+        entry = None
+        if root is not None:
+            entry = self._load(root).get(os.path.relpath(path, root))
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            stat_result = None
+        if stat_result is None or not stat.S_ISDIR(stat_result.st_mode):
+            mtime = None
+        else:
+            mtime = stat_result.st_mtime
+
+        if entry is not None and entry[0] == mtime:
+            _, dirs, files = entry
+            return dirs, files
+        if root is not None and (entry is not None or mtime is not None):
+            self._warn_outdated(root, path)
+        if mtime is None:
+            return None
+        return _list_directory(path)
+
+    def isdir(self, path):
+        """Check if path is an existing directory."""
+        return self._get_contents(path) is not None
+
+    def listdir(self, path):
+        """List the contents of a directory like :func:`os.listdir`."""
+        contents = self._get_contents(path)
+        if contents is None:
+            raise OSError("No such directory: '{}'".format(path))
+        dirs, files = contents
+        return dirs + files
+
+    def walk(self, top):
+        """Walk a directory tree like :func:`os.walk` with followlinks."""
+        unvisited = [os.path.normpath(top)]
+        while unvisited:
+            path = unvisited.pop()
+            contents = self._get_contents(path)
+            if contents is None:
+                continue
+            dirs, files = contents
+            yield path, dirs, files
+            unvisited.extend(
+                os.path.join(path, name) for name in reversed(dirs))
+
+    def find_files(self, top, patterns):
+        """Find the files matching glob patterns below a directory.
+
+        Parameters
+        ----------
+        top: str
+            The directory to search.
+        patterns: list of str
+            File name patterns, made from the DRS facets of a dataset.
+
+        Returns
+        -------
+        list of str
+            The paths of the matching files.
+
+        """
+        result = []
+        for path, _, files in self.walk(top):
+            for pattern in patterns:
+                result.extend(
+                    os.path.join(path, name)
+                    for name in _match_files(files, pattern))
+        return result
+
+    def update(self, root):
+        """Add or update the directories below root.
+
+        Only directories that were modified since the previous update are
+        listed, the contents of other directories are taken from the
+        catalogue.
+
+        Returns
+        -------
+        tuple of int
+            The number of directories that were listed and the total number
+            of directories below root.
+
+        """
+        root = os.path.normpath(os.path.abspath(root))
+        old = self._load(root) if root in self._index else {}
+        new = {}
+        n_listed = 0
+        unvisited = [(root, ())]
+        while unvisited:
+            path, parents = unvisited.pop()
+            try:
+                stat_result = os.stat(path)
+            except OSError:
+                continue
+            inode = (stat_result.st_dev, stat_result.st_ino)
+            if inode in parents:
+                logger.warning("Skipping %s, symbolic link loop", path)
+                continue
+            relpath = os.path.relpath(path, root)
+            entry = old.get(relpath)
+            if entry is None or entry[0] != stat_result.st_mtime:
+                try:
+                    dirs, files = _list_directory(path)
+                except OSError as exc:
+                    logger.warning("Unable to list %s: %s", path, exc)
+                    continue
+                entry = [stat_result.st_mtime, dirs, files]
+                n_listed += 1
+            new[relpath] = entry
+            parents = parents + (inode, )
+            unvisited.extend(
+                (os.path.join(path, name), parents) for name in entry[1])
+
+        self._directories[root] = new
+        self._save(root)
+        return n_listed, len(new)
+
+
+def get_catalogue():
+    """Get the catalogue set in the user configuration file, if any."""
+    catalogue_dir = get_config_user_file().get('catalogue_dir')
+    if not catalogue_dir:
+        return None
+    if catalogue_dir not in _CATALOGUES:
+        _CATALOGUES[catalogue_dir] = Catalogue(catalogue_dir)
+    return _CATALOGUES[catalogue_dir]
+
+
+def get_args(argv=None):
+    """Define the `esmvaltool catalogue` command line."""
+    parser = argparse.ArgumentParser(
+        prog='esmvaltool catalogue',
+        description="Manage the catalogue of input data directories.")
+    parser.add_argument(
+        'command',
+        choices=['build'],
+        help="'build' creates the catalogue or updates it with the "
+        "directories that were modified since the previous build.")
+    parser.add_argument(
+        'roots',
+        nargs='*',
+        help='Root paths to catalogue, defaults to the rootpath entries in '
+        'the config file')
+    parser.add_argument(
+        '-c',
+        '--config-file',
+        default=os.path.join(os.path.dirname(__file__), 'config-user.yml'),
+        help='Config file')
+    parser.add_argument(
+        '--catalogue-dir',
+        help='Directory to store the catalogue in, defaults to catalogue_dir '
+        'in the config file')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the `esmvaltool catalogue` program."""
+    args = get_args(argv)
+    logging.basicConfig(format='%(levelname)s %(message)s', level=logging.INFO)
+
+    with open(_normalize_path(args.config_file), 'r') as file:
+        cfg = yaml.safe_load(file)
+
+    catalogue_dir = _normalize_path(args.catalogue_dir
+                                    or cfg.get('catalogue_dir'))
+    if not catalogue_dir:
+        raise ValueError("Please set catalogue_dir in the config file {} or "
+                         "use --catalogue-dir".format(args.config_file))
+
+    roots = args.roots
+    if not roots:
+        for paths in cfg.get('rootpath', {}).values():
+            if isinstance(paths, six.string_types):
+                paths = [paths]
+            roots.extend(paths)
+
+    catalogue = Catalogue(catalogue_dir)
+    for root in sorted(set(_normalize_path(root) for root in roots)):
+        if not os.path.isdir(root):
+            logger.warning("Skipping non-existent root path %s", root)
+            continue
+        n_listed, n_total = catalogue.update(root)
+        logger.info("Catalogued %s directories below %s, listed %s", n_total,
+                    root, n_listed)
+    logger.info("Catalogue stored in %s", catalogue_dir)
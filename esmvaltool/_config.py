@@ -17,6 +17,9 @@ logger = logging.getLogger(__name__)
 CFG = {}
 CFG_USER = {}
 
+# Subdirectory of the cache directory for the compiled CMOR tables
+CMOR_INDEX_DIR = 'cmor_tables'
+
 
 def use_legacy_iris():
     """Return True if legacy iris is used."""
@@ -40,6 +43,16 @@ def read_config_user_file(config_file, recipe_name):
         'save_intermediary_cubes': False,
         'remove_preproc_dir': False,
         'max_parallel_tasks': 1,
+        'max_memory': None,
+        'workers': None,
+        'max_parallel_products': 1,
+        'parallel_products_executor': 'process',
+        'max_parallel_writes': 1,
+        'working_precision': 'native',
+        'audit_precision': False,
+        'cache_dir': None,
+        'max_cache_size': 100,
+        'catalogue_dir': None,
         'run_diagnostic': True,
         'profile_diagnostic': False,
         'config_developer_file': None,
@@ -56,6 +69,8 @@ def read_config_user_file(config_file, recipe_name):
     cfg['output_dir'] = _normalize_path(cfg['output_dir'])
     cfg['config_developer_file'] = _normalize_path(
         cfg['config_developer_file'])
+    cfg['cache_dir'] = _normalize_path(cfg['cache_dir'])
+    cfg['catalogue_dir'] = _normalize_path(cfg['catalogue_dir'])
 
     for key in cfg['rootpath']:
         root = cfg['rootpath'][key]
@@ -83,7 +98,10 @@ def read_config_user_file(config_file, recipe_name):
     cfg_developer = read_config_developer_file(cfg['config_developer_file'])
     for key, value in six.iteritems(cfg_developer):
         CFG[key] = value
-    read_cmor_tables(CFG)
+    index_dir = None
+    if cfg['cache_dir']:
+        index_dir = os.path.join(cfg['cache_dir'], CMOR_INDEX_DIR)
+    read_cmor_tables(CFG, index_dir=index_dir)
 
     return cfg
 
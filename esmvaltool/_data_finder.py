@@ -11,6 +11,7 @@ import re
 
 import six
 
+from ._catalogue import get_catalogue
 from ._config import get_project_config, replace_mip_fx
 from .cmor.table import CMOR_TABLES
 
@@ -21,8 +22,12 @@ def find_files(dirnames, filenames):
     """Find files matching filenames in dirnames."""
     logger.debug("Looking for files matching %s in %s", filenames, dirnames)
 
+    catalogue = get_catalogue()
     result = []
     for dirname in dirnames:
+        if catalogue is not None:
+            result.extend(catalogue.find_files(dirname, filenames))
+            continue
         for path, _, files in os.walk(dirname, followlinks=True):
             for filename in filenames:
                 matches = fnmatch.filter(files, filename)
@@ -31,6 +36,14 @@ def find_files(dirnames, filenames):
     return result
 
 
+def _isdir(path):
+    """Check if path is a directory, using the catalogue if available."""
+    catalogue = get_catalogue()
+    if catalogue is None:
+        return os.path.isdir(path)
+    return catalogue.isdir(path)
+
+
 def get_start_end_year(filename):
     """Get the start and end year from a file name.
 
@@ -162,12 +175,13 @@ def _resolve_latestversion(dirname_template):
     # Find latest version
     part1, part2 = dirname_template.split('[latestversion]')
     part2 = part2.lstrip(os.sep)
-    if os.path.exists(part1):
-        versions = os.listdir(part1)
+    filesystem = get_catalogue() or os
+    if _isdir(part1):
+        versions = filesystem.listdir(part1)
         versions.sort(reverse=True)
         for version in ['latest'] + versions:
             dirname = os.path.join(part1, version, part2)
-            if os.path.isdir(dirname):
+            if _isdir(dirname):
                 return dirname
 
     return dirname_template
@@ -211,7 +225,7 @@ def _find_input_dirs(variable, rootpath, drs, fx_var=None):
         for base_path in root:
             dirname = os.path.join(base_path, dirname_template)
             dirname = _resolve_latestversion(dirname)
-            if os.path.exists(dirname):
+            if _isdir(dirname):
                 logger.debug("Found %s", dirname)
                 dirnames.append(dirname)
             else:
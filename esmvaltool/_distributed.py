@@ -0,0 +1,274 @@
+"""Run tasks on worker processes on other machines.
+
+A worker is started on every machine that should run tasks with::
+
+    export ESMVALTOOL_AUTHKEY=<secret>
+    esmvaltool_worker <host>:<port> --processes <n>
+
+and the addresses of the workers are listed under ``workers`` in the user
+configuration file. All machines need the same ESMValTool installation and
+access to the input and output directories at the same paths.
+
+Functions and their arguments, i.e. the pickled tasks, are sent to the
+workers using :mod:`multiprocessing.connection`, which authenticates both
+ends with the key in the environment variable ``ESMVALTOOL_AUTHKEY``.
+"""
+import argparse
+import logging
+import os
+import threading
+from multiprocessing import AuthenticationError, Pool, cpu_count
+from multiprocessing.connection import Client, Listener
+
+import six
+from six.moves import queue
+
+logger = logging.getLogger(__name__)
+
+AUTHKEY_VARIABLE = 'ESMVALTOOL_AUTHKEY'
+
+
+def _get_authkey(authkey=None):
+    """Get the key used to authenticate workers and clients."""
+    if authkey is None:
+        authkey = os.environ.get(AUTHKEY_VARIABLE)
+    if not authkey:
+        raise ValueError(
+            "No key for authenticating workers found, please set the "
+            "environment variable {}".format(AUTHKEY_VARIABLE))
+    if isinstance(authkey, six.text_type):
+        authkey = authkey.encode('utf-8')
+    return authkey
+
+
+def parse_address(address):
+    """Convert a 'host:port' string to a (host, port) tuple."""
+    if isinstance(address, (list, tuple)):
+        return tuple(address)
+    host, _, port = address.rpartition(':')
+    if not host or not port.isdigit():
+        raise ValueError(
+            "Invalid worker address '{}', expected 'host:port'".format(
+                address))
+    return host, int(port)
+
+
+class Worker(object):
+    """Server that runs the functions it receives in a pool of processes.
+
+    Parameters
+    ----------
+    address: tuple
+        The (host, port) to listen on.
+    processes: int
+        Number of processes to run functions in. Defaults to the number of
+        CPUs.
+    authkey: str or bytes
+        Key used to authenticate clients. Defaults to the value of the
+        environment variable ``ESMVALTOOL_AUTHKEY``.
+
+    """
+
+    def __init__(self, address, processes=None, authkey=None):
+        """Start listening for connections."""
+        self.processes = processes or cpu_count()
+        self._authkey = _get_authkey(authkey)
+        self._listener = Listener(address, authkey=self._authkey)
+        # The listener forgets its address when it is closed
+        self._address = self._listener.address
+        self._closed = threading.Event()
+
+    @property
+    def address(self):
+        """The (host, port) the worker is listening on."""
+        return self._address
+
+    def serve_forever(self):
+        """Handle requests until the worker is closed."""
+        host, port = self.address
+        logger.info("Worker listening on %s:%s with %s processes", host,
+                    port, self.processes)
+        pool = Pool(processes=self.processes)
+        try:
+            while True:
+                try:
+                    connection = self._listener.accept()
+                except AuthenticationError as exc:
+                    logger.warning("Refused connection: %s", exc)
+                    continue
+                if self._closed.is_set():
+                    connection.close()
+                    break
+                thread = threading.Thread(
+                    target=self._handle, args=(connection, pool))
+                thread.daemon = True
+                thread.start()
+        finally:
+            self._listener.close()
+            pool.terminate()
+            pool.join()
+
+    def close(self):
+        """Stop accepting new requests."""
+        self._closed.set()
+        # Wake up the listener, which is waiting for a connection
+        try:
+            Client(self.address, authkey=self._authkey).close()
+        except (IOError, OSError):
+            # serve_forever has already stopped and closed the listener,
+            # e.g. because it was interrupted
+            pass
+
+    def _handle(self, connection, pool):
+        """Run a function for a client and send back the result.
+
+        A request is either None, to ask for the number of processes of
+        the worker, or a tuple containing a function and its arguments.
+        The reply is a tuple containing a boolean that indicates success
+        and the result or the exception that was raised.
+        """
+        try:
+            try:
+                request = connection.recv()
+            except (EOFError, IOError, OSError):
+                return
+            if request is None:
+                reply = (True, self.processes)
+            else:
+                function, args = request
+                logger.info("Running %s", function.__name__)
+                try:
+                    reply = (True, pool.apply(function, args))
+                except Exception as exc:  # pylint: disable=broad-except
+                    reply = (False, exc)
+            try:
+                connection.send(reply)
+            except (EOFError, IOError, OSError):
+                logger.warning("Lost connection to client")
+            except Exception as exc:  # pylint: disable=broad-except
+                # The result or exception could not be pickled
+                connection.send((False, RuntimeError(repr(exc))))
+        finally:
+            connection.close()
+
+
+class WorkerPool(object):
+    """Pool that runs functions on remote workers.
+
+    The pool implements the part of the :class:`multiprocessing.Pool`
+    interface that is used by :func:`esmvaltool._task.run_tasks`:
+    `apply_async` with callbacks, `close`, `join` and `terminate`.
+
+    Parameters
+    ----------
+    addresses: list
+        The (host, port) or 'host:port' addresses of the workers.
+    authkey: str or bytes
+        Key used to authenticate with the workers. Defaults to the value of
+        the environment variable ``ESMVALTOOL_AUTHKEY``.
+
+    """
+
+    def __init__(self, addresses, authkey=None):
+        """Connect to the workers."""
+        self._authkey = _get_authkey(authkey)
+        self._jobs = queue.Queue()
+        self._threads = []
+        for address in addresses:
+            address = parse_address(address)
+            processes = self._request(address, None)
+            logger.info("Using worker %s:%s with %s processes", address[0],
+                        address[1], processes)
+            for _ in range(processes):
+                thread = threading.Thread(
+                    target=self._dispatch, args=(address, ))
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self.processes = len(self._threads)
+
+    def _request(self, address, request):
+        """Send a request to a worker and return the result."""
+        connection = Client(address, authkey=self._authkey)
+        try:
+            connection.send(request)
+            success, result = connection.recv()
+        finally:
+            connection.close()
+        if not success:
+            raise result
+        return result
+
+    def _dispatch(self, address):
+        """Send jobs to a worker, one at a time."""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            function, args, callback, error_callback = job
+            try:
+                result = self._request(address, (function, args))
+            except Exception as exc:  # pylint: disable=broad-except
+                if error_callback is not None:
+                    error_callback(exc)
+            else:
+                if callback is not None:
+                    callback(result)
+
+    def apply_async(self, func, args=(), callback=None, error_callback=None):
+        """Run `func(*args)` on the first available worker."""
+        self._jobs.put((func, tuple(args), callback, error_callback))
+
+    def close(self):
+        """Stop accepting new jobs once the submitted jobs are done."""
+        for _ in self._threads:
+            self._jobs.put(None)
+
+    def join(self):
+        """Wait for the submitted jobs to finish."""
+        for thread in self._threads:
+            thread.join()
+
+    def terminate(self):
+        """Discard jobs that have not been started yet.
+
+        Unlike :meth:`multiprocessing.Pool.terminate`, this does not stop
+        the jobs that are already running on the workers. They keep
+        running until they are done and their callbacks are still called.
+        """
+        while True:
+            try:
+                self._jobs.get_nowait()
+            except queue.Empty:
+                break
+        self.close()
+
+
+def get_args():
+    """Define the `esmvaltool_worker` command line."""
+    parser = argparse.ArgumentParser(
+        description="Run ESMValTool tasks sent by other machines. The key "
+        "used to authenticate clients is read from the environment "
+        "variable {}.".format(AUTHKEY_VARIABLE))
+    parser.add_argument(
+        'address', help='Address to listen on, in the form host:port')
+    parser.add_argument(
+        '-p',
+        '--processes',
+        type=int,
+        help='Number of tasks to run in parallel, defaults to the number '
+        'of CPUs')
+    return parser.parse_args()
+
+
+def run_worker():
+    """Run the `esmvaltool_worker` program."""
+    args = get_args()
+    logging.basicConfig(
+        format='%(asctime)s [%(process)d] %(levelname)-8s %(message)s',
+        level=logging.INFO)
+    worker = Worker(parse_address(args.address), processes=args.processes)
+    try:
+        worker.serve_forever()
+    except KeyboardInterrupt:
+        worker.close()
@@ -40,9 +40,12 @@ import sys
 from multiprocessing import cpu_count
 
 from . import __version__
-from ._config import configure_logging, read_config_user_file
+from ._catalogue import main as catalogue_main
+from ._config import (CFG, CMOR_INDEX_DIR, configure_logging,
+                      read_config_user_file)
 from ._recipe import read_recipe_file, TASKSEP
 from ._task import resource_usage_logger
+from .cmor.table import read_cmor_tables
 
 # set up logging
 logger = logging.getLogger(__name__)
@@ -64,6 +67,8 @@ def get_args():
     # parse command line args
     parser = argparse.ArgumentParser(
         description=HEADER,
+        epilog="Run 'esmvaltool catalogue build' to build or update the "
+        "catalogue of input data directories.",
         formatter_class=argparse.RawDescriptionHelpFormatter)
     parser.add_argument('recipe', help='Path or name of the yaml recipe file')
     parser.add_argument(
@@ -99,6 +104,10 @@ def get_args():
         '--diagnostics',
         nargs='*',
         help="Only run the named diagnostics from the recipe.")
+    parser.add_argument(
+        '--cache-dir',
+        help="Reuse preprocessed files stored in CACHE_DIR by previous runs "
+        "and store new ones there. Overrides cache_dir in the config file.")
     args = parser.parse_args()
     return args
 
@@ -145,6 +154,11 @@ def main(args):
         for pattern in args.diagnostics or ()
     }
     cfg['synda_download'] = args.synda_download
+    if args.cache_dir is not None:
+        cfg['cache_dir'] = os.path.abspath(
+            os.path.expandvars(os.path.expanduser(args.cache_dir)))
+        read_cmor_tables(
+            CFG, index_dir=os.path.join(cfg['cache_dir'], CMOR_INDEX_DIR))
     for limit in ('max_datasets', 'max_years'):
         value = getattr(args, limit)
         if value is not None:
@@ -180,13 +194,31 @@ def process_recipe(recipe_file, config_user):
     logger.info("PLOTDIR    = %s", config_user["plot_dir"])
     logger.info(70 * "-")
 
-    logger.info("Running tasks using at most %s processes",
-                config_user['max_parallel_tasks'] or cpu_count())
+    if config_user.get('workers'):
+        logger.info("Running tasks on workers %s",
+                    ', '.join(config_user['workers']))
+    else:
+        logger.info("Running tasks using at most %s processes",
+                    config_user['max_parallel_tasks'] or cpu_count())
 
-    logger.info(
-        "If your system hangs during execution, it may not have enough "
-        "memory for keeping this number of tasks in memory. In that case, "
-        "try reducing 'max_parallel_tasks' in your user configuration file.")
+    if config_user.get('max_memory') is None:
+        logger.info(
+            "If your system hangs during execution, it may not have enough "
+            "memory for keeping this number of tasks in memory. In that "
+            "case, try reducing 'max_parallel_tasks' or setting "
+            "'max_memory' in your user configuration file.")
+    else:
+        logger.info(
+            "Only running tasks in parallel while their estimated memory "
+            "use is less than %s GB", config_user['max_memory'])
+
+    if config_user.get('cache_dir'):
+        if config_user['save_intermediary_cubes']:
+            logger.info("Not using the cache of preprocessed files because "
+                        "save_intermediary_cubes is enabled")
+        else:
+            logger.info("Using preprocessed files cached in %s",
+                        config_user['cache_dir'])
 
     if config_user['compress_netcdf']:
         logger.warning(
@@ -225,6 +257,12 @@ def process_recipe(recipe_file, config_user):
 
 def run():
     """Run the `esmvaltool` program, logging any exceptions."""
+    # The catalogue command is dispatched before parsing the arguments,
+    # because an argparse subcommand would not allow running a recipe with
+    # just `esmvaltool recipe.yml`
+    if sys.argv[1:2] == ['catalogue']:
+        catalogue_main(sys.argv[2:])
+        return
     args = get_args()
     try:
         conf = main(args)
@@ -104,13 +104,30 @@ def get_task_provenance(task, recipe_entity):
     return activity
 
 
+def _read_attributes(filename):
+    """Read the attributes from a netcdf file."""
+    attributes = {}
+    if not (os.path.exists(filename)
+            and os.path.splitext(filename)[1].lower() == '.nc'):
+        return attributes
+
+    with Dataset(filename, 'r') as dataset:
+        for attr in dataset.ncattrs():
+            attributes[attr] = getattr(dataset, attr)
+    return attributes
+
+
 class TrackedFile(object):
     """File with provenance tracking."""
 
-    def __init__(self, filename, attributes, ancestors=None):
-        """Create an instance of a file with provenance tracking."""
+    def __init__(self, filename, attributes=None, ancestors=None):
+        """Create an instance of a file with provenance tracking.
+
+        If no attributes are given, they are read from the file when they
+        are first used.
+        """
         self._filename = filename
-        self.attributes = copy.deepcopy(attributes)
+        self._attributes = copy.deepcopy(attributes)
 
         self.provenance = None
         self.entity = None
@@ -143,6 +160,22 @@ class TrackedFile(object):
         """Filename."""
         return self._filename
 
+    @property
+    def attributes(self):
+        """Attributes of the file."""
+        if self._attributes is None:
+            self._attributes = _read_attributes(self.filename)
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, value):
+        self._attributes = value
+
+    @property
+    def ancestors(self):
+        """Files this file is derived from."""
+        return self._ancestors
+
     def initialize_provenance(self, activity):
         """Initialize the provenance document.
 
@@ -1,15 +1,18 @@
 """Recipe parser."""
 import copy
 import fnmatch
+import glob
 import logging
 import os
+import threading
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
 import yaml
-from netCDF4 import Dataset
 
 from . import __version__
 from . import _recipe_checks as check
+from ._cache import Cache
 from ._config import TAGS, get_institutes, replace_tags
 from ._data_finder import (get_input_filelist, get_input_fx_filelist,
                            get_output_file, get_statistic_output_file)
@@ -23,7 +26,7 @@ from .preprocessor import (DEFAULT_ORDER, FINAL_STEPS, INITIAL_STEPS,
                            PreprocessorFile)
 from .preprocessor._derive import get_required
 from .preprocessor._download import synda_search
-from .preprocessor._io import DATASET_KEYS, concatenate_callback
+from .preprocessor._io import DATASET_KEYS, IO_LOCK, concatenate_callback
 from .preprocessor._regrid import (get_cmor_levels, get_reference_levels,
                                    parse_cell_spec)
 
@@ -31,6 +34,42 @@ logger = logging.getLogger(__name__)
 
 TASKSEP = os.sep
 
+# Maximum number of threads used to look for input files
+MAX_DISCOVERY_THREADS = 16
+
+# Threads that may still be started to look for input files, shared by
+# nested calls to _map_in_threads
+_DISCOVERY_THREADS = threading.BoundedSemaphore(MAX_DISCOVERY_THREADS)
+
+# Subdirectories of the cache directory where regridding weights and
+# Natural Earth land/sea masks are stored
+REGRID_WEIGHTS_DIR = 'regrid_weights'
+NE_MASKS_DIR = 'natural_earth_masks'
+
+# Preprocessor steps that give the same result on a subset of the grid, so
+# regions can already be selected when loading if only these run before
+# the region is extracted
+SUBSET_SAFE_STEPS = {
+    'fix_metadata',
+    'concatenate',
+    'cmor_check_metadata',
+    'extract_time',
+    'extract_season',
+    'extract_month',
+    'fix_data',
+    'mask_above_threshold',
+    'mask_below_threshold',
+    'mask_inside_range',
+    'mask_outside_range',
+}
+
+# Subset extraction steps with the load keyword for the subset and the
+# additional steps that may run before them
+LOAD_SUBSET_STEPS = (
+    ('extract_region', 'region', {'extract_levels', 'extract_volume'}),
+    ('extract_volume', 'depth_range', {'extract_region', 'regrid'}),
+)
+
 
 def ordered_safe_load(stream):
     """Load a YAML file using OrderedDict instead of dict."""
@@ -185,11 +224,13 @@ def _update_target_levels(variable, variables, settings, config_user):
             filename = \
                 _dataset_to_file(variable_data, config_user)
             coordinate = levels.get('coordinate', 'air_pressure')
-            settings['extract_levels']['levels'] = get_reference_levels(
-                filename, variable_data['project'], dataset,
-                variable_data['short_name'],
-                os.path.splitext(variable_data['filename'])[0] + '_fixed',
-                coordinate)
+            # The netCDF library can not read files from multiple threads
+            with IO_LOCK:
+                settings['extract_levels']['levels'] = get_reference_levels(
+                    filename, variable_data['project'], dataset,
+                    variable_data['short_name'],
+                    os.path.splitext(variable_data['filename'])[0] +
+                    '_fixed', coordinate)
 
 
 def _update_target_grid(variable, variables, settings, config_user):
@@ -210,6 +251,43 @@ def _update_target_grid(variable, variables, settings, config_user):
         parse_cell_spec(settings['regrid']['target_grid'])
 
 
+def _update_cache_dirs(settings, config_user):
+    """Let preprocessor functions store reusable data in the cache."""
+    if not config_user.get('cache_dir'):
+        return
+    if 'regrid' in settings:
+        # Share the weights for regridding irregular grids between runs
+        settings['regrid']['weights_dir'] = os.path.join(
+            config_user['cache_dir'], REGRID_WEIGHTS_DIR)
+    if 'mask_landsea' in settings:
+        # Share the rasterised Natural Earth masks between runs
+        settings['mask_landsea']['masks_dir'] = os.path.join(
+            config_user['cache_dir'], NE_MASKS_DIR)
+
+
+def _update_load_time_range(settings):
+    """Only read the time steps that will be extracted from the files."""
+    if 'load' in settings and 'extract_time' in settings:
+        settings['load']['time_range'] = dict(settings['extract_time'])
+
+
+def _update_load_subset(settings, order):
+    """Only read the region and depths that will be extracted from files.
+
+    This is only done if all preprocessor steps that run before the
+    extraction give the same result on the subset.
+    """
+    if 'load' not in settings:
+        return
+    first = order.index('load') + 1
+    for step, keyword, safe_steps in LOAD_SUBSET_STEPS:
+        if step not in settings or step not in order:
+            continue
+        previous = {s for s in order[first:order.index(step)] if s in settings}
+        if previous <= SUBSET_SAFE_STEPS | safe_steps:
+            settings['load'][keyword] = dict(settings[step])
+
+
 def _get_dataset_info(dataset, variables):
     for var in variables:
         if var['dataset'] == dataset:
@@ -409,17 +487,31 @@ def _update_fx_settings(settings, variable, config_user):
             )
 
 
-def _read_attributes(filename):
-    """Read the attributes from a netcdf file."""
-    attributes = {}
-    if not (os.path.exists(filename)
-            and os.path.splitext(filename)[1].lower() == '.nc'):
-        return attributes
-
-    with Dataset(filename, 'r') as dataset:
-        for attr in dataset.ncattrs():
-            attributes[attr] = getattr(dataset, attr)
-    return attributes
+def _map_in_threads(function, items):
+    """Apply function to every item using a pool of threads.
+
+    Looking for input data is limited by the latency of the file system,
+    so this is done for many datasets or variables at the same time. All
+    calls, including the ones made from the threads of another call, share
+    at most `MAX_DISCOVERY_THREADS` threads. Items are processed in the
+    calling thread if no threads are left.
+    """
+    items = list(items)
+    n_threads = 0
+    while n_threads < len(items) and _DISCOVERY_THREADS.acquire(False):
+        n_threads += 1
+    try:
+        if n_threads < 2:
+            return [function(item) for item in items]
+        pool = ThreadPool(processes=n_threads)
+        try:
+            return pool.map(function, items, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        for _ in range(n_threads):
+            _DISCOVERY_THREADS.release()
 
 
 def _get_input_files(variable, config_user):
@@ -442,10 +534,10 @@ def _get_input_files(variable, config_user):
             or variable['dataset'] == variable.get('reference_dataset')):
         check.data_availability(input_files, variable)
 
-    # Set up provenance tracking
+    # Set up provenance tracking, the attributes of the input files are
+    # read when the provenance is recorded
     for i, filename in enumerate(input_files):
-        attributes = _read_attributes(filename)
-        input_files[i] = TrackedFile(filename, attributes)
+        input_files[i] = TrackedFile(filename)
 
     return input_files
 
@@ -583,10 +675,13 @@ def _get_preprocessor_products(variables, profile, order, ancestor_products,
     else:
         grouped_ancestors = {}
 
-    for variable in variables:
+    def get_product(variable):
+        """Create the product of a single dataset."""
         settings = _get_default_settings(
             variable, config_user, derive='derive' in profile)
         _apply_preprocessor_profile(settings, profile)
+        _update_load_time_range(settings)
+        _update_load_subset(settings, order)
         _update_multi_dataset_settings(variable, settings)
         _update_target_levels(
             variable=variable,
@@ -600,15 +695,19 @@ def _get_preprocessor_products(variables, profile, order, ancestor_products,
             variables=variables,
             settings=settings,
             config_user=config_user)
+        _update_cache_dirs(settings, config_user)
         ancestors = grouped_ancestors.get(variable['filename'])
         if not ancestors:
             ancestors = _get_input_files(variable, config_user)
             if config_user.get('skip-nonexistent') and not ancestors:
                 logger.info("Skipping: no data found for %s", variable)
-                continue
-        product = PreprocessorFile(
+                return None
+        return PreprocessorFile(
             attributes=variable, settings=settings, ancestors=ancestors)
-        products.add(product)
+
+    for product in _map_in_threads(get_product, variables):
+        if product is not None:
+            products.add(product)
 
     _update_statistic_settings(products, order, config_user['preproc_dir'])
 
@@ -618,6 +717,15 @@ def _get_preprocessor_products(variables, profile, order, ancestor_products,
     return products
 
 
+def _get_preprocessor_cache(config_user):
+    """Get the cache of preprocessed files if it is enabled."""
+    if (not config_user.get('cache_dir')
+            or config_user['save_intermediary_cubes']):
+        # Intermediary files are not stored in the cache
+        return None
+    return Cache(config_user['cache_dir'], config_user.get('max_cache_size'))
+
+
 def _get_single_preprocessor_task(variables,
                                   profile,
                                   config_user,
@@ -647,6 +755,15 @@ def _get_single_preprocessor_task(variables,
         order=order,
         debug=config_user['save_intermediary_cubes'],
         write_ncl_interface=config_user['write_ncl_interface'],
+        resource_log=os.path.join(config_user['run_dir'], name,
+                                  'resource_usage.txt'),
+        max_parallel_products=config_user.get('max_parallel_products', 1),
+        parallel_products_executor=config_user.get(
+            'parallel_products_executor', 'process'),
+        max_parallel_writes=config_user.get('max_parallel_writes', 1),
+        cache=_get_preprocessor_cache(config_user),
+        precision=config_user.get('working_precision', 'native'),
+        audit_precision=config_user.get('audit_precision', False),
     )
 
     logger.info("PreprocessingTask %s created. It will create the files:\n%s",
@@ -702,13 +819,23 @@ def _get_derive_input_variables(variables, config_user):
             derive_input[group] = []
         derive_input[group].append(var)
 
+    def has_input_files(variable):
+        """Check if there are input files for `variable`."""
+        return bool(
+            get_input_filelist(
+                variable=variable,
+                rootpath=config_user['rootpath'],
+                drs=config_user['drs']))
+
+    available = iter(
+        _map_in_threads(
+            has_input_files,
+            [v for v in variables if not v.get('force_derivation')]))
+
     for variable in variables:
 
         group_prefix = variable['variable_group'] + '_derive_input_'
-        if not variable.get('force_derivation') and get_input_filelist(
-                variable=variable,
-                rootpath=config_user['rootpath'],
-                drs=config_user['drs']):
+        if not variable.get('force_derivation') and next(available):
             # No need to derive, just process normally up to derive step
             var = copy.deepcopy(variable)
             append(group_prefix, var)
@@ -886,14 +1013,21 @@ class Recipe(object):
             if 'fx_files' in variable:
                 for fx_file in variable['fx_files']:
                     DATASET_KEYS.add(fx_file)
-                # Get the fx files
-                variable['fx_files'] = get_input_fx_filelist(
-                    variable=variable,
-                    rootpath=self._cfg['rootpath'],
-                    drs=self._cfg['drs'])
-                logger.info("Using fx files for var %s of dataset %s:\n%s",
-                            variable['short_name'], variable['dataset'],
-                            variable['fx_files'])
+
+        def get_fx_files(variable):
+            """Get the fx files of a single dataset."""
+            fx_files = get_input_fx_filelist(
+                variable=variable,
+                rootpath=self._cfg['rootpath'],
+                drs=self._cfg['drs'])
+            logger.info("Using fx files for var %s of dataset %s:\n%s",
+                        variable['short_name'], variable['dataset'], fx_files)
+            return fx_files
+
+        fx_variables = [v for v in variables if 'fx_files' in v]
+        for variable, fx_files in zip(
+                fx_variables, _map_in_threads(get_fx_files, fx_variables)):
+            variable['fx_files'] = fx_files
 
         return variables
 
@@ -984,21 +1118,30 @@ class Recipe(object):
         logger.info("Creating tasks from recipe")
         tasks = set()
 
+        # Create preprocessor tasks, looking for the input data of all
+        # variable groups at the same time
+        def get_preprocessor_task(item):
+            """Create the preprocessor task of a variable group."""
+            task_name, variables = item
+            logger.info("Creating preprocessor task %s", task_name)
+            return _get_preprocessor_task(
+                variables=variables,
+                profiles=self._preprocessors,
+                config_user=self._cfg,
+                task_name=task_name)
+
+        preprocessor_output = [
+            (diagnostic_name + TASKSEP + variable_group, variables)
+            for diagnostic_name, diagnostic in self.diagnostics.items()
+            for variable_group, variables in diagnostic[
+                'preprocessor_output'].items()
+        ]
+        tasks.update(_map_in_threads(get_preprocessor_task,
+                                     preprocessor_output))
+
         for diagnostic_name, diagnostic in self.diagnostics.items():
             logger.info("Creating tasks for diagnostic %s", diagnostic_name)
 
-            # Create preprocessor tasks
-            for variable_group in diagnostic['preprocessor_output']:
-                task_name = diagnostic_name + TASKSEP + variable_group
-                logger.info("Creating preprocessor task %s", task_name)
-                task = _get_preprocessor_task(
-                    variables=diagnostic['preprocessor_output']
-                    [variable_group],
-                    profiles=self._preprocessors,
-                    config_user=self._cfg,
-                    task_name=task_name)
-                tasks.add(task)
-
             # Create diagnostic tasks
             for script_name, script_cfg in diagnostic['scripts'].items():
                 task_name = diagnostic_name + TASKSEP + script_name
@@ -1034,11 +1177,36 @@ class Recipe(object):
         for task in tasks:
             task.initialize_provenance(self.entity)
 
+        # Use the resource usage of previous runs to estimate memory use
+        self._find_previous_resource_logs(tasks)
+
         # TODO: check that no loops are created (will throw RecursionError)
 
         # Return smallest possible set of tasks
         return get_independent_tasks(tasks)
 
+    def _find_previous_resource_logs(self, tasks):
+        """Find the resource usage logs of the last previous run of tasks."""
+        recipe_name = os.path.splitext(self._filename)[0]
+        output_dirs = sorted(
+            glob.glob(
+                os.path.join(
+                    os.path.dirname(self._cfg['output_dir']),
+                    recipe_name + '_' + 8 * '[0-9]' + '_' + 6 * '[0-9]')),
+            reverse=True)
+        output_dirs = [d for d in output_dirs if d != self._cfg['output_dir']]
+        for task in tasks:
+            if task.resource_log is None:
+                continue
+            relpath = os.path.relpath(task.resource_log, self._cfg['run_dir'])
+            for output_dir in output_dirs:
+                resource_log = os.path.join(output_dir, 'run', relpath)
+                if os.path.exists(resource_log):
+                    logger.debug("Found resource usage of previous run %s",
+                                 resource_log)
+                    task.previous_resource_log = resource_log
+                    break
+
     def __str__(self):
         """Get human readable summary."""
         return '\n\n'.join(str(task) for task in self.tasks)
@@ -1046,4 +1214,7 @@ class Recipe(object):
     def run(self):
         """Run all tasks in the recipe."""
         run_tasks(
-            self.tasks, max_parallel_tasks=self._cfg['max_parallel_tasks'])
+            self.tasks,
+            max_parallel_tasks=self._cfg['max_parallel_tasks'],
+            max_memory=self._cfg.get('max_memory'),
+            workers=self._cfg.get('workers'))
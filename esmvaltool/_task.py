@@ -9,12 +9,16 @@ import pprint
 import subprocess
 import threading
 import time
+from collections import deque
 from multiprocessing import Pool, cpu_count
 
 import psutil
+import six
 import yaml
+from six.moves import queue
 
 from ._config import TAGS, replace_tags
+from ._distributed import WorkerPool
 from ._provenance import TrackedFile, get_task_provenance
 
 logger = logging.getLogger(__name__)
@@ -103,8 +107,7 @@ def resource_usage_logger(pid, filename, interval=1, children=True):
         with open(filename, 'w') as file:
             for msg in _get_resource_usage(process, start_time, children):
                 file.write(msg)
-                time.sleep(interval)
-                if halt.is_set():
+                if halt.wait(interval):
                     return
 
     thread = threading.Thread(target=_log_resource_usage)
@@ -116,6 +119,30 @@ def resource_usage_logger(pid, filename, interval=1, children=True):
         thread.join()
 
 
+def get_peak_memory(resource_log):
+    """Get the peak memory use in GB recorded in a resource usage log.
+
+    Returns None if the log does not exist or does not contain any entries.
+    """
+    if resource_log is None or not os.path.exists(resource_log):
+        return None
+
+    peak = None
+    with open(resource_log, 'r') as file:
+        header = file.readline().rstrip('\n').split('\t')
+        if 'Memory (GB)' not in header:
+            return None
+        column = header.index('Memory (GB)')
+        for line in file:
+            try:
+                memory = float(line.split('\t')[column])
+            except (IndexError, ValueError):
+                continue
+            if peak is None or memory > peak:
+                peak = memory
+    return peak
+
+
 def _py2ncl(value, var_name=''):
     """Format a structure of Python list/dict/etc items as NCL."""
     txt = var_name + ' = ' if var_name else ''
@@ -198,6 +225,8 @@ class BaseTask(object):
         self.output_files = None
         self.name = name
         self.activity = None
+        self.resource_log = None
+        self.previous_resource_log = None
 
     def initialize_provenance(self, recipe_entity):
         """Initialize task provenance activity."""
@@ -208,11 +237,22 @@ class BaseTask(object):
 
     def flatten(self):
         """Return a flattened set of all ancestor tasks and task itself."""
-        tasks = set()
-        for task in self.ancestors:
-            tasks.update(task.flatten())
-        tasks.add(self)
-        return tasks
+        return get_flattened_tasks([self])
+
+    def estimate_memory(self):
+        """Estimate the peak memory use of the task in GB.
+
+        The peak memory use recorded in the resource usage log of a previous
+        run of the task is used if it is available.
+        """
+        peak = get_peak_memory(self.previous_resource_log)
+        if peak is None:
+            peak = self._estimate_memory()
+        return peak
+
+    def _estimate_memory(self):
+        """Estimate the peak memory use in GB from the task definition."""
+        return 0.
 
     def run(self, input_files=None):
         """Run task."""
@@ -559,25 +599,48 @@ class DiagnosticTask(BaseTask):
 
 def get_flattened_tasks(tasks):
     """Return a set of all tasks and their ancestors in `tasks`."""
-    return set(t for task in tasks for t in task.flatten())
+    flattened = set()
+    unvisited = list(tasks)
+    while unvisited:
+        task = unvisited.pop()
+        if task not in flattened:
+            flattened.add(task)
+            unvisited.extend(task.ancestors)
+    return flattened
 
 
 def get_independent_tasks(tasks):
     """Return a set of independent tasks."""
-    independent_tasks = set()
     all_tasks = get_flattened_tasks(tasks)
-    for task in all_tasks:
-        if not any(task in t.ancestors for t in all_tasks):
-            independent_tasks.add(task)
-    return independent_tasks
-
-
-def run_tasks(tasks, max_parallel_tasks=None):
-    """Run tasks."""
-    if max_parallel_tasks == 1:
+    ancestors = {a for task in all_tasks for a in task.ancestors}
+    return all_tasks - ancestors
+
+
+def run_tasks(tasks, max_parallel_tasks=None, max_memory=None, workers=None):
+    """Run tasks.
+
+    Parameters
+    ----------
+    tasks: set
+        Tasks to run.
+    max_parallel_tasks: int
+        Maximum number of tasks that is run at the same time on the local
+        machine.
+    max_memory: float
+        Maximum amount of memory in GB that tasks running at the same time
+        are estimated to use together. Only used when running in parallel.
+    workers: list
+        Addresses ('host:port') of :mod:`esmvaltool._distributed` workers to
+        run the tasks on instead of the local machine.
+
+    """
+    if workers:
+        _run_tasks_parallel(tasks, max_memory=max_memory,
+                            pool=WorkerPool(workers))
+    elif max_parallel_tasks == 1:
         _run_tasks_sequential(tasks)
     else:
-        _run_tasks_parallel(tasks, max_parallel_tasks)
+        _run_tasks_parallel(tasks, max_parallel_tasks, max_memory)
 
 
 def _run_tasks_sequential(tasks):
@@ -589,68 +652,172 @@ def _run_tasks_sequential(tasks):
         task.run()
 
 
-def _run_tasks_parallel(tasks, max_parallel_tasks=None):
-    """Run tasks in parallel."""
+def _get_task_graph(tasks):
+    """Return the number of unfinished ancestors and the dependents of tasks.
+
+    Parameters
+    ----------
+    tasks: set
+        Set of tasks, including all their ancestors.
+
+    Returns
+    -------
+    tuple of dict
+        A dictionary mapping each task to its number of ancestors and a
+        dictionary mapping each task to the list of tasks that have it as
+        an ancestor.
+
+    """
+    indegree = {}
+    dependents = {task: [] for task in tasks}
+    for task in tasks:
+        ancestors = set(task.ancestors)
+        indegree[task] = len(ancestors)
+        for ancestor in ancestors:
+            dependents[ancestor].append(task)
+    return indegree, dependents
+
+
+def _update_task_results(task, output_files, updated_products):
+    """Copy the results of a task run in another process to `task`."""
+    task.output_files = output_files
+    for updated in updated_products:
+        for original in task.products:
+            if original.filename == updated.filename:
+                updated.copy_provenance(target=original)
+                break
+        else:
+            task.products.add(updated)
+
+
+def _run_tasks_parallel(tasks,
+                        max_parallel_tasks=None,
+                        max_memory=None,
+                        pool=None):
+    """Run tasks in parallel.
+
+    A task is submitted to the pool as soon as the last of its ancestors
+    has finished, so the scheduling overhead scales linearly with the
+    number of tasks and dependencies. If `max_memory` is given, a task is
+    only submitted if its estimated memory use fits in the memory that is
+    not yet claimed by running tasks.
+
+    Tasks are run by a :class:`multiprocessing.Pool` with
+    `max_parallel_tasks` processes, unless another `pool` is given. Such a
+    pool needs to provide the `apply_async` (with `callback` and
+    `error_callback`), `close`, `join` and `terminate` methods of
+    :class:`multiprocessing.Pool` and a `processes` attribute.
+    """
     scheduled = get_flattened_tasks(tasks)
-    running = []
-    results = []
+    indegree, dependents = _get_task_graph(scheduled)
+    finished = queue.Queue()
+
+    n_tasks = len(scheduled)
+    n_done = 0
+    ready = deque(t for t in scheduled if not indegree[t])
+    running = {}
+    # Estimated memory use of the running tasks, in a list so the nested
+    # functions can update it
+    claimed = [0.]
+
+    estimates = {}
+    if max_memory is not None:
+        logger.info(
+            "Running tasks with an estimated memory use of at most %s GB",
+            max_memory)
+        estimates = {t: t.estimate_memory() for t in scheduled}
+        logger.debug("Estimated memory use of tasks in GB:\n%s", '\n'.join(
+            '{}: {:.2f}'.format(t.name, estimates[t])
+            for t in sorted(scheduled, key=lambda t: t.name)))
+
+    if pool is None:
+        pool = Pool(processes=max_parallel_tasks)
+        n_processes = max_parallel_tasks or cpu_count()
+    else:
+        n_processes = pool.processes
 
-    n_scheduled, n_running = len(scheduled), len(running)
-    n_tasks = n_scheduled
+    logger.info("Running %s tasks using at most %s processes", n_tasks,
+                n_processes)
+
+    def submit(task):
+        """Submit a task to the pool and report back when it is done."""
+        scheduled.remove(task)
+        running[task] = estimates.get(task, 0.)
+        claimed[0] += running[task]
+        kwargs = {'callback': lambda result: finished.put((task, result))}
+        if not six.PY2 or isinstance(pool, WorkerPool):
+            # Report errors outside of the task, e.g. a lost worker. The
+            # pool of Python 2 does not support this.
+            kwargs['error_callback'] = lambda exc: finished.put(
+                (task, (None, None, exc)))
+        pool.apply_async(_run_task, [task], **kwargs)
+
+    def submit_ready():
+        """Submit the ready tasks that fit in the available memory."""
+        # Tasks that do not fit are put back at the end of the queue
+        for _ in range(len(ready)):
+            task = ready.popleft()
+            memory = estimates.get(task, 0.)
+            if max_memory is not None and memory > max_memory - claimed[0]:
+                if running:
+                    ready.append(task)
+                    continue
+                logger.warning(
+                    "Estimated memory use of task %s (%.2f GB) is larger "
+                    "than max_memory (%s GB), running it anyway", task.name,
+                    memory, max_memory)
+            submit(task)
+
+    submit_ready()
 
-    pool = Pool(processes=max_parallel_tasks)
+    try:
+        while running:
+            # Wait for the next task to finish
+            task, (output_files, products, exception) = finished.get()
+            claimed[0] -= running.pop(task)
+            if not running:
+                # Avoid accumulating rounding errors
+                claimed[0] = 0.
+            if exception is not None:
+                raise exception
+            _update_task_results(task, output_files, products)
+            n_done += 1
+
+            # Submit tasks for which all ancestors are now done
+            for dependent in dependents[task]:
+                indegree[dependent] -= 1
+                if not indegree[dependent]:
+                    ready.append(dependent)
+            submit_ready()
 
-    logger.info("Running %s tasks using at most %s processes", n_tasks,
-                max_parallel_tasks or cpu_count())
-
-    def done(task):
-        """Assume a task is done if it not scheduled or running."""
-        return not (task in scheduled or task in running)
-
-    while scheduled or running:
-        # Submit new tasks to pool
-        just_scheduled = []
-        for task in scheduled:
-            if not task.ancestors or all(done(t) for t in task.ancestors):
-                result = pool.apply_async(_run_task, [task])
-                results.append(result)
-                running.append(task)
-                just_scheduled.append(task)
-        for task in just_scheduled:
-            scheduled.remove(task)
-
-        # Handle completed tasks
-        for task, result in zip(running, results):
-            if result.ready():
-                task.output_files, updated_products = result.get()
-                for updated in updated_products:
-                    for original in task.products:
-                        if original.filename == updated.filename:
-                            updated.copy_provenance(target=original)
-                            break
-                    else:
-                        task.products.add(updated)
-                running.remove(task)
-                results.remove(result)
-
-        # Wait if there are still tasks running
-        if running:
-            time.sleep(0.1)
-
-        # Log progress message
-        if len(scheduled) != n_scheduled or len(running) != n_running:
-            n_scheduled, n_running = len(scheduled), len(running)
-            n_done = n_tasks - n_scheduled - n_running
             logger.info(
                 "Progress: %s tasks running or queued, %s tasks waiting for "
-                "ancestors, %s/%s done", n_running, n_scheduled, n_done,
-                n_tasks)
+                "ancestors, %s tasks waiting for memory, %s/%s done",
+                len(running),
+                len(scheduled) - len(ready), len(ready), n_done, n_tasks)
+    except BaseException:
+        # A WorkerPool only discards the queued tasks, tasks that are
+        # already running on remote workers keep running until they are done
+        pool.terminate()
+        raise
 
     pool.close()
     pool.join()
 
+    if scheduled:
+        raise ValueError("Unable to run tasks {}, their ancestors contain a "
+                         "cycle".format(', '.join(t.name for t in scheduled)))
+
 
 def _run_task(task):
-    """Run task and return the result."""
-    output_files = task.run()
-    return output_files, task.products
+    """Run task and return the result.
+
+    An exception raised by the task is returned instead of raised, because
+    the :class:`multiprocessing.Pool` of Python 2 does not report it back.
+    """
+    try:
+        output_files = task.run()
+    except Exception as exc:  # pylint: disable=broad-except
+        logger.error("Failed to run task %s", task.name, exc_info=True)
+        return None, None, exc
+    return output_files, task.products, None
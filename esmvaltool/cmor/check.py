@@ -341,7 +341,7 @@ class CMORCheck(object):
     def _reverse_coord(self, coord):
         """Reverse coordinate."""
         if coord.ndim == 1:
-            self._cube.data = iris.util.reverse(self._cube.data,
+            self._cube.data = iris.util.reverse(self._cube.core_data(),
                                                 self._cube.coord_dims(coord))
             coord.points = iris.util.reverse(coord.points, 0)
 
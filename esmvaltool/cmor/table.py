@@ -3,29 +3,53 @@ CMOR information reader for ESMValTool.
 
 Read variable information from CMOR 2 and CMOR 3 tables and make it easily
 available for the other components of ESMValTool
+
+Table files are read when a table is first used. The parsed tables are kept
+in memory and can be stored in a compiled index directory, so later runs do
+not need to parse the tables again. Index entries are invalidated when the
+table files change.
 """
 import errno
 import glob
+import hashlib
 import json
 import logging
 import os
+import sys
+import tempfile
+import threading
+from functools import partial
+
+from six.moves import cPickle as pickle
 
 logger = logging.getLogger(__name__)
 
 CMOR_TABLES = {}
 """dict of str, obj: CMOR info objects."""
 
+# Version of the compiled table index, increase it when the info classes
+# change so index files written by older versions are not used
+INDEX_VERSION = 1
+
+# Parsed table files by index key, shared by the info objects of all projects
+_PARSED_TABLES = {}
+
+# Tables are read on first use, which may happen in several threads at once
+_LOAD_LOCK = threading.RLock()
 
-def read_cmor_tables(cfg_developer):
+
+def read_cmor_tables(cfg_developer, index_dir=None):
     """Read cmor tables required in the configuration.
 
     Parameters
     ----------
     cfg_developer : dict of str
         Parsed config-developer file
+    index_dir : str, optional
+        Directory to store the compiled tables in for use by later runs
 
     """
-    custom = CustomInfo()
+    custom = CustomInfo(index_dir=index_dir)
     CMOR_TABLES['custom'] = custom
 
     for table in cfg_developer:
@@ -42,14 +66,76 @@ def read_cmor_tables(cfg_developer):
             default = custom
         if cmor_type == 'CMIP5':
             CMOR_TABLES[table] = CMIP5Info(
-                table_path, default=default,
+                table_path, default=default, index_dir=index_dir,
             )
         elif cmor_type == 'CMIP6':
             CMOR_TABLES[table] = CMIP6Info(
-                table_path, default=default,
+                table_path, default=default, index_dir=index_dir,
             )
 
 
+def _get_index_key(kind, table_files):
+    """Get a key that identifies the contents of the table files."""
+    sha = hashlib.sha256()
+    sha.update('{} {} {}'.format(INDEX_VERSION, sys.version_info[0],
+                                 kind).encode('utf-8'))
+    for table_file in table_files:
+        stat = os.stat(table_file)
+        sha.update(
+            repr((os.path.realpath(table_file), stat.st_mtime,
+                  stat.st_size)).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def _load_compiled(kind, table_files, read, index_dir=None):
+    """Get the result of reading table files from the compiled index.
+
+    The result of `read` is kept in memory and, if `index_dir` is given,
+    stored in that directory for use by other processes and later runs.
+    It is read again if any of the table files changes.
+    """
+    key = _get_index_key(kind, table_files)
+    if key in _PARSED_TABLES:
+        return _PARSED_TABLES[key]
+
+    filename = None
+    if index_dir is not None:
+        filename = os.path.join(index_dir, key + '.pickle')
+    result = None
+    if filename and os.path.exists(filename):
+        logger.debug("Loading compiled CMOR tables from %s", filename)
+        try:
+            with open(filename, 'rb') as file:
+                result = pickle.load(file)
+        except (EnvironmentError, EOFError, pickle.UnpicklingError) as exc:
+            logger.debug("Unable to load %s: %s", filename, exc)
+    if result is None:
+        result = read()
+        if filename:
+            logger.debug("Saving compiled CMOR tables to %s", filename)
+            try:
+                if not os.path.exists(index_dir):
+                    os.makedirs(index_dir)
+                # Write to a temporary file first, so other processes never
+                # read an incomplete file
+                handle, tmp_filename = tempfile.mkstemp(
+                    suffix='.pickle', dir=index_dir)
+                with os.fdopen(handle, 'wb') as file:
+                    pickle.dump(result, file, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_filename, filename)
+            except EnvironmentError as exc:
+                logger.debug("Unable to save %s: %s", filename, exc)
+
+    _PARSED_TABLES[key] = result
+    return result
+
+
+def _get_table_name(table_file):
+    """Guess the name of the table in a file from the file name."""
+    name = os.path.splitext(os.path.basename(table_file))[0]
+    return name.split('_')[-1]
+
+
 class CMIP6Info(object):
     """
     Class to read CMIP6-like data request.
@@ -69,19 +155,26 @@ class CMIP6Info(object):
         'tro3': 'o3',
     }
 
-    def __init__(self, cmor_tables_path, default=None):
+    def __init__(self, cmor_tables_path, default=None, index_dir=None):
         cmor_tables_path = self._get_cmor_path(cmor_tables_path)
 
         self._cmor_folder = os.path.join(cmor_tables_path, 'Tables')
         self.default = default
+        self._index_dir = index_dir
 
-        self.tables = {}
+        self._tables = {}
+        self._coords = None
+        self._coordinate_files = sorted(
+            glob.glob(os.path.join(self._cmor_folder, '*coordinate*.json')))
 
-        self._load_coordinates()
-        for json_file in glob.glob(os.path.join(self._cmor_folder, '*.json')):
+        # Table files that have not been read yet, by table name
+        self._table_files = {}
+        for json_file in sorted(
+                glob.glob(os.path.join(self._cmor_folder, '*.json'))):
             if 'CV_test' in json_file or 'grids' in json_file:
                 continue
-            self._load_table(json_file)
+            self._table_files.setdefault(_get_table_name(json_file),
+                                         []).append(json_file)
 
     @staticmethod
     def _get_cmor_path(cmor_tables_path):
@@ -91,15 +184,49 @@ class CMIP6Info(object):
         cmor_tables_path = os.path.join(cwd, 'tables', cmor_tables_path)
         return cmor_tables_path
 
+    @property
+    def tables(self):
+        """dict of str, TableInfo: All tables, read on first access."""
+        self._load_tables()
+        return self._tables
+
+    @property
+    def coords(self):
+        """dict of str, CoordinateInfo: Coordinates, read on first access."""
+        with _LOAD_LOCK:
+            if self._coords is None:
+                self._coords = _load_compiled(
+                    'CMIP6 coordinates', self._coordinate_files,
+                    self._read_coordinates, self._index_dir)
+        return self._coords
+
+    def _load_tables(self, table_name=None):
+        """Load the files of a table, or all tables that were not loaded."""
+        with _LOAD_LOCK:
+            if table_name is None:
+                table_names = list(self._table_files)
+            else:
+                table_names = [table_name] \
+                    if table_name in self._table_files else []
+            for name in table_names:
+                for json_file in self._table_files.pop(name):
+                    self._load_table(json_file)
+
     def _load_table(self, json_file):
+        table = _load_compiled('CMIP6', [json_file] + self._coordinate_files,
+                               partial(self._read_table, json_file),
+                               self._index_dir)
+        if table is not None:
+            self._tables[table.name] = table
+
+    def _read_table(self, json_file):
         with open(json_file) as inf:
             raw_data = json.loads(inf.read())
             if not self._is_table(raw_data):
-                return
+                return None
             table = TableInfo()
             header = raw_data['Header']
             table.name = header['table_id'][6:].split('_')[-1]
-            self.tables[table.name] = table
 
             generic_levels = header['generic_levels'].split()
             table.frequency = header.get('frequency', '')
@@ -114,6 +241,7 @@ class CMIP6Info(object):
                 var.read_json(var_data)
                 self._assign_dimensions(var, generic_levels)
                 table[var_name] = var
+            return table
 
     def _assign_dimensions(self, var, generic_levels):
         for dimension in var.dimensions:
@@ -130,21 +258,23 @@ class CMIP6Info(object):
 
             var.coordinates[axis] = coord
 
-    def _load_coordinates(self):
-        self.coords = {}
-        for json_file in glob.glob(
-                os.path.join(self._cmor_folder, '*coordinate*.json')):
+    def _read_coordinates(self):
+        coords = {}
+        for json_file in self._coordinate_files:
             with open(json_file) as inf:
                 table_data = json.loads(inf.read())
                 for coord_name in table_data['axis_entry'].keys():
                     coord = CoordinateInfo(coord_name)
                     coord.read_json(table_data['axis_entry'][coord_name])
-                    self.coords[coord_name] = coord
+                    coords[coord_name] = coord
+        return coords
 
     def get_table(self, table):
         """
         Search and return the table info.
 
+        The table is read on first use.
+
         Parameters
         ----------
         table: basestring
@@ -157,7 +287,12 @@ class CMIP6Info(object):
             found, returns None if not
 
         """
-        return self.tables.get(table)
+        if table not in self._tables:
+            self._load_tables(table)
+        if table not in self._tables:
+            # The table name does not match the file name
+            self._load_tables()
+        return self._tables.get(table)
 
     def get_variable(self, table, short_name):
         """
@@ -177,15 +312,15 @@ class CMIP6Info(object):
             found, returns None if not
 
         """
-        try:
-            return self.tables[table][short_name]
-        except KeyError:
-            if short_name in CMIP6Info._CMIP_5to6_varname:
-                new_short_name = CMIP6Info._CMIP_5to6_varname[short_name]
-                return self.get_variable(table, new_short_name)
-            if self.default:
-                return self.default.get_variable(table, short_name)
-            return None
+        table_info = self.get_table(table)
+        if table_info is not None and short_name in table_info:
+            return table_info[short_name]
+        if short_name in CMIP6Info._CMIP_5to6_varname:
+            new_short_name = CMIP6Info._CMIP_5to6_varname[short_name]
+            return self.get_variable(table, new_short_name)
+        if self.default:
+            return self.default.get_variable(table, short_name)
+        return None
 
     @staticmethod
     def _is_table(table_data):
@@ -407,7 +542,7 @@ class CMIP5Info(object):
 
     """
 
-    def __init__(self, cmor_tables_path, default=None):
+    def __init__(self, cmor_tables_path, default=None, index_dir=None):
         cmor_tables_path = self._get_cmor_path(cmor_tables_path)
 
         self._cmor_folder = os.path.join(cmor_tables_path, 'Tables')
@@ -415,16 +550,24 @@ class CMIP5Info(object):
             raise OSError(errno.ENOTDIR, "CMOR tables path is not a directory",
                           self._cmor_folder)
 
-        self.tables = {}
-        self.coords = {}
+        self._tables = {}
+        self._coords = {}
         self.default = default
+        self._index_dir = index_dir
         self._current_table = None
         self._last_line_read = None
-
-        for table_file in glob.glob(os.path.join(self._cmor_folder, '*')):
+        # Tables and coordinates of the file that is being read
+        self._parsed_tables = None
+        self._parsed_coords = None
+
+        # Table files that have not been read yet, by table name
+        self._table_files = {}
+        for table_file in sorted(
+                glob.glob(os.path.join(self._cmor_folder, '*'))):
             if '_grids' in table_file:
                 continue
-            self._load_table(table_file)
+            self._table_files.setdefault(_get_table_name(table_file),
+                                         []).append(table_file)
 
     @staticmethod
     def _get_cmor_path(cmor_tables_path):
@@ -434,15 +577,43 @@ class CMIP5Info(object):
         cmor_tables_path = os.path.join(cwd, 'tables', cmor_tables_path)
         return cmor_tables_path
 
-    def _load_table(self, table_file, table_name=''):
-        if table_name and table_name in self.tables:
-            # special case used for updating a table with custom variable file
-            table = self.tables[table_name]
-        else:
-            # default case: table name is first line of table file
-            table = None
-
-        self._read_table_file(table_file, table)
+    @property
+    def tables(self):
+        """dict of str, TableInfo: All tables, read on first access."""
+        self._load_tables()
+        return self._tables
+
+    @property
+    def coords(self):
+        """dict of str, CoordinateInfo: Coordinates of all tables."""
+        self._load_tables()
+        return self._coords
+
+    def _load_tables(self, table_name=None):
+        """Load the files of a table, or all tables that were not loaded."""
+        with _LOAD_LOCK:
+            if table_name is None:
+                table_names = sorted(self._table_files)
+            else:
+                table_names = [table_name] \
+                    if table_name in self._table_files else []
+            for name in table_names:
+                for table_file in self._table_files.pop(name):
+                    self._load_table(table_file)
+
+    def _load_table(self, table_file):
+        tables, coords = _load_compiled(
+            'CMIP5', [table_file], partial(self._read_table, table_file),
+            self._index_dir)
+        self._tables.update(tables)
+        self._coords.update(coords)
+
+    def _read_table(self, table_file):
+        """Read the tables and coordinates defined in a table file."""
+        self._parsed_tables = {}
+        self._parsed_coords = {}
+        self._read_table_file(table_file)
+        return self._parsed_tables, self._parsed_coords
 
     def _read_table_file(self, table_file, table=None):
         with open(table_file) as self._current_table:
@@ -452,7 +623,7 @@ class CMIP5Info(object):
                 if key == 'table_id':
                     table = TableInfo()
                     table.name = value[len('Table '):]
-                    self.tables[table.name] = table
+                    self._parsed_tables[table.name] = table
                 elif key == 'frequency':
                     table.frequency = value
                 elif key == 'modeling_realm':
@@ -462,9 +633,9 @@ class CMIP5Info(object):
                         coord = CoordinateInfo(dim)
                         coord.generic_level = True
                         coord.axis = 'Z'
-                        self.coords[dim] = coord
+                        self._parsed_coords[dim] = coord
                 elif key == 'axis_entry':
-                    self.coords[value] = self._read_coordinate(value)
+                    self._parsed_coords[value] = self._read_coordinate(value)
                     continue
                 elif key == 'variable_entry':
                     table[value] = self._read_variable(value, table.frequency)
@@ -515,13 +686,15 @@ class CMIP5Info(object):
             elif hasattr(var, key):
                 setattr(var, key, value)
         for dim in var.dimensions:
-            var.coordinates[dim] = self.coords[dim]
+            var.coordinates[dim] = self._parsed_coords[dim]
         return var
 
     def get_table(self, table):
         """
         Search and return the table info.
 
+        The table is read on first use.
+
         Parameters
         ----------
         table: basestring
@@ -534,7 +707,12 @@ class CMIP5Info(object):
             found, returns None if not
 
         """
-        return self.tables.get(table)
+        if table not in self._tables:
+            self._load_tables(table)
+        if table not in self._tables:
+            # The table name does not match the file name
+            self._load_tables()
+        return self._tables.get(table)
 
     def get_variable(self, table, short_name):
         """
@@ -554,7 +732,7 @@ class CMIP5Info(object):
             found, returns None if not
 
         """
-        var_info = self.tables.get(table, {}).get(short_name, None)
+        var_info = (self.get_table(table) or {}).get(short_name, None)
         if not var_info and self.default:
             return self.default.get_variable(table, short_name)
         return var_info
@@ -572,23 +750,44 @@ class CustomInfo(CMIP5Info):
 
     """
 
-    def __init__(self, cmor_tables_path=None):
+    def __init__(self, cmor_tables_path=None, index_dir=None):
         cwd = os.path.dirname(os.path.realpath(__file__))
         self._cmor_folder = os.path.join(cwd, 'tables', 'custom')
-        self.tables = {}
-        table = TableInfo()
-        table.name = 'custom'
-        self.tables[table.name] = table
+        self._index_dir = index_dir
+        self._tables = None
+        self._coords = None
+        self._current_table = None
+        self._last_line_read = None
+        self._parsed_tables = None
+        self._parsed_coords = None
         self._coordinates_file = os.path.join(
             self._cmor_folder,
             'CMOR_coordinates.dat',
         )
-        self.coords = {}
-        self._read_table_file(self._coordinates_file, self.tables['custom'])
-        for dat_file in glob.glob(os.path.join(self._cmor_folder, '*.dat')):
+        self._dat_files = [self._coordinates_file]
+        for dat_file in sorted(
+                glob.glob(os.path.join(self._cmor_folder, '*.dat'))):
             if dat_file == self._coordinates_file:
                 continue
-            self._read_table_file(dat_file, self.tables['custom'])
+            self._dat_files.append(dat_file)
+
+    def _load_tables(self, table_name=None):
+        """Load the custom table, all files are read at once."""
+        with _LOAD_LOCK:
+            if self._tables is None:
+                self._tables, self._coords = _load_compiled(
+                    'custom', self._dat_files, self._read_tables,
+                    self._index_dir)
+
+    def _read_tables(self):
+        """Read the custom table and coordinates from all files."""
+        table = TableInfo()
+        table.name = 'custom'
+        self._parsed_tables = {table.name: table}
+        self._parsed_coords = {}
+        for dat_file in self._dat_files:
+            self._read_table_file(dat_file, table)
+        return self._parsed_tables, self._parsed_coords
 
     def get_table(self, table):
         """
@@ -606,7 +805,8 @@ class CustomInfo(CMIP5Info):
             found, returns None if not
 
         """
-        return self.tables.get(table)
+        self._load_tables()
+        return self._tables.get(table)
 
     def get_variable(self, table, short_name):
         """
@@ -638,9 +838,9 @@ class CustomInfo(CMIP5Info):
                         coord = CoordinateInfo(dim)
                         coord.generic_level = True
                         coord.axis = 'Z'
-                        self.coords[dim] = coord
+                        self._parsed_coords[dim] = coord
                 elif key == 'axis_entry':
-                    self.coords[value] = self._read_coordinate(value)
+                    self._parsed_coords[value] = self._read_coordinate(value)
                     continue
                 elif key == 'variable_entry':
                     table[value] = self._read_variable(value, None)
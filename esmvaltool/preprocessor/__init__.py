@@ -2,28 +2,36 @@
 import copy
 import inspect
 import logging
+import multiprocessing
+import os
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
 import six
 from iris.cube import Cube, CubeList
+from netCDF4 import Dataset
 
+from .. import __version__
+from .._cache import get_key
 from .._provenance import TrackedFile
-from .._task import BaseTask
+from .._task import BaseTask, resource_usage_logger
 from ._area_pp import area_average as average_region
 from ._area_pp import area_slice as extract_region
 from ._area_pp import (zonal_means, extract_named_regions)
 from ._derive import derive
 from ._download import download
-from ._io import (_get_debug_filename, cleanup, concatenate, load, save,
-                  write_metadata)
+from ._io import (IO_LOCK, _get_debug_filename, cleanup, concatenate, load,
+                  realise, save, write_metadata)
 from ._mask import (mask_above_threshold, mask_below_threshold,
                     mask_fillvalues, mask_inside_range, mask_landsea,
                     mask_landseaice, mask_outside_range)
 from ._multimodel import multi_model_statistics
+from ._precision import PRECISIONS, check_precision, set_precision
 from ._reformat import (cmor_check_data, cmor_check_metadata, fix_data,
                         fix_file, fix_metadata)
 from ._regrid import extract_levels, regrid
-from ._time_area import (extract_month, extract_season, seasonal_mean,
-                         time_average)
+from ._time_area import (climatology, extract_month, extract_season,
+                         seasonal_mean, time_average)
 from ._time_area import time_slice as extract_time
 from ._volume_pp import depth_integration, extract_trajectory, extract_transect
 from ._volume_pp import volume_average as average_volume
@@ -82,6 +90,7 @@ __all__ = [
     'average_volume',
     'zonal_means',
     'seasonal_mean',
+    'climatology',
     'time_average',
     'cmor_check_data',
     # Save to file
@@ -100,6 +109,20 @@ MULTI_MODEL_FUNCTIONS = {
     'mask_fillvalues',
 }
 
+# Approximate number of copies of the data that are kept in memory while
+# running a preprocessor function, the default is 2 (input and result).
+MEMORY_COPIES = {
+    'average_region': 3,
+    'average_volume': 3,
+    'climatology': 3,
+    'depth_integration': 3,
+    'extract_levels': 4,
+    'mask_fillvalues': 3,
+    'multi_model_statistics': 3,
+    'regrid': 3,
+    'time_average': 3,
+}
+
 
 def _get_itype(step):
     """Get the input type of a preprocessor function."""
@@ -247,6 +270,9 @@ class PreprocessorFile(TrackedFile):
 
         self._cubes = None
         self._prepared = False
+        self.cache_key = None
+        self.precision = 'native'
+        self.audit_precision = False
 
     def check(self):
         """Check preprocessor settings."""
@@ -258,7 +284,14 @@ class PreprocessorFile(TrackedFile):
             raise ValueError(
                 "PreprocessorFile {} has no settings for step {}".format(
                     self, step))
+        lazy = all(cube.has_lazy_data() for cube in self.cubes)
+        dtypes = [cube.dtype for cube in self.cubes]
         self.cubes = preprocess(self.cubes, step, **self.settings[step])
+        self.cubes = check_precision(step, self.cubes, dtypes, self.precision,
+                                     self.audit_precision)
+        if lazy and not all(cube.has_lazy_data() for cube in self.cubes):
+            logger.debug("Step %s loaded the data of %s into memory", step,
+                         self.filename)
         if debug:
             logger.debug("Result %s", self.cubes)
             filename = _get_debug_filename(self.filename, step)
@@ -267,10 +300,12 @@ class PreprocessorFile(TrackedFile):
     def prepare(self):
         """Apply preliminary file operations on product."""
         if not self._prepared:
-            for step in DEFAULT_ORDER[:DEFAULT_ORDER.index('load')]:
-                if step in self.settings:
-                    self.files = preprocess(self.files, step,
-                                            **self.settings[step])
+            # File operations like fix_file read and write netCDF files
+            with IO_LOCK:
+                for step in DEFAULT_ORDER[:DEFAULT_ORDER.index('load')]:
+                    if step in self.settings:
+                        self.files = preprocess(self.files, step,
+                                                **self.settings[step])
             self._prepared = True
 
     @property
@@ -280,6 +315,7 @@ class PreprocessorFile(TrackedFile):
             self.prepare()
             self._cubes = preprocess(self.files, 'load',
                                      **self.settings.get('load', {}))
+            set_precision(self._cubes, self.precision)
         return self._cubes
 
     @cubes.setter
@@ -314,6 +350,167 @@ class PreprocessorFile(TrackedFile):
         self.entity.add_attributes(settings)
 
 
+def _get_data_size(filename, short_name):
+    """Get the size in GB of the data in a file when loaded into memory."""
+    if not os.path.exists(filename):
+        return 0.
+    try:
+        with Dataset(filename, 'r') as dataset:
+            if short_name in dataset.variables:
+                variables = [dataset.variables[short_name]]
+            else:
+                variables = dataset.variables.values()
+            # Each element needs an additional byte for the mask
+            size = max([0] + [
+                v.size * (v.dtype.itemsize + 1) for v in variables
+                if hasattr(v.dtype, 'itemsize')
+            ])
+    except (IOError, OSError):
+        size = os.path.getsize(filename)
+    return size / float(2**30)
+
+
+def _get_input_size(product):
+    """Get the size in GB of the input data of a product."""
+    size = 0.
+    for ancestor in product.ancestors:
+        if os.path.exists(ancestor.filename):
+            size += _get_data_size(ancestor.filename,
+                                   product.attributes.get('short_name'))
+        elif isinstance(ancestor, PreprocessorFile):
+            # Output of an ancestor task that has not been run yet
+            size += _get_input_size(ancestor)
+    return size
+
+
+def _estimate_product_memory(product):
+    """Estimate the peak memory use in GB of preprocessing a product."""
+    copies = max(MEMORY_COPIES.get(step, 2) for step in product.settings)
+    return copies * _get_input_size(product)
+
+
+# Settings that only define where output is written
+_CACHE_IGNORED_SETTINGS = {
+    'cleanup': ('remove', ),
+    'download': ('dest_folder', ),
+    'fix_file': ('output_dir', ),
+    'mask_landsea': ('masks_dir', ),
+    'multi_model_statistics': ('output_products', ),
+    'regrid': ('weights_dir', ),
+    'save': ('filename', ),
+}
+
+
+def _get_cache_key(product, order):
+    """Get the key of a product in the cache of preprocessed files.
+
+    The key depends on the input files, the preprocessor settings and
+    order and the ESMValTool version. Returns None if an input is a product
+    that has no key.
+    """
+    inputs = []
+    for ancestor in product.ancestors:
+        if isinstance(ancestor, PreprocessorFile):
+            if ancestor.cache_key is None:
+                return None
+            inputs.append(ancestor.cache_key)
+        else:
+            inputs.append(ancestor.filename)
+    settings = {}
+    for step, step_settings in product.settings.items():
+        ignored = _CACHE_IGNORED_SETTINGS.get(step, ())
+        settings[step] = {
+            key: value
+            for key, value in step_settings.items() if key not in ignored
+        }
+    steps = [step for step in order if step in product.settings]
+    return get_key(__version__, steps, settings, sorted(inputs),
+                   product.precision)
+
+
+def _apply_single_model_steps(product, block, debug, close,
+                              realise_data=False):
+    """Apply a block of single model steps to a product.
+
+    With `realise_data`, the data is read into memory before the steps are
+    applied, so the steps do not read files while other threads do.
+    """
+    logger.debug("Applying single-model steps to %s", product)
+    if realise_data:
+        realise(product.cubes)
+    for step in block:
+        if step in product.settings:
+            product.apply(step, debug)
+    if close:
+        product.close()
+    return product
+
+
+def _close_realised(product):
+    """Close a product whose data was read into memory with :func:`realise`.
+
+    The data of the product does not depend on files anymore, so it is
+    computed before saving and only writing the file holds
+    :data:`IO_LOCK`.
+    """
+    for cube in product.cubes:
+        if cube.has_lazy_data():
+            cube.data = cube.data
+    product.close()
+    return product
+
+
+class _ProductWriter(object):
+    """Close products, saving them from a pool of writer threads.
+
+    Saving a product computes its data, compresses it and writes it to
+    disk. With more than one writer, this overlaps with loading and
+    preprocessing the next products. The netCDF library can not access
+    files from multiple threads, so the files are written one at a time
+    and the products must have been read into memory with :func:`realise`
+    before their steps were applied. At most `max_parallel_writes` products
+    wait to be saved at a time, so the memory used is bounded.
+    """
+
+    def __init__(self, max_parallel_writes=1):
+        self.n_writers = max_parallel_writes or multiprocessing.cpu_count()
+        self._pool = None
+        self._pending = []
+        if self.n_writers > 1:
+            self._pool = ThreadPool(processes=self.n_writers)
+
+    @property
+    def background(self):
+        """Check if products are saved from writer threads."""
+        return self._pool is not None
+
+    def close(self, product):
+        """Close a product, in the background if there are writers."""
+        if self._pool is None:
+            product.close()
+            return
+        while len(self._pending) >= self.n_writers:
+            self._pending.pop(0).get()
+        self._pending.append(
+            self._pool.apply_async(_close_realised, (product, )))
+
+    def wait(self):
+        """Wait until all products are saved.
+
+        Errors raised while saving are raised again here.
+        """
+        while self._pending:
+            self._pending.pop(0).get()
+
+    def terminate(self):
+        """Stop the writers."""
+        self._pending = []
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+
 # TODO: use a custom ProductSet that raises an exception if you try to
 # add the same Product twice
 
@@ -324,8 +521,16 @@ def _apply_multimodel(products, step, debug):
 
     logger.debug("Applying %s to\n%s", step, '\n'.join(
         str(p) for p in products - exclude))
+    dtypes = [
+        cube.dtype for product in products - exclude
+        for cube in product.cubes
+    ]
     result = preprocess(products - exclude, step, **settings)
     products = set(result) | exclude
+    for product in set(result):
+        if not product.is_closed:
+            check_precision(step, product.cubes, dtypes, product.precision,
+                            product.audit_precision)
 
     if debug:
         for product in products:
@@ -348,14 +553,54 @@ class PreprocessingTask(BaseTask):
             order=DEFAULT_ORDER,
             debug=None,
             write_ncl_interface=False,
+            resource_log=None,
+            max_parallel_products=1,
+            parallel_products_executor='process',
+            max_parallel_writes=1,
+            cache=None,
+            precision='native',
+            audit_precision=False,
     ):
         """Initialize"""
         super(PreprocessingTask, self).__init__(ancestors=ancestors, name=name)
         _check_multi_model_settings(products)
+        if parallel_products_executor not in ('process', 'thread'):
+            raise ValueError(
+                "Unknown parallel_products_executor '{}', choose from: "
+                "process, thread".format(parallel_products_executor))
+        if precision not in PRECISIONS:
+            raise ValueError(
+                "Unknown working precision '{}', choose from: {}".format(
+                    precision, ', '.join(PRECISIONS)))
         self.products = set(products)
         self.order = list(order)
         self.debug = debug
         self.write_ncl_interface = write_ncl_interface
+        self.resource_log = resource_log
+        self.max_parallel_products = max_parallel_products
+        self.parallel_products_executor = parallel_products_executor
+        self.max_parallel_writes = max_parallel_writes
+        self.cache = cache
+        for product in self.products | self._get_statistic_products():
+            product.precision = precision
+            product.audit_precision = audit_precision
+        if cache is not None:
+            for product in self.products:
+                product.cache_key = _get_cache_key(product, self.order)
+
+    def _get_statistic_products(self):
+        """Get the products created by multi model statistics."""
+        step = 'multi_model_statistics'
+        input_products = [p for p in self.products if step in p.settings]
+        if input_products:
+            return set(input_products[0].settings[step].get(
+                'output_products', {}).values())
+        return set()
+
+    def _has_multi_model_steps(self):
+        """Check if the products are combined by multi model steps."""
+        steps = {step for p in self.products for step in p.settings}
+        return bool(steps & MULTI_MODEL_FUNCTIONS)
 
     def _intialize_product_provenance(self):
         """Initialize product provenance."""
@@ -363,44 +608,201 @@ class PreprocessingTask(BaseTask):
             product.initialize_provenance(self.activity)
 
         # Hacky way to initialize the multi model products as well.
-        step = 'multi_model_statistics'
-        input_products = [p for p in self.products if step in p.settings]
-        if input_products:
-            statistic_products = input_products[0].settings[step].get(
-                'output_products', {}).values()
-            for product in statistic_products:
-                product.initialize_provenance(self.activity)
+        for product in self._get_statistic_products():
+            product.initialize_provenance(self.activity)
+
+    def _estimate_memory(self):
+        """Estimate the peak memory use in GB from the input data."""
+        if not self.products:
+            return 0.
+        memory = [_estimate_product_memory(p) for p in self.products]
+        if self._has_multi_model_steps():
+            # Multi model steps keep all products in memory
+            return sum(memory)
+        n_parallel = self.max_parallel_products or multiprocessing.cpu_count()
+        if n_parallel == 1 and self.max_parallel_writes != 1:
+            # Products that wait to be saved are kept in memory as well
+            n_parallel += (self.max_parallel_writes
+                           or multiprocessing.cpu_count())
+        return sum(sorted(memory, reverse=True)[:n_parallel])
 
     def _run(self, _):
+        """Run the preprocessor and log its resource usage."""
+        if self.resource_log is None:
+            return self._run_preprocessor()
+
+        log_dir = os.path.dirname(self.resource_log)
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        # Products processed in parallel processes use memory in the child
+        # processes of the task
+        children = (self.parallel_products_executor == 'process'
+                    and self.max_parallel_products != 1)
+        with resource_usage_logger(
+                os.getpid(), self.resource_log, children=children):
+            return self._run_preprocessor()
+
+    def _run_preprocessor(self):
         """Run the preprocessor."""
         self._intialize_product_provenance()
 
-        steps = {
-            step
-            for product in self.products for step in product.settings
-        }
-        blocks = get_step_blocks(steps, self.order)
-        for block in blocks:
-            logger.debug("Running block %s", block)
-            if block[0] in MULTI_MODEL_FUNCTIONS:
-                for step in block:
-                    self.products = _apply_multimodel(self.products, step,
-                                                      self.debug)
-            else:
-                for product in self.products:
-                    logger.debug("Applying single-model steps to %s", product)
-                    for step in block:
-                        if step in product.settings:
-                            product.apply(step, self.debug)
-                    if block == blocks[-1]:
-                        product.close()
+        cached = set()
+        if self.cache is not None:
+            cached = self._restore_from_cache()
+        products = self._preprocess(self.products - cached)
+        if self.cache is not None:
+            self._store_in_cache(products)
+        self.products = cached | products
 
-        for product in self.products:
-            product.close()
         metadata_files = write_metadata(self.products,
                                         self.write_ncl_interface)
         return metadata_files
 
+    def _preprocess(self, products):
+        """Apply the preprocessor steps to products and save them."""
+        if not products:
+            return products
+
+        steps = {step for product in products for step in product.settings}
+        blocks = get_step_blocks(steps, self.order)
+        writer = _ProductWriter(self.max_parallel_writes)
+        try:
+            for block in blocks:
+                logger.debug("Running block %s", block)
+                if block[0] in MULTI_MODEL_FUNCTIONS:
+                    for step in block:
+                        products = _apply_multimodel(products, step,
+                                                     self.debug)
+                else:
+                    self._apply_single_model_block(
+                        products, block, writer, close=block == blocks[-1])
+            writer.wait()
+        finally:
+            writer.terminate()
+
+        for product in products:
+            product.close()
+        return products
+
+    def _get_task_cache_key(self):
+        """Get the key of all products together in the cache."""
+        keys = [p.cache_key for p in self.products]
+        if None in keys:
+            return None
+        names = [os.path.basename(p.filename) for p in self.products]
+        return get_key(sorted(zip(names, keys)))
+
+    def _restore_from_cache(self):
+        """Restore the products that are available in the cache.
+
+        Products that are combined by multi model steps depend on each
+        other, so they are stored in and restored from the cache together.
+        """
+        cached = set()
+        if self._has_multi_model_steps():
+            key = self._get_task_cache_key()
+            products = self.products | self._get_statistic_products()
+            targets = {os.path.basename(p.filename): p for p in products}
+            restored = None
+            if key is not None:
+                restored = self.cache.restore(
+                    key, {name: p.filename for name, p in targets.items()})
+            if restored is not None:
+                cached = {targets[os.path.basename(f)] for f in restored}
+            step = 'multi_model_statistics'
+            for product in cached - self.products:
+                for input_product in self.products:
+                    if step in input_product.settings:
+                        product.wasderivedfrom(input_product)
+        else:
+            for product in self.products:
+                if product.cache_key is None:
+                    continue
+                restored = self.cache.restore(
+                    product.cache_key,
+                    {os.path.basename(product.filename): product.filename})
+                if restored is not None:
+                    cached.add(product)
+
+        for product in cached:
+            product.files = [product.filename]
+        if cached:
+            logger.info("Restored %s files of task %s from cache %s",
+                        len(cached), self.name, self.cache.cache_dir)
+        return cached
+
+    def _store_in_cache(self, products):
+        """Store preprocessed products in the cache."""
+        if not products:
+            return
+        if self._has_multi_model_steps():
+            key = self._get_task_cache_key()
+            if key is not None:
+                self.cache.store(key, [p.filename for p in products])
+        else:
+            for product in products:
+                if product.cache_key is not None:
+                    self.cache.store(product.cache_key, [product.filename])
+
+    def _apply_single_model_block(self, products, block, writer, close):
+        """Apply a block of single model steps to products.
+
+        The products are processed in parallel if `max_parallel_products`
+        is not 1, using threads or processes depending on
+        `parallel_products_executor`. Threads read the data of a product
+        into memory before applying the steps and read and write files one
+        at a time, so only the computations run in parallel. Otherwise the
+        products are processed one at a time and closed by `writer`. If it
+        saves them in the background, their data is read into memory first
+        as well.
+        """
+        products = list(products)
+        n_workers = min(self.max_parallel_products
+                        or multiprocessing.cpu_count(), len(products))
+        executor = self.parallel_products_executor
+        if (n_workers > 1 and executor == 'process'
+                and multiprocessing.current_process().daemon):
+            logger.debug(
+                "Unable to start processes from task %s because it is run "
+                "in a parallel process, processing products sequentially",
+                self.name)
+            n_workers = 1
+
+        if n_workers <= 1:
+            background = close and writer.background
+            for product in products:
+                _apply_single_model_steps(
+                    product,
+                    block,
+                    self.debug,
+                    close=False,
+                    realise_data=background)
+                if close:
+                    writer.close(product)
+            return
+
+        function = partial(
+            _apply_single_model_steps,
+            block=block,
+            debug=self.debug,
+            close=close,
+            realise_data=executor == 'thread')
+        if executor == 'thread':
+            pool = ThreadPool(processes=n_workers)
+        else:
+            pool = multiprocessing.Pool(processes=n_workers)
+        try:
+            results = pool.map(function, products, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        if executor == 'process':
+            for product, result in zip(products, results):
+                # Copy the result back from the worker process
+                product.cubes = None if result.is_closed else result.cubes
+                product.files = result.files
+
     def __str__(self):
         """Get human readable description."""
         order = [
@@ -9,6 +9,8 @@ import logging
 import iris
 import numpy as np
 
+from ._fx import get_fx_weights, load_fx_cube
+from ._weighting import expand_weights, weighted_mean
 
 logger = logging.getLogger(__name__)
 
@@ -153,20 +155,12 @@ def area_average(cube, coord1, coord2, fx_files=None):
             if fx_file is None:
                 continue
             logger.info('Attempting to load %s from file: %s', key, fx_file)
-            fx_cube = iris.load_cube(fx_file)
-
-            grid_areas = fx_cube.data
+            grid_areas = load_fx_cube(fx_file).data
             grid_areas_found = True
-            cube_shape = cube.data.shape
-            if cube.data.ndim == 4 and grid_areas.ndim == 2:
-                grid_areas = np.tile(grid_areas,
-                                     [cube_shape[0], cube_shape[1], 1, 1])
-            elif cube.data.ndim == 4 and grid_areas.ndim == 3:
-                grid_areas = np.tile(grid_areas,
-                                     [cube_shape[0], 1, 1, 1])
-            elif cube.data.ndim == 3 and grid_areas.ndim == 2:
-                grid_areas = np.tile(grid_areas,
-                                     [cube_shape[0], 1, 1])
+            if cube.ndim > grid_areas.ndim:
+                # Masked areas do not contribute to the average, use a
+                # read-only view to avoid storing copies of the areas
+                grid_areas = get_fx_weights(fx_file, cube.shape)
 
     if not fx_files and cube.coord('latitude').points.ndim == 2:
         logger.error('area_average ERROR: fx_file needed to calculate grid'
@@ -175,17 +169,20 @@ def area_average(cube, coord1, coord2, fx_files=None):
 
     if not grid_areas_found:
         cube = _guess_bounds(cube, [coord1, coord2])
-        grid_areas = iris.analysis.cartography.area_weights(cube)
+        # Only compute the areas of a single horizontal slice
+        horizontal = next(cube.slices([coord1, coord2], ordered=False))
+        grid_areas = expand_weights(
+            iris.analysis.cartography.area_weights(horizontal),
+            cube.coord_dims(coord1) + cube.coord_dims(coord2), cube.ndim)
         logger.info('Calculated grid area:{}'.format(grid_areas.shape))
 
-    if cube.data.shape != grid_areas.shape:
-
+    if grid_areas.ndim != cube.ndim or any(
+            area_len not in (1, cube_len)
+            for area_len, cube_len in zip(grid_areas.shape, cube.shape)):
         raise ValueError('Cube shape ({}) doesn`t match grid area shape '
-                         '({})'.format(cube.data.shape, grid_areas.shape))
+                         '({})'.format(cube.shape, grid_areas.shape))
 
-    result = cube.collapsed([coord1, coord2],
-                            iris.analysis.MEAN,
-                            weights=grid_areas)
+    result = weighted_mean(cube, [coord1, coord2], grid_areas)
     return result
 
 
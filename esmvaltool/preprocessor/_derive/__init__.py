@@ -6,6 +6,7 @@ import os
 
 import iris
 
+from .._fx import load_fx_cube
 from ._derived_variable_base import DerivedVariableBase
 
 logger = logging.getLogger(__name__)
@@ -73,7 +74,7 @@ def derive(cubes, short_name, standard_name, long_name, units, fx_files=None):
     if fx_files:
         for (fx_var, fx_path) in fx_files.items():
             if fx_path is not None:
-                cubes.append(iris.load_cube(fx_path))
+                cubes.append(load_fx_cube(fx_path))
             else:
                 logger.debug(
                     "Requested fx variable '%s' for derivation of "
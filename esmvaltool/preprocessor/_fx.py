@@ -0,0 +1,158 @@
+"""Shared access to the fx variables of datasets.
+
+The same fx files (e.g. sftlf, sftof, areacello or volcello) are used by the
+preprocessor functions of many products. They are loaded from disk only once
+per process and the cubes handed out share their read-only data. Arrays
+derived from the fx data, like land-sea masks and cell weights, are also
+computed once and can be broadcast to the shape of the data without copying.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+import iris
+import numpy as np
+
+from ._io import IO_LOCK
+
+logger = logging.getLogger(__name__)
+
+# Maximum size in bytes of the fx data and derived arrays kept in memory
+MAX_CACHED_FX_SIZE = 2**30
+
+# Fx cubes and derived arrays by key, least recently used first
+_FX_CACHE = OrderedDict()
+
+_FX_LOCK = threading.RLock()
+
+
+def _set_read_only(array):
+    """Make an array, including its mask, read-only."""
+    array.flags.writeable = False
+    mask = np.ma.getmask(array)
+    if mask is not np.ma.nomask:
+        mask.flags.writeable = False
+    return array
+
+
+def _nbytes(item):
+    """Get the number of bytes of the arrays in a cached item."""
+    if isinstance(item, iris.cube.Cube):
+        item = item.data
+    size = item.nbytes
+    mask = np.ma.getmask(item)
+    if mask is not np.ma.nomask:
+        size += mask.nbytes
+    return size
+
+
+def _cached(key, function):
+    """Get an item from the cache, computing it with `function` if needed."""
+    with _FX_LOCK:
+        if key in _FX_CACHE:
+            item = _FX_CACHE.pop(key)
+            _FX_CACHE[key] = item
+            return item
+
+        item = function()
+        _FX_CACHE[key] = item
+        size = 0
+        for cached_key in reversed(list(_FX_CACHE)):
+            size += _nbytes(_FX_CACHE[cached_key])
+            if size > MAX_CACHED_FX_SIZE and cached_key != key:
+                del _FX_CACHE[cached_key]
+        return item
+
+
+def _load(filename):
+    """Load an fx file and realise its data as a read-only array."""
+    logger.debug("Loading fx file %s", filename)
+    with IO_LOCK:
+        cube = iris.load_cube(filename)
+        _set_read_only(cube.data)
+    return cube
+
+
+def load_fx_cube(filename):
+    """Load the cube in an fx file.
+
+    The file is read only once, the data of the returned cube is a read-only
+    array that is shared with all other cubes loaded from the same file.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the fx file.
+
+    Returns
+    -------
+    iris.cube.Cube
+        The fx cube.
+
+    """
+    cube = _cached((filename, ), lambda: _load(filename))
+    return cube.copy(data=cube.data)
+
+
+def get_fx_array(filename, function, *args):
+    """Get an array computed from the data in an fx file.
+
+    The array is computed only once for each combination of `filename`,
+    `function` and `args` and returned read-only.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the fx file.
+    function: callable
+        Function that takes the fx data and `args` and returns an array.
+    *args:
+        Further (hashable) arguments to `function`.
+
+    Returns
+    -------
+    numpy.ndarray
+        The computed array.
+
+    """
+    key = (filename, function.__module__, function.__name__) + args
+
+    def compute():
+        fx_data = load_fx_cube(filename).data
+        return _set_read_only(function(fx_data, *args))
+
+    return _cached(key, compute)
+
+
+def _get_weights(fx_data):
+    """Get cell weights with zero weight for masked cells."""
+    return np.ma.filled(fx_data, 0.)
+
+
+def get_fx_weights(filename, shape):
+    """Get cell areas or volumes from an fx file as weights.
+
+    Masked cells get zero weight. The weights are broadcast to `shape` as a
+    read-only view, so they are not copied for every time step.
+
+    Parameters
+    ----------
+    filename: str
+        Path to the fx file.
+    shape: tuple of int
+        Shape of the data to be weighted, the trailing dimensions should
+        match the fx data.
+
+    Returns
+    -------
+    numpy.ndarray
+        The weights.
+
+    """
+    return np.broadcast_to(get_fx_array(filename, _get_weights), shape)
+
+
+def clear_fx_cache():
+    """Remove all fx data from memory."""
+    with _FX_LOCK:
+        _FX_CACHE.clear()
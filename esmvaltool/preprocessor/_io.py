@@ -1,14 +1,18 @@
 """Functions for loading and saving cubes."""
 import copy
+import datetime
 import logging
 import os
 import shutil
+import threading
 from collections import OrderedDict
 from itertools import groupby
 
+import dask.array as da
 import numpy as np
 import iris
 import iris.exceptions
+import six
 import yaml
 
 from .._config import use_legacy_iris
@@ -18,6 +22,13 @@ logger = logging.getLogger(__name__)
 
 GLOBAL_FILL_VALUE = 1e+20
 
+# The netCDF library can not access files from multiple threads at once, all
+# reading and writing of netCDF files in the preprocessor holds this lock
+IO_LOCK = threading.RLock()
+
+# Target size in bytes of the chunks of saved NetCDF files
+CHUNK_SIZE = 2**20
+
 DATASET_KEYS = {
     'mip',
 }
@@ -51,35 +62,304 @@ def concatenate_callback(raw_cube, field, _):
                 coord.units = units
 
 
-def load(file, callback=None):
-    """Load iris cubes from files."""
+def _get_overlap(coord, lower, upper):
+    """Get the cells of a coordinate that overlap with [lower, upper]."""
+    if coord.has_bounds():
+        return ((coord.bounds.max(axis=-1) >= lower) &
+                (coord.bounds.min(axis=-1) <= upper))
+    return (coord.points >= lower) & (coord.points <= upper)
+
+
+def _select_period(time, time_range):
+    """Select the time steps that overlap with a period."""
+    if not time.units.is_time_reference():
+        return None
+    start_day = time_range.get('start_day', 1)
+    end_day = time_range.get('end_day', 1)
+    if time.units.calendar == '360_day':
+        start_day = min(start_day, 30)
+        end_day = min(end_day, 30)
+    start = time.units.date2num(
+        datetime.datetime(
+            int(time_range['start_year']),
+            int(time_range.get('start_month', 1)), int(start_day)))
+    end = time.units.date2num(
+        datetime.datetime(
+            int(time_range['end_year']), int(time_range.get('end_month', 1)),
+            int(end_day)))
+    # Time steps that end at the start of the period are not in it
+    if time.has_bounds():
+        return ((time.bounds.max(axis=-1) > start) &
+                (time.bounds.min(axis=-1) < end))
+    return (time.points > start) & (time.points < end)
+
+
+def _select_latitudes(latitude, region):
+    """Select the latitudes that overlap with a region."""
+    return _get_overlap(
+        latitude,
+        min(float(region['start_latitude']), float(region['end_latitude'])),
+        max(float(region['start_latitude']), float(region['end_latitude'])))
+
+
+def _select_longitudes(longitude, region):
+    """Select the longitudes in a region, taking the modulus into account."""
+    modulus = longitude.units.modulus
+    if not modulus:
+        return None
+    start = float(region['start_longitude'])
+    width = float(region['end_longitude']) - start
+    if width >= modulus:
+        return None
+    return (longitude.points - start) % modulus <= width % modulus
+
+
+def _select_depths(depth, depth_range):
+    """Select the levels that overlap with a depth range."""
+    return _get_overlap(
+        depth,
+        min(float(depth_range['z_min']), float(depth_range['z_max'])),
+        max(float(depth_range['z_min']), float(depth_range['z_max'])))
+
+
+def _get_index_range(selected):
+    """Get the slice that covers the selected indices.
+
+    One extra index is kept on either side, so fixes that shift the
+    coordinate points a bit still have all the selected data available.
+    Returns None if the slice covers all or none of the indices.
+    """
+    index = np.flatnonzero(selected)
+    if not index.size:
+        return None
+    first = max(index[0] - 1, 0)
+    last = min(index[-1] + 2, len(selected))
+    if first == 0 and last == len(selected):
+        return None
+    return slice(first, last)
+
+
+def _get_read_index(cube, time_range=None, region=None, depth_range=None):
+    """Get the index of the part of a cube that will be used.
+
+    Only one dimensional dimension coordinates are used to select the
+    data. Returns None if all data is needed.
+    """
+    selections = []
+    if time_range is not None:
+        selections.append(('time', _select_period, time_range))
+    if region is not None:
+        selections.append(('latitude', _select_latitudes, region))
+        selections.append(('longitude', _select_longitudes, region))
+    if depth_range is not None:
+        selections.append(('depth', _select_depths, depth_range))
+
+    index = [slice(None)] * cube.ndim
+    for name, select, settings in selections:
+        if not cube.coords(name, dim_coords=True):
+            continue
+        coord = cube.coord(name, dim_coords=True)
+        selected = select(coord, settings)
+        if selected is None:
+            continue
+        dim_index = _get_index_range(selected)
+        if dim_index is not None:
+            dim, = cube.coord_dims(coord)
+            index[dim] = dim_index
+    if all(dim_index == slice(None) for dim_index in index):
+        return None
+    return tuple(index)
+
+
+def load(file, callback=None, time_range=None, region=None,
+         depth_range=None):
+    """Load iris cubes from files.
+
+    The time, region and depth ranges are used to subset the cubes before
+    their data is read, so only that part of the file is read. They still
+    need to be extracted after fixing the data.
+
+    Parameters
+    ----------
+    file: str
+        File to load.
+    callback: callable, optional
+        Callback function passed to :func:`iris.load_raw`.
+    time_range: dict, optional
+        Period to read, with the keywords `start_year`, `start_month`,
+        `start_day`, `end_year`, `end_month` and `end_day` of
+        :func:`esmvaltool.preprocessor.extract_time`.
+    region: dict, optional
+        Region to read, with the keywords `start_longitude`,
+        `end_longitude`, `start_latitude` and `end_latitude` of
+        :func:`esmvaltool.preprocessor.extract_region`. Only used for
+        grids with one dimensional latitudes and longitudes.
+    depth_range: dict, optional
+        Depths to read, with the keywords `z_min` and `z_max` of
+        :func:`esmvaltool.preprocessor.extract_volume`.
+
+    Returns
+    -------
+    iris.cube.CubeList
+        The raw cubes in the file.
+
+    """
     logger.debug("Loading:\n%s", file)
-    raw_cubes = iris.load_raw(file, callback=callback)
+    with IO_LOCK:
+        raw_cubes = iris.load_raw(file, callback=callback)
     if not raw_cubes:
         raise Exception('Can not load cubes from {0}'.format(file))
-    for cube in raw_cubes:
+    for i, cube in enumerate(raw_cubes):
+        index = _get_read_index(cube, time_range, region, depth_range)
+        if index is not None:
+            cube = cube[index]
+            logger.debug("Reading %s of %s from %s", cube.shape,
+                         raw_cubes[i].shape, file)
+            raw_cubes[i] = cube
         cube.attributes['source_file'] = file
     return raw_cubes
 
 
+def _attributes_equal(value, other):
+    """Compare attribute values, strings are compared directly."""
+    if (isinstance(value, six.string_types)
+            and isinstance(other, six.string_types)):
+        return value == other
+    return np.array_equal(value, other)
+
+
 def _fix_cube_attributes(cubes):
-    """Unify attributes of different cubes to allow concatenation."""
-    attributes = {}
+    """Unify attributes of different cubes to allow concatenation.
+
+    Values of an attribute that differ from the value of the first cube
+    are joined with semicolons, starting from the first differing value.
+    """
+    values = OrderedDict()
     for cube in cubes:
         for (attr, val) in cube.attributes.items():
-            if attr not in attributes:
-                attributes[attr] = val
-            else:
-                if not np.array_equal(val, attributes[attr]):
-                    attributes[attr] = '{};{}'.format(
-                        str(attributes[attr]), str(val))
+            values.setdefault(attr, []).append(val)
+    attributes = {}
+    for attr, vals in values.items():
+        first = vals[0]
+        differing = next((i for i, val in enumerate(vals)
+                          if not _attributes_equal(val, first)), None)
+        if differing is None:
+            attributes[attr] = first
+        else:
+            attributes[attr] = ';'.join(
+                str(val) for val in [first] + vals[differing:])
     for cube in cubes:
         cube.attributes = attributes
 
 
+def _concatenate_coords(coords):
+    """Concatenate the points and bounds of coordinates along their dim."""
+    points = np.concatenate([coord.points for coord in coords])
+    bounds = None
+    if coords[0].has_bounds():
+        bounds = np.concatenate([coord.bounds for coord in coords])
+    return coords[0].copy(points=points, bounds=bounds)
+
+
+def _coords_compatible(cube, other, time_dim):
+    """Check that the coordinates of two cubes allow concatenation.
+
+    Coordinates along the time dimension need the same metadata, the other
+    coordinates need to be equal.
+    """
+    for coords, other_coords in ((cube.dim_coords, other.dim_coords),
+                                 (cube.aux_coords, other.aux_coords)):
+        if len(coords) != len(other_coords):
+            return False
+        for coord, other_coord in zip(coords, other_coords):
+            dims = cube.coord_dims(coord)
+            if dims != other.coord_dims(other_coord):
+                return False
+            if time_dim in dims:
+                # Points are concatenated along their first dimension
+                if (dims[0] != time_dim
+                        or coord.metadata != other_coord.metadata
+                        or coord.has_bounds() != other_coord.has_bounds()):
+                    return False
+            elif coord is not other_coord and coord != other_coord:
+                return False
+    return True
+
+
+def _cube_metadata_equal(cube, other):
+    """Compare the metadata of cubes that have the same attributes."""
+    return (cube.standard_name == other.standard_name
+            and cube.long_name == other.long_name
+            and cube.var_name == other.var_name
+            and cube.units == other.units
+            and cube.cell_methods == other.cell_methods)
+
+
+def _concatenate_along_time(cubes):
+    """Concatenate cubes along time without comparing all pairs of cubes.
+
+    The cubes are sorted by time and only neighbouring cubes are checked
+    for compatibility. The data is concatenated lazily. Returns None if the
+    cubes cannot be concatenated this way.
+    """
+    if not all(cube.coords('time', dim_coords=True) for cube in cubes):
+        return None
+    cubes = sorted(
+        cubes, key=lambda cube: cube.coord('time', dim_coords=True).points[0])
+    times = [cube.coord('time', dim_coords=True) for cube in cubes]
+    time_dim, = cubes[0].coord_dims(times[0])
+    for cube, time in zip(cubes, times):
+        # Derived coordinates, cell measures and ancillary variables are
+        # left to iris
+        if (cube.aux_factories or cube.cell_measures()
+                or getattr(cube, 'ancillary_variables', list)()
+                or cube.coord_dims(time) != (time_dim, )
+                or time.points[0] > time.points[-1]):
+            return None
+    first = cubes[0]
+    for i in range(1, len(cubes)):
+        cube, other = cubes[i - 1], cubes[i]
+        if (not _cube_metadata_equal(cube, other)
+                or cube.dtype != other.dtype
+                or cube.ndim != other.ndim
+                or any(cube.shape[dim] != other.shape[dim]
+                       for dim in range(cube.ndim) if dim != time_dim)
+                or times[i - 1].points[-1] >= times[i].points[0]
+                or not _coords_compatible(cube, other, time_dim)):
+            return None
+
+    data = da.concatenate([cube.lazy_data() for cube in cubes],
+                          axis=time_dim)
+    result = iris.cube.Cube(data)
+    result.metadata = first.metadata
+    for i, coord in enumerate(first.dim_coords):
+        dims = first.coord_dims(coord)
+        if time_dim in dims:
+            coord = _concatenate_coords([cube.dim_coords[i] for cube in cubes])
+        else:
+            coord = coord.copy()
+        result.add_dim_coord(coord, dims)
+    for i, coord in enumerate(first.aux_coords):
+        dims = first.coord_dims(coord)
+        if time_dim in dims:
+            coord = _concatenate_coords([cube.aux_coords[i] for cube in cubes])
+        else:
+            coord = coord.copy()
+        result.add_aux_coord(coord, dims)
+    return result
+
+
 def concatenate(cubes):
-    """Concatenate all cubes after fixing metadata."""
+    """Concatenate all cubes after fixing metadata.
+
+    Cubes with a time dimension that follow each other in time are
+    concatenated lazily, other cubes are concatenated by
+    :meth:`iris.cube.CubeList.concatenate_cube`.
+    """
     _fix_cube_attributes(cubes)
+    cube = _concatenate_along_time(cubes)
+    if cube is not None:
+        return cube
     try:
         cube = iris.cube.CubeList(cubes).concatenate_cube()
         return cube
@@ -91,7 +371,69 @@ def concatenate(cubes):
         raise ex
 
 
-def save(cubes, filename, optimize_access='', compress=False, **kwargs):
+def _get_access_dims(cube, optimize_access):
+    """Get the data dimensions that are read at once."""
+    if optimize_access == 'map':
+        dims = cube.coord_dims('latitude') + cube.coord_dims('longitude')
+    elif optimize_access == 'timeseries':
+        dims = cube.coord_dims('time')
+    else:
+        dims = tuple()
+        for dimension in optimize_access.split(' '):
+            dims += cube.coord_dims(dimension)
+    return set(dims)
+
+
+def get_chunksizes(cube, optimize_access='', chunk_size=None):
+    """Get the NetCDF chunk shape for saving a cube.
+
+    Chunks span the whole length of the dimensions in the access pattern,
+    so reading e.g. one map or time series at a time reads whole chunks.
+    The other dimensions, starting with the last one, are added to the
+    chunks as long as they stay below the target size, so small maps or
+    time series are not stored in many tiny chunks.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Cube to be saved.
+    optimize_access: str
+        Access pattern, see :func:`save`. If empty, chunks contain as many
+        whole rows of the data as fit in the target size.
+    chunk_size: int, optional
+        Target size of the chunks in bytes, :data:`CHUNK_SIZE` by default.
+
+    Returns
+    -------
+    tuple of int
+        The length of the chunks along each dimension.
+
+    """
+    if chunk_size is None:
+        chunk_size = CHUNK_SIZE
+    dims = _get_access_dims(cube, optimize_access) if optimize_access else ()
+    chunks = [length if dim in dims else 1
+              for dim, length in enumerate(cube.shape)]
+    size = cube.dtype.itemsize * int(np.prod(chunks))
+    for dim in reversed(range(cube.ndim)):
+        if dim in dims:
+            continue
+        length = max(1, min(cube.shape[dim], chunk_size // size))
+        chunks[dim] = length
+        size *= length
+        if length < cube.shape[dim]:
+            break
+    return tuple(chunks)
+
+
+def save(cubes,
+         filename,
+         optimize_access='',
+         compress=False,
+         complevel=4,
+         shuffle=True,
+         chunk_size=None,
+         **kwargs):
     """
     Save iris cubes to file.
 
@@ -110,11 +452,23 @@ def save(cubes, filename, optimize_access='', compress=False, **kwargs):
         reading the file one map or time series at a time.
         Users can also provide a coordinate or a list of coordinates. In that
         case the better performance will be avhieved by loading all the values
-        in that coordinate at a time
+        in that coordinate at a time. The chunk shape is computed with
+        :func:`get_chunksizes`.
 
     compress: bool, optional
         Use NetCDF internal compression.
 
+    complevel: int, optional
+        Compression level from 1 (fastest) to 9 (smallest files).
+
+    shuffle: bool, optional
+        Use the shuffle filter before compressing, which usually improves
+        the compression of floating point data.
+
+    chunk_size: int, optional
+        Target size of the NetCDF chunks in bytes, see
+        :func:`get_chunksizes`.
+
     Returns
     -------
     str
@@ -124,6 +478,9 @@ def save(cubes, filename, optimize_access='', compress=False, **kwargs):
     # Rename some arguments
     kwargs['target'] = filename
     kwargs['zlib'] = compress
+    if compress:
+        kwargs['complevel'] = complevel
+        kwargs['shuffle'] = shuffle
 
     dirname = os.path.dirname(filename)
     if not os.path.exists(dirname):
@@ -137,32 +494,55 @@ def save(cubes, filename, optimize_access='', compress=False, **kwargs):
         return filename
 
     logger.debug("Saving cubes %s to %s", cubes, filename)
-    if optimize_access:
-        cube = cubes[0]
-        if optimize_access == 'map':
-            dims = set(
-                cube.coord_dims('latitude') + cube.coord_dims('longitude'))
-        elif optimize_access == 'timeseries':
-            dims = set(cube.coord_dims('time'))
-        else:
-            dims = tuple()
-            for coord_dims in (cube.coord_dims(dimension)
-                               for dimension in optimize_access.split(' ')):
-                dims += coord_dims
-            dims = set(dims)
-
-        kwargs['chunksizes'] = tuple(
-            length if index in dims else 1
-            for index, length in enumerate(cube.shape))
+    # Compressed data is always chunked, choose the chunks instead of
+    # leaving it to the NetCDF library if they fit all cubes
+    chunked = optimize_access or (compress and len(
+        set(cube.shape for cube in cubes)) == 1)
+    if chunked and cubes[0].ndim:
+        chunksizes = get_chunksizes(cubes[0], optimize_access, chunk_size)
+        kwargs['chunksizes'] = chunksizes
+        # Lazy data is written one dask chunk at a time, align those with
+        # the NetCDF chunks so every compressed chunk is written only once
+        cubes = [
+            cube.copy(cube.lazy_data().rechunk(chunksizes))
+            if cube.has_lazy_data() and cube.shape == cubes[0].shape else cube
+            for cube in cubes
+        ]
 
     if not use_legacy_iris():
         kwargs['fill_value'] = GLOBAL_FILL_VALUE
 
-    iris.save(cubes, **kwargs)
+    with IO_LOCK:
+        iris.save(cubes, **kwargs)
 
     return filename
 
 
+def realise(cubes):
+    """Read the lazy data of cubes into memory.
+
+    The data is read while holding :data:`IO_LOCK`, so the cubes can be
+    processed in a thread without accessing files concurrently with other
+    threads.
+
+    Parameters
+    ----------
+    cubes: iterable of iris.cube.Cube
+        The cubes.
+
+    Returns
+    -------
+    iterable of iris.cube.Cube
+        The cubes.
+
+    """
+    with IO_LOCK:
+        for cube in cubes:
+            if cube.has_lazy_data():
+                cube.data = cube.data
+    return cubes
+
+
 def _get_debug_filename(filename, step):
     """Get a filename for debugging the preprocessor."""
     dirname = os.path.splitext(filename)[0]
@@ -7,18 +7,36 @@ and geographical area eslection
 
 from __future__ import print_function
 
+import hashlib
 import logging
 import os
+import tempfile
 
 import cartopy.io.shapereader as shpreader
-import iris
+import dask.array as da
 import numpy as np
+import shapely.geometry
 import shapely.vectorized as shp_vect
 from iris.analysis import Aggregator
 from iris.util import rolling_window
+from shapely.prepared import prep
+
+from ._fx import get_fx_array, load_fx_cube
 
 logger = logging.getLogger(__name__)
 
+# Size in degrees of the tiles used to rasterise Natural Earth geometries
+_TILE_SIZE = 10.
+
+# Natural Earth geometries by shapefile
+_GEOMETRIES = {}
+
+# Rasterised Natural Earth masks by shapefile and grid
+_SHP_MASKS = {}
+
+# Size in bytes of the chunks of data used to compute the fillvalues mask
+_CHUNK_SIZE = 2**26
+
 
 def _check_dims(cube, mask_cube):
     """Check for same dims for mask and data"""
@@ -70,11 +88,22 @@ def _get_fx_mask(fx_data, fx_option, mask_type):
     return inmask
 
 
+def _get_ma(cube):
+    """Get the masked array module that can handle the cube data."""
+    return da.ma if cube.has_lazy_data() else np.ma
+
+
 def _apply_fx_mask(fx_mask, var_data):
     """Apply the fx mask"""
+    if isinstance(var_data, da.Array):
+        # Keep lazy data lazy
+        var_mask = da.broadcast_to(
+            fx_mask, var_data.shape, chunks=var_data.chunks)
+        var_mask = var_mask | da.ma.getmaskarray(var_data)
+        return da.ma.masked_array(var_data, mask=var_mask, fill_value=1e+20)
+
     # Broadcast mask
-    var_mask = np.zeros_like(var_data, bool)
-    var_mask = np.broadcast_to(fx_mask, var_mask.shape).copy()
+    var_mask = np.broadcast_to(fx_mask, var_data.shape).copy()
 
     # Aplly mask accross
     if np.ma.is_masked(var_data):
@@ -86,7 +115,7 @@ def _apply_fx_mask(fx_mask, var_data):
     return var_data
 
 
-def mask_landsea(cube, fx_files, mask_out):
+def mask_landsea(cube, fx_files, mask_out, masks_dir=None):
     """
     Mask out either land or sea
 
@@ -109,6 +138,10 @@ def mask_landsea(cube, fx_files, mask_out):
     * mask_out (string):
         either "land" to mask out land mass or "sea" to mask out seas.
 
+    * masks_dir (string):
+        directory where the Natural Earth masks are stored, so they can be
+        reused for other cubes on the same grid.
+
     Returns
     -------
     masked iris cube
@@ -124,26 +157,29 @@ def mask_landsea(cube, fx_files, mask_out):
 
     if fx_files:
         fx_cubes = {}
+        fx_paths = {}
         for fx_file in fx_files:
             fx_root = os.path.basename(fx_file).split('_')[0]
-            fx_cubes[fx_root] = iris.load_cube(fx_file)
+            fx_cubes[fx_root] = load_fx_cube(fx_file)
+            fx_paths[fx_root] = fx_file
 
         # preserve importance order: try stflf first then sftof
         if ('sftlf' in fx_cubes.keys()
                 and _check_dims(cube, fx_cubes['sftlf'])):
-            landsea_mask = _get_fx_mask(fx_cubes['sftlf'].data, mask_out,
-                                        'sftlf')
-            cube.data = _apply_fx_mask(landsea_mask, cube.data)
+            landsea_mask = get_fx_array(fx_paths['sftlf'], _get_fx_mask,
+                                        mask_out, 'sftlf')
+            cube.data = _apply_fx_mask(landsea_mask, cube.core_data())
             logger.debug("Applying land-sea mask: sftlf")
         elif ('sftof' in fx_cubes.keys()
               and _check_dims(cube, fx_cubes['sftof'])):
-            landsea_mask = _get_fx_mask(fx_cubes['sftof'].data, mask_out,
-                                        'sftof')
-            cube.data = _apply_fx_mask(landsea_mask, cube.data)
+            landsea_mask = get_fx_array(fx_paths['sftof'], _get_fx_mask,
+                                        mask_out, 'sftof')
+            cube.data = _apply_fx_mask(landsea_mask, cube.core_data())
             logger.debug("Applying land-sea mask: sftof")
         else:
             if cube.coord('longitude').points.ndim < 2:
-                cube = _mask_with_shp(cube, shapefiles[mask_out])
+                cube = _mask_with_shp(cube, shapefiles[mask_out],
+                                      masks_dir)
                 logger.debug(
                     "Applying land-sea mask from Natural Earth"
                     " shapefile: \n%s", shapefiles[mask_out])
@@ -152,7 +188,7 @@ def mask_landsea(cube, fx_files, mask_out):
                              "yet implemented, land-sea mask not applied")
     else:
         if cube.coord('longitude').points.ndim < 2:
-            cube = _mask_with_shp(cube, shapefiles[mask_out])
+            cube = _mask_with_shp(cube, shapefiles[mask_out], masks_dir)
             logger.debug(
                 "Applying land-sea mask from Natural Earth"
                 " shapefile: \n%s", shapefiles[mask_out])
@@ -190,12 +226,12 @@ def mask_landseaice(cube, fx_files, mask_out):
     # sftgif is the only one so far
     if fx_files:
         for fx_file in fx_files:
-            fx_cube = iris.load_cube(fx_file)
+            fx_cube = load_fx_cube(fx_file)
 
             if _check_dims(cube, fx_cube):
-                landice_mask = _get_fx_mask(fx_cube.data, mask_out,
+                landice_mask = get_fx_array(fx_file, _get_fx_mask, mask_out,
                                             'sftgif')
-                cube.data = _apply_fx_mask(landice_mask, cube.data)
+                cube.data = _apply_fx_mask(landice_mask, cube.core_data())
                 logger.debug("Applying landsea-ice mask: sftgif")
     else:
         logger.warning("Landsea-ice mask could not be found ")
@@ -205,25 +241,88 @@ def mask_landseaice(cube, fx_files, mask_out):
 
 def _get_geometry_from_shp(shapefilename):
     """Get the mask geometry out from a shapefile"""
-    reader = shpreader.Reader(shapefilename)
-    # Index 0 grabs the lowest resolution mask (no zoom)
-    main_geom = [contour for contour in reader.geometries()][0]
-    return main_geom
+    if shapefilename not in _GEOMETRIES:
+        reader = shpreader.Reader(shapefilename)
+        # Index 0 grabs the lowest resolution mask (no zoom)
+        main_geom = [contour for contour in reader.geometries()][0]
+        _GEOMETRIES[shapefilename] = main_geom
+    return _GEOMETRIES[shapefilename]
 
 
-def _mask_with_shp(cube, shapefilename):
-    """Apply a Natural Earth land/sea mask"""
-    # Create the region
-    region = _get_geometry_from_shp(shapefilename)
+def _rasterise(geometry, lons, lats):
+    """Find the points of a regular grid that are inside a geometry.
+
+    The grid is divided into tiles. Tiles that are completely inside or
+    outside the geometry are filled at once, only the points in tiles that
+    cross the boundary of the geometry are tested one by one.
+    """
+    prepared = prep(geometry)
+    mask = np.zeros((len(lats), len(lons)), dtype=bool)
+    lon_tiles = np.floor(lons / _TILE_SIZE)
+    lat_tiles = np.floor(lats / _TILE_SIZE)
+    for lon_tile in np.unique(lon_tiles):
+        i_lon = np.nonzero(lon_tiles == lon_tile)[0]
+        for lat_tile in np.unique(lat_tiles):
+            i_lat = np.nonzero(lat_tiles == lat_tile)[0]
+            tile = shapely.geometry.box(
+                lon_tile * _TILE_SIZE, lat_tile * _TILE_SIZE,
+                (lon_tile + 1) * _TILE_SIZE, (lat_tile + 1) * _TILE_SIZE)
+            index = np.ix_(i_lat, i_lon)
+            if prepared.contains_properly(tile):
+                mask[index] = True
+            elif not prepared.disjoint(tile):
+                x_p, y_p = np.meshgrid(lons[i_lon], lats[i_lat])
+                mask[index] = shp_vect.contains(prepared, x_p, y_p)
+    return mask
 
-    # Create a mask for the data
-    mask = np.zeros(cube.shape, dtype=bool)
 
+def _get_shp_mask(shapefilename, lons, lats, masks_dir=None):
+    """Get the rasterised shapefile geometry on a regular grid.
+
+    Masks are kept in memory and, if `masks_dir` is given, stored in that
+    directory for use by other processes and later runs.
+    """
+    sha = hashlib.sha256()
+    sha.update(os.path.basename(shapefilename).encode('utf-8'))
+    sha.update(str(os.path.getsize(shapefilename)).encode('utf-8'))
+    sha.update(np.asarray(lons, np.float64).tobytes())
+    sha.update(b'|')
+    sha.update(np.asarray(lats, np.float64).tobytes())
+    key = sha.hexdigest()
+    if key in _SHP_MASKS:
+        return _SHP_MASKS[key]
+
+    filename = None
+    if masks_dir is not None:
+        filename = os.path.join(masks_dir, key + '.npy')
+    if filename and os.path.exists(filename):
+        logger.debug("Loading Natural Earth mask from %s", filename)
+        mask = np.load(filename)
+    else:
+        mask = _rasterise(_get_geometry_from_shp(shapefilename), lons, lats)
+        if filename:
+            logger.debug("Saving Natural Earth mask to %s", filename)
+            if not os.path.exists(masks_dir):
+                os.makedirs(masks_dir)
+            # Write to a temporary file first, so other processes never read
+            # an incomplete file
+            handle, tmp_filename = tempfile.mkstemp(
+                suffix='.npy', dir=masks_dir)
+            with os.fdopen(handle, 'wb') as file:
+                np.save(file, mask)
+            os.rename(tmp_filename, filename)
+
+    _SHP_MASKS[key] = mask
+    return mask
+
+
+def _mask_with_shp(cube, shapefilename, masks_dir=None):
+    """Apply a Natural Earth land/sea mask"""
     # Create a set of x,y points from the cube
     # 1D regular grids
     if cube.coord('longitude').points.ndim < 2:
-        x_p, y_p = np.meshgrid(
-            cube.coord(axis='X').points, cube.coord(axis='Y').points)
+        x_p = cube.coord(axis='X').points
+        y_p = cube.coord(axis='Y').points
     # 2D irregular grids; spit an error for now
     else:
         logger.error('No fx-files found (sftlf or sftof)!\n \
@@ -238,17 +337,11 @@ def _mask_with_shp(cube, shapefilename):
     y_p_0 = np.where(y_p == -90., y_p + 1., y_p)
     y_p_90 = np.where(y_p_0 == 90., y_p_0 - 1., y_p_0)
 
-    # Build mask with vectorization
-    if len(cube.data.shape) == 3:
-        mask[:] = shp_vect.contains(region, x_p_180, y_p_90)
-    elif len(cube.data.shape) == 4:
-        mask[:, :] = shp_vect.contains(region, x_p_180, y_p_90)
+    # Build the mask once for every grid
+    mask = _get_shp_mask(shapefilename, x_p_180, y_p_90, masks_dir)
 
     # Then apply the mask
-    if isinstance(cube.data, np.ma.MaskedArray):
-        cube.data.mask |= mask
-    else:
-        cube.data = np.ma.masked_array(cube.data, mask)
+    cube.data = _apply_fx_mask(mask, cube.core_data())
 
     return cube
 
@@ -368,7 +461,9 @@ def mask_above_threshold(cube, threshold):
     Takes a value 'threshold' and masks off anything that is above
     it in the cube data. Values equal to the threshold are not masked.
     """
-    cube.data = np.ma.masked_where(cube.data > threshold, cube.data)
+    ma = _get_ma(cube)
+    cube.data = ma.masked_where(cube.core_data() > threshold,
+                                cube.core_data())
     return cube
 
 
@@ -379,7 +474,9 @@ def mask_below_threshold(cube, threshold):
     Takes a value 'threshold' and masks off anything that is below
     it in the cube data. Values equal to the threshold are not masked.
     """
-    cube.data = np.ma.masked_where(cube.data < threshold, cube.data)
+    ma = _get_ma(cube)
+    cube.data = ma.masked_where(cube.core_data() < threshold,
+                                cube.core_data())
     return cube
 
 
@@ -390,7 +487,8 @@ def mask_inside_range(cube, minimum, maximum):
     Takes a MINIMUM and a MAXIMUM value for the range, and masks off anything
     that's between the two in the cube data.
     """
-    cube.data = np.ma.masked_inside(cube.data, minimum, maximum)
+    ma = _get_ma(cube)
+    cube.data = ma.masked_inside(cube.core_data(), minimum, maximum)
     return cube
 
 
@@ -401,7 +499,8 @@ def mask_outside_range(cube, minimum, maximum):
     Takes a MINIMUM and a MAXIMUM value for the range, and masks off anything
     that's outside the two in the cube data.
     """
-    cube.data = np.ma.masked_outside(cube.data, minimum, maximum)
+    ma = _get_ma(cube)
+    cube.data = ma.masked_outside(cube.core_data(), minimum, maximum)
     return cube
 
 
@@ -416,7 +515,10 @@ def mask_fillvalues(products,
     used = set()
     for product in products:
         for cube in product.cubes:
-            cube.data = np.ma.fix_invalid(cube.data, copy=False)
+            if cube.has_lazy_data():
+                cube.data = da.ma.fix_invalid(cube.core_data())
+            else:
+                cube.data = np.ma.fix_invalid(cube.data, copy=False)
             mask = _get_fillvalues_mask(cube, threshold_fraction, min_value,
                                         time_window)
             if combined_mask is None:
@@ -442,7 +544,12 @@ def mask_fillvalues(products,
         used = {p.copy_provenance() for p in used}
         for product in products:
             for cube in product.cubes:
-                cube.data.mask |= combined_mask
+                if cube.has_lazy_data():
+                    data = cube.core_data()
+                    cube.data = da.ma.masked_array(
+                        data, mask=da.ma.getmaskarray(data) | combined_mask)
+                else:
+                    cube.data.mask |= combined_mask
             for other in used:
                 if other.filename != product.filename:
                     product.wasderivedfrom(other)
@@ -466,17 +573,52 @@ def _get_fillvalues_mask(cube, threshold_fraction, min_value, time_window):
     # round to lower integer
     counts_threshold = int(max_counts_per_time_window * threshold_fraction)
 
-    # Make an aggregator
-    spell_count = Aggregator(
-        'spell_count', count_spells, units_func=lambda units: 1)
-
     # Calculate the statistic.
-    counts_windowed_cube = cube.collapsed(
-        'time', spell_count, threshold=min_value, spell_length=time_window)
+    counts, valid = _count_spells_in_chunks(cube, min_value, time_window)
 
     # Create mask
-    mask = counts_windowed_cube.data < counts_threshold
-    if np.ma.isMaskedArray(mask):
-        mask = mask.data | mask.mask
+    mask = (counts < counts_threshold) | ~valid
 
     return mask
+
+
+def _count_spells_in_chunks(cube, threshold, spell_length):
+    """Count spells like :func:`count_spells` over the time coordinate.
+
+    The data is read in chunks of time windows, so only a chunk of lazy
+    data is realised at a time.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The number of windows in which all values exceed the threshold and
+        whether there are windows that are not completely masked.
+
+    """
+    axis = cube.coord_dims('time')[0]
+    data = cube.core_data()
+    n_windows = data.shape[axis] // spell_length
+    shape = data.shape[:axis] + data.shape[axis + 1:]
+    counts = np.zeros(shape, dtype=int)
+    valid = np.zeros(shape, dtype=bool)
+
+    window_size = data.dtype.itemsize * spell_length * int(np.prod(shape))
+    step = max(1, _CHUNK_SIZE // max(1, window_size))
+    for start in range(0, n_windows, step):
+        stop = min(start + step, n_windows)
+        index = [slice(None)] * data.ndim
+        index[axis] = slice(start * spell_length, stop * spell_length)
+        chunk = data[tuple(index)]
+        if isinstance(chunk, da.Array):
+            chunk = chunk.compute()
+        windows = shape[:axis] + (stop - start, spell_length) + shape[axis:]
+        masked = np.ma.getmaskarray(chunk).reshape(windows)
+        # As in count_spells, masked values do not interrupt a spell, but
+        # completely masked windows are not counted.
+        hits = np.ma.filled(chunk > threshold, False).reshape(windows)
+        all_masked = np.all(masked, axis=axis + 1)
+        full = np.all(hits | masked, axis=axis + 1) & ~all_masked
+        counts += np.sum(full, axis=axis)
+        valid |= np.any(~all_masked, axis=axis)
+
+    return counts, valid
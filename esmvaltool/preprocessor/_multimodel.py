@@ -14,13 +14,14 @@ It operates on different (time) spans:
 
 import logging
 from datetime import datetime
-from functools import reduce
+from functools import partial, reduce
 
 import cf_units
 import iris
 import numpy as np
 
 from .._config import use_legacy_iris
+from ._precision import get_float_dtype
 
 logger = logging.getLogger(__name__)
 
@@ -33,71 +34,153 @@ def _get_time_offset(time_unit):
     return time_offset
 
 
-def _plev_fix(dataset, pl_idx):
-    """Extract valid plev data.
+# Maximum size in bytes of the data of all datasets that is loaded into memory
+# at once when computing multimodel statistics
+MAX_CHUNK_SIZE = 2**28
 
-    this function takes care of situations
-    in which certain plevs are completely
-    masked due to unavailable interpolation
-    boundaries.
-    """
-    if np.ma.is_masked(dataset):
-        # keep only the valid plevs
-        if not np.all(dataset.mask[pl_idx]):
-            statj = np.ma.array(dataset[pl_idx], mask=dataset.mask[pl_idx])
-        else:
-            logger.debug('All vals in plev are masked, ignoring.')
-            statj = None
-    else:
-        mask = np.zeros_like(dataset[pl_idx], bool)
-        statj = np.ma.array(dataset[pl_idx], mask=mask)
-
-    return statj
 
+def _percentile(data, percent):
+    """Compute a percentile over the first axis of a masked array.
 
-def _compute_statistic(datas, statistic_name):
-    """Compute multimodel statistic."""
-    datas = np.ma.array(datas)
-    statistic = datas[0]
-
+    Masked values are ignored and the result is interpolated linearly
+    between the closest valid values, like :func:`numpy.percentile` does.
+    """
+    if not np.issubdtype(data.dtype, np.floating):
+        data = data.astype(np.float64)
+    n_valid = np.ma.count(data, axis=0)
+    last = np.maximum(n_valid - 1, 0)
+    rank = last * (percent / 100.)
+    lower = np.floor(rank).astype(np.intp)
+    upper = np.minimum(lower + 1, last)
+    # masked values are sorted to the end as NaN
+    data = np.sort(np.ma.filled(data, np.nan), axis=0)
+    low = np.take_along_axis(data, lower[np.newaxis], axis=0)[0]
+    high = np.take_along_axis(data, upper[np.newaxis], axis=0)[0]
+    statistic = low + (rank - lower) * (high - low)
+    return np.ma.masked_where(n_valid == 0, statistic, copy=False)
+
+
+def _get_statistic_function(statistic_name):
+    """Get a function that computes a statistic over the first axis.
+
+    Supported statistics are 'mean', 'median', 'std', 'min', 'max' and
+    percentiles, given as 'p' followed by a number, e.g. 'p95'.
+    """
+    functions = {
+        'mean': np.ma.mean,
+        'std': np.ma.std,
+        'min': np.ma.min,
+        'max': np.ma.max,
+    }
     if statistic_name == 'median':
-        statistic_function = np.ma.median
-    elif statistic_name == 'mean':
-        statistic_function = np.ma.mean
-    else:
-        raise NotImplementedError
+        return partial(_percentile, percent=50.)
+    if statistic_name in functions:
+        return partial(functions[statistic_name], axis=0)
+    if statistic_name.startswith('p'):
+        try:
+            percent = float(statistic_name[1:])
+        except ValueError:
+            percent = None
+        if percent is not None and 0. <= percent <= 100.:
+            return partial(_percentile, percent=percent)
+    names = sorted(list(functions) + ['median'])
+    raise ValueError(
+        "Unknown multimodel statistic '{}', choose from {} or a percentile "
+        "like 'p95'".format(statistic_name, ', '.join(names)))
+
+
+def _compute_statistic(data, statistic_name):
+    """Compute multimodel statistic.
+
+    Parameters
+    ----------
+    data: numpy.ma.MaskedArray
+        Data of all datasets, stacked along the first axis, with time along
+        the second axis.
+    statistic_name: str
+        Name of the statistic.
+
+    Returns
+    -------
+    numpy.ma.MaskedArray
+        The statistic. A time step, or a vertical level of a time step if
+        the data has (PLEV-LAT-LON) dimensions, is masked if fewer than two
+        datasets have valid data there.
 
-    # no plevs
-    if len(datas[0].shape) < 3:
-        # get all NOT fully masked data - u_data
-        # datas is per time point
-        # so we can safely NOT compute stats for single points
-        if datas.ndim == 1:
-            u_datas = [data for data in datas]
-        else:
-            u_datas = [data for data in datas if not np.all(data.mask)]
-        if len(u_datas) > 1:
-            statistic = statistic_function(datas, axis=0)
-        else:
-            statistic.mask = True
+    """
+    statistic_function = _get_statistic_function(statistic_name)
+    statistic = np.ma.asarray(statistic_function(data))
+    if data.ndim == 2:
         return statistic
 
-    # plevs
-    for j in range(statistic.shape[0]):
-        plev_check = []
-        for cdata in datas:
-            fixed_data = _plev_fix(cdata, j)
-            if fixed_data is not None:
-                plev_check.append(fixed_data)
-
-        # check for nr datasets
-        if len(plev_check) > 1:
-            plev_check = np.ma.array(plev_check)
-            statistic[j] = statistic_function(plev_check, axis=0)
-        else:
-            statistic.mask[j] = True
+    # Datasets that are fully masked in a (horizontal) time slice, e.g.
+    # because of unavailable interpolation boundaries, do not count
+    axes = tuple(range(max(2, data.ndim - 2), data.ndim))
+    n_valid = (~np.ma.getmaskarray(data)).any(axis=axes).sum(axis=0)
+    mask = (n_valid < 2).reshape(n_valid.shape + (1, ) * len(axes))
+    return np.ma.masked_where(
+        np.broadcast_to(mask, statistic.shape), statistic, copy=False)
+
+
+def _get_time_data(cube, start, stop):
+    """Load the data of a range of time steps of a cube."""
+    data = cube.core_data()[start:stop]
+    if cube.has_lazy_data():
+        data = data.compute()
+    return data
+
+
+def _compute_statistics(cubes, positions, n_times, statistics):
+    """Compute statistics of the datasets on a common time axis.
+
+    The data of all datasets is stacked along a new first axis and the
+    statistics are computed for chunks of time steps, so only the data of
+    a single chunk needs to be in memory at any time.
+
+    Parameters
+    ----------
+    cubes: list of iris.cube.Cube
+        The datasets.
+    positions: list of numpy.ndarray
+        For each cube, the (sorted) position on the common time axis of each
+        of its time points. Positions outside of the axis are ignored.
+    n_times: int
+        Length of the common time axis.
+    statistics: list of str
+        Names of the statistics to compute.
+
+    Returns
+    -------
+    dict
+        The data of each statistic.
 
-    return statistic
+    """
+    # Statistics of integer data are not integers
+    dtype = get_float_dtype(np.result_type(*[cube.dtype for cube in cubes]))
+    shape = cubes[0].shape[1:]
+    # one extra byte per element for the mask
+    time_step_size = len(cubes) * int(np.prod(shape)) * (dtype.itemsize + 1)
+    chunk_size = max(1, MAX_CHUNK_SIZE // time_step_size)
+    logger.debug("Computing multimodel statistics in chunks of %s time steps",
+                 chunk_size)
+
+    results = {
+        statistic: np.ma.empty((n_times, ) + shape, dtype=dtype)
+        for statistic in statistics
+    }
+    for t_start in range(0, n_times, chunk_size):
+        t_stop = min(t_start + chunk_size, n_times)
+        data = np.ma.masked_all((len(cubes), t_stop - t_start) + shape,
+                                dtype=dtype)
+        for i, (cube, cube_positions) in enumerate(zip(cubes, positions)):
+            start, stop = np.searchsorted(cube_positions, [t_start, t_stop])
+            if start < stop:
+                data[i, cube_positions[start:stop] - t_start] = (
+                    _get_time_data(cube, start, stop))
+        for statistic in statistics:
+            results[statistic][t_start:t_stop] = _compute_statistic(
+                data, statistic)
+    return results
 
 
 def _put_in_cube(template_cube, cube_data, statistic, t_axis):
@@ -223,84 +306,48 @@ def _monthly_t(cubes):
     return sorted(days)
 
 
-def _full_time_slice(cubes, ndat, indices, ndatarr, t_idx):
-    """Construct a contiguous collection over time."""
-    for idx_cube, cube in enumerate(cubes):
-        # reset mask
-        ndat.mask = True
-        ndat[indices[idx_cube]] = cube.data
-        if np.ma.is_masked(cube.data):
-            ndat.mask[indices[idx_cube]] = cube.data.mask
-        else:
-            ndat.mask[indices[idx_cube]] = False
-        ndatarr[idx_cube] = ndat[t_idx]
-
-    # return time slice
-    return ndatarr
-
-
-def _assemble_overlap_data(cubes, interval, statistic):
+def _assemble_overlap_data(cubes, interval, statistics):
     """Get statistical data in iris cubes for OVERLAP."""
     start, stop = interval
-    sl_1, sl_2 = _slice_cube(cubes[0], start, stop)
-    stats_dats = np.ma.zeros(cubes[0].data[sl_1:sl_2 + 1].shape)
-
-    # keep this outside the following loop
-    # this speeds up the code by a factor of 15
     indices = [_slice_cube(cube, start, stop) for cube in cubes]
-
-    for i in range(stats_dats.shape[0]):
-        time_data = [
-            cube.data[indx[0]:indx[1] + 1][i]
-            for cube, indx in zip(cubes, indices)
-        ]
-        stats_dats[i] = _compute_statistic(time_data, statistic)
-    stats_cube = _put_in_cube(
-        cubes[0][sl_1:sl_2 + 1], stats_dats, statistic, t_axis=None)
-    return stats_cube
-
-
-def _assemble_full_data(cubes, statistic):
+    sl_1, sl_2 = indices[0]
+    n_times = sl_2 - sl_1 + 1
+    positions = [
+        np.arange(cube.shape[0]) - indx[0]
+        for cube, indx in zip(cubes, indices)
+    ]
+    stats_dats = _compute_statistics(cubes, positions, n_times, statistics)
+    return {
+        statistic: _put_in_cube(
+            cubes[0][sl_1:sl_2 + 1], stats_dats[statistic], statistic,
+            t_axis=None)
+        for statistic in statistics
+    }
+
+
+def _assemble_full_data(cubes, statistics):
     """Get statistical data in iris cubes for FULL."""
     # all times, new MONTHLY data time axis
     time_axis = [float(fl) for fl in _monthly_t(cubes)]
-
-    # new big time-slice array shape
-    new_shape = [len(time_axis)] + list(cubes[0].shape[1:])
-
-    # assemble an array to hold all time data
-    # for all cubes; shape is (ncubes,(plev), lat, lon)
-    new_arr = np.ma.empty([len(cubes)] + list(new_shape[1:]))
-
-    # data array for stats computation
-    stats_dats = np.ma.zeros(new_shape)
-
-    # assemble indices list to chop new_arr on
-    indices_list = []
-
-    # empty data array to hold time slices
-    empty_arr = np.ma.empty(new_shape)
-
-    # loop through cubes and populate empty_arr with points
-    for cube in cubes:
-        time_redone = _datetime_to_int_days(cube)
-        oidx = [time_axis.index(s) for s in time_redone]
-        indices_list.append(oidx)
-    for i in range(new_shape[0]):
-        # hold time slices only
-        new_datas_array = _full_time_slice(cubes, empty_arr, indices_list,
-                                           new_arr, i)
-        # list to hold time slices
-        time_data = []
-        for j in range(len(cubes)):
-            time_data.append(new_datas_array[j])
-        stats_dats[i] = _compute_statistic(time_data, statistic)
-    stats_cube = _put_in_cube(cubes[0], stats_dats, statistic, time_axis)
-    return stats_cube
+    positions = [
+        np.searchsorted(time_axis, _datetime_to_int_days(cube))
+        for cube in cubes
+    ]
+    stats_dats = _compute_statistics(cubes, positions, len(time_axis),
+                                     statistics)
+    return {
+        statistic: _put_in_cube(cubes[0], stats_dats[statistic], statistic,
+                                time_axis)
+        for statistic in statistics
+    }
 
 
 def multi_model_statistics(products, span, output_products, statistics):
-    """Compute multi-model mean and median."""
+    """Compute multi-model statistics.
+
+    Supported statistics are 'mean', 'median', 'std', 'min', 'max' and
+    percentiles, given as 'p' followed by a number, e.g. 'p95'.
+    """
     logger.debug('Multimodel statistics: computing: %s', statistics)
     if len(products) < 2:
         logger.info("Single dataset in list: will not compute statistics.")
@@ -324,13 +371,15 @@ def multi_model_statistics(products, span, output_products, statistics):
             "Unexpected value for span {}, choose from 'overlap', 'full'"
             .format(span))
 
+    # Compute statistics
+    if span == 'overlap':
+        statistic_cubes = _assemble_overlap_data(cubes, interval, statistics)
+    elif span == 'full':
+        statistic_cubes = _assemble_full_data(cubes, statistics)
+
     statistic_products = set()
     for statistic in statistics:
-        # Compute statistic
-        if span == 'overlap':
-            statistic_cube = _assemble_overlap_data(cubes, interval, statistic)
-        elif span == 'full':
-            statistic_cube = _assemble_full_data(cubes, statistic)
+        statistic_cube = statistic_cubes[statistic]
         statistic_cube.data = np.ma.array(
             statistic_cube.data, dtype=np.dtype('float32'))
 
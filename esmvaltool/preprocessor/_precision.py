@@ -0,0 +1,112 @@
+"""Working precision of the preprocessor.
+
+Most input data is stored as single precision floats. The preprocessor
+functions keep the floating point type of the data, but some operations,
+e.g. in third party libraries, return double precision results. With the
+'float32' working precision the data is converted to single precision after
+loading and after every step that changes it, which halves the memory and
+bandwidth used by the following steps. Steps that upcast the data are
+reported, as warnings if the precision is audited.
+"""
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Supported working precisions
+PRECISIONS = ('native', 'float32')
+
+
+def get_float_dtype(dtype):
+    """Get the floating point type used to compute with data of `dtype`.
+
+    Floating point data keeps its type, other data is computed in double
+    precision.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.floating):
+        return dtype
+    return np.dtype(np.float64)
+
+
+def _get_max_itemsize(dtypes):
+    """Get the largest item size of the floating point types in dtypes."""
+    sizes = [
+        np.dtype(dtype).itemsize for dtype in dtypes
+        if np.issubdtype(dtype, np.floating)
+    ]
+    return max(sizes) if sizes else None
+
+
+def _check_precision_name(precision):
+    """Check that the working precision is supported."""
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown working precision '{}', choose from: "
+                         "{}".format(precision, ', '.join(PRECISIONS)))
+
+
+def set_precision(cubes, precision):
+    """Convert the data of cubes to the working precision.
+
+    With the 'float32' precision, double precision data is converted to
+    single precision, lazily if the data is lazy. Other data is not changed.
+
+    Parameters
+    ----------
+    cubes: list of iris.cube.Cube
+        The cubes to convert.
+    precision: str
+        The working precision, 'native' or 'float32'.
+
+    Returns
+    -------
+    list of iris.cube.Cube
+        The cubes.
+
+    """
+    _check_precision_name(precision)
+    if precision == 'float32':
+        for cube in cubes:
+            if (np.issubdtype(cube.dtype, np.floating)
+                    and cube.dtype.itemsize > 4):
+                cube.data = cube.core_data().astype(np.float32)
+    return cubes
+
+
+def check_precision(step, cubes, input_dtypes, precision='native',
+                    audit=False):
+    """Check that a preprocessor step did not upcast the data.
+
+    Parameters
+    ----------
+    step: str
+        Name of the preprocessor step.
+    cubes: list of iris.cube.Cube
+        The result of the step, the data of these cubes is converted to the
+        working precision with :func:`set_precision`.
+    input_dtypes: list of numpy.dtype
+        The types of the input data of the step.
+    precision: str
+        The working precision, 'native' or 'float32'.
+    audit: bool
+        Report upcasts as warnings instead of debug messages.
+
+    Returns
+    -------
+    list of iris.cube.Cube
+        The cubes.
+
+    """
+    _check_precision_name(precision)
+    max_itemsize = _get_max_itemsize(input_dtypes)
+    if max_itemsize is not None:
+        log = logger.warning if audit else logger.debug
+        for cube in cubes:
+            if (np.issubdtype(cube.dtype, np.floating)
+                    and cube.dtype.itemsize > max_itemsize):
+                log("Preprocessor step %s upcast the data of %s from %s to "
+                    "%s", step, cube.name(), ', '.join(
+                        sorted(set(str(np.dtype(d)) for d in input_dtypes))),
+                    cube.dtype)
+    return set_precision(cubes, precision)
@@ -2,10 +2,16 @@
 
 from __future__ import absolute_import, division, print_function
 
+import hashlib
 import os
 import re
+import threading
+from collections import OrderedDict
 from copy import deepcopy
+from functools import partial
+from multiprocessing.pool import ThreadPool
 
+import dask.array as da
 import iris
 import numpy as np
 import six
@@ -14,7 +20,8 @@ from iris.analysis import AreaWeighted, Linear, Nearest, UnstructuredNearest
 
 from ..cmor.fix import fix_file, fix_metadata
 from ..cmor.table import CMOR_TABLES
-from ._io import concatenate_callback, load
+from ._io import IO_LOCK, concatenate_callback, load
+from ._precision import get_float_dtype
 from ._regrid_esmpy import ESMF_REGRID_METHODS
 from ._regrid_esmpy import regrid as esmpy_regrid
 
@@ -41,15 +48,93 @@ _LON_RANGE = _LON_MAX - _LON_MIN
 # A cached stock of standard horizontal target grids.
 _CACHE = dict()
 
+# Maximum number of regridders kept for reuse by the regridding schemes.
+MAX_CACHED_REGRIDDERS = 32
+
+# Regridders by scheme, source and target grid, least recently used first.
+_REGRIDDER_CACHE = OrderedDict()
+
+_REGRIDDER_LOCK = threading.RLock()
+
+
+def _get_grid_key(cube):
+    """Compute a key that identifies the horizontal grid of a cube.
+
+    The iris regridders only accept cubes with horizontal coordinates that
+    are equal to the ones they were created with, so all coordinate
+    metadata is part of the key.
+    """
+    sha = hashlib.sha256()
+    for axis in ('x', 'y'):
+        for coord in cube.coords(axis=axis, dim_coords=True):
+            sha.update(
+                repr((coord.metadata, coord.shape, cube.coord_dims(coord),
+                      getattr(coord, 'circular', None),
+                      coord.has_bounds())).encode('utf-8'))
+            sha.update(np.asarray(coord.points, np.float64).tobytes())
+            if coord.has_bounds():
+                sha.update(np.asarray(coord.bounds, np.float64).tobytes())
+    return sha.hexdigest()
+
+
+class _CachedScheme(object):
+    """Regridding scheme that reuses the regridders it creates.
+
+    Creating an iris regridder computes the interpolation indices or area
+    weights, which only depend on the source and target grid. Many datasets
+    share a grid and are regridded to the same target grid, so the
+    regridders are kept in a process-wide cache of limited size and applied
+    to all cubes on the same grid.
+
+    Parameters
+    ----------
+    name : str
+        Name of the scheme, used in the cache key.
+    scheme :
+        The iris regridding scheme.
+
+    """
+
+    def __init__(self, name, scheme):
+        self.name = name
+        self.scheme = scheme
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(self.__class__.__name__, self.name,
+                                       self.scheme)
+
+    def regridder(self, src_grid, target_grid):
+        """Get a regridder from `src_grid` to `target_grid`."""
+        key = (self.name, _get_grid_key(src_grid), _get_grid_key(target_grid))
+        with _REGRIDDER_LOCK:
+            if key in _REGRIDDER_CACHE:
+                regridder = _REGRIDDER_CACHE.pop(key)
+            else:
+                regridder = self.scheme.regridder(src_grid, target_grid)
+            _REGRIDDER_CACHE[key] = regridder
+            while len(_REGRIDDER_CACHE) > MAX_CACHED_REGRIDDERS:
+                _REGRIDDER_CACHE.popitem(last=False)
+        return regridder
+
+
 # Supported horizontal regridding schemes.
 HORIZONTAL_SCHEMES = {
-    'linear': Linear(extrapolation_mode='mask'),
-    'linear_extrapolate': Linear(extrapolation_mode='extrapolate'),
-    'nearest': Nearest(extrapolation_mode='mask'),
-    'area_weighted': AreaWeighted(),
-    'unstructured_nearest': UnstructuredNearest(),
+    'linear':
+    _CachedScheme('linear', Linear(extrapolation_mode='mask')),
+    'linear_extrapolate':
+    _CachedScheme('linear_extrapolate',
+                  Linear(extrapolation_mode='extrapolate')),
+    'nearest':
+    _CachedScheme('nearest', Nearest(extrapolation_mode='mask')),
+    'area_weighted':
+    _CachedScheme('area_weighted', AreaWeighted()),
+    'unstructured_nearest':
+    UnstructuredNearest(),
 }
 
+# Size in bytes of the chunks of data that are interpolated vertically at once.
+_VERTICAL_CHUNK_SIZE = 2**26
+
 # Supported vertical interpolation schemes.
 VERTICAL_SCHEMES = ('linear', 'nearest',
                     'linear_horizontal_extrapolate_vertical',
@@ -162,7 +247,12 @@ def _attempt_irregular_regridding(cube, scheme):
     return False
 
 
-def regrid(cube, target_grid, scheme, lat_offset=True, lon_offset=True):
+def regrid(cube,
+           target_grid,
+           scheme,
+           lat_offset=True,
+           lon_offset=True,
+           weights_dir=None):
     """
     Perform horizontal regridding.
 
@@ -190,6 +280,9 @@ def regrid(cube, target_grid, scheme, lat_offset=True, lon_offset=True):
         Offset the grid centers of the longitude coordinate w.r.t. Greenwich
         meridian by half a grid step.
         This argument is ignored if `target_grid` is a cube or file.
+    weights_dir : str
+        Directory where the weights for regridding irregular grids are
+        stored, so they can be reused for other cubes on the same grid.
 
     Returns
     -------
@@ -206,7 +299,8 @@ def regrid(cube, target_grid, scheme, lat_offset=True, lon_offset=True):
 
     if isinstance(target_grid, six.string_types):
         if os.path.isfile(target_grid):
-            target_grid = iris.load_cube(target_grid)
+            with IO_LOCK:
+                target_grid = iris.load_cube(target_grid)
         else:
             # Generate a target grid from the provided cell-specification,
             # and cache the resulting stock cube for later use.
@@ -237,7 +331,7 @@ def regrid(cube, target_grid, scheme, lat_offset=True, lon_offset=True):
 
     # Perform the horizontal regridding.
     if _attempt_irregular_regridding(cube, scheme):
-        cube = esmpy_regrid(cube, target_grid, scheme)
+        cube = esmpy_regrid(cube, target_grid, scheme, weights_dir)
     else:
         cube = cube.regrid(target_grid, HORIZONTAL_SCHEMES[scheme])
 
@@ -326,46 +420,129 @@ def _create_cube(src_cube, data, levels):
     return result
 
 
-def _vertical_interpolate(cube, levels, interpolation, extrapolation):
-    """Perform vertical interpolation."""
+def _get_vertical_weights(src_levels, levels, interpolation,
+                          extrapolation):
+    """Compute the vertical interpolation weights.
+
+    Vertical interpolation with the schemes used here is linear in the data,
+    so when the source levels are the same for all columns it can be done
+    with a single matrix of weights. The weights are computed by
+    interpolating the unit vectors with :func:`stratify.interpolate`, which
+    does the search for the source levels around each target level once
+    for all columns.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        The weights with shape (number of target levels, number of source
+        levels), which source levels each target level depends on (if any of
+        those is missing, so is the result) and which target levels are
+        outside the source levels and not extrapolated.
+
+    """
+    identity = np.eye(len(src_levels))
+    src_levels = np.broadcast_to(src_levels[:, np.newaxis], identity.shape)
+    kwargs = dict(
+        axis=0, interpolation=interpolation, extrapolation=extrapolation)
+    weights = stratify.interpolate(levels, src_levels, identity, **kwargs)
+    # Put a NaN in every source level in turn to see where it ends up
+    probe = np.where(identity, np.nan, 0.)
+    dependencies = np.isnan(
+        stratify.interpolate(levels, src_levels, probe, **kwargs))
+    missing = np.all(np.isnan(weights), axis=1)
+    weights[missing] = 0.
+    return weights, dependencies, missing
+
+
+def _interpolate_block(block, weights, dependencies, missing, z_axis):
+    """Vertically interpolate a block of data with all levels."""
+    data = np.ma.getdata(block)
+    mask = np.ma.getmaskarray(block) | np.isnan(data)
+    if np.any(mask):
+        data = np.where(mask, 0., data)
+        result_mask = np.tensordot(
+            dependencies.astype(np.float32),
+            mask.astype(np.float32),
+            axes=([1], [z_axis])) > 0
+    else:
+        shape = data.shape[:z_axis] + data.shape[z_axis + 1:]
+        result_mask = np.zeros((len(weights), ) + shape, dtype=bool)
+    result_mask[missing] = True
+    result = np.tensordot(weights, data, axes=([1], [z_axis]))
+    result = np.moveaxis(result, 0, z_axis)
+    result_mask = np.moveaxis(result_mask, 0, z_axis)
+    return np.ma.masked_array(result, mask=result_mask, fill_value=_MDI)
+
+
+def _vertical_interpolate(cube, levels, interpolation, extrapolation,
+                          n_threads=1):
+    """Perform vertical interpolation.
+
+    Realised data is interpolated in chunks along the first non-vertical
+    dimension, using `n_threads` threads. Lazy data is interpolated lazily.
+    """
     # Determine the source levels and axis for vertical interpolation.
     src_levels = cube.coord(axis='z', dim_coords=True)
     z_axis, = cube.coord_dims(src_levels)
+    weights, dependencies, missing = _get_vertical_weights(
+        src_levels.points, levels, interpolation, extrapolation)
+    # Interpolate in the floating point type of the data
+    weights = weights.astype(get_float_dtype(cube.dtype))
+    interpolate = partial(
+        _interpolate_block,
+        weights=weights,
+        dependencies=dependencies,
+        missing=missing,
+        z_axis=z_axis)
+    shape = list(cube.shape)
+    shape[z_axis] = len(levels)
+
+    if cube.has_lazy_data():
+        data = cube.core_data().rechunk({z_axis: -1})
+        chunks = list(data.chunks)
+        chunks[z_axis] = (len(levels), )
+        new_data = data.map_blocks(
+            interpolate, chunks=tuple(chunks), dtype=weights.dtype)
+        return _create_cube(cube, new_data, levels.astype(float))
+
+    data = cube.data
+    other_dims = [dim for dim in range(cube.ndim) if dim != z_axis]
+    slices = [()]
+    if other_dims:
+        chunk_dim = other_dims[0]
+        index_size = data.nbytes // max(1, cube.shape[chunk_dim])
+        step = max(1, _VERTICAL_CHUNK_SIZE // max(1, index_size))
+        slices = [(slice(None), ) * chunk_dim + (slice(start, start + step), )
+                  for start in range(0, cube.shape[chunk_dim], step)]
+    new_data = np.empty(shape, dtype=weights.dtype)
+    new_mask = np.empty(shape, dtype=bool)
+
+    def interpolate_chunk(index):
+        """Interpolate a chunk of the data into the result."""
+        result = interpolate(data[index])
+        new_data[index] = result.data
+        new_mask[index] = result.mask
+
+    if n_threads > 1 and len(slices) > 1:
+        pool = ThreadPool(processes=min(n_threads, len(slices)))
+        try:
+            pool.map(interpolate_chunk, slices, chunksize=1)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for index in slices:
+            interpolate_chunk(index)
 
-    # Broadcast the 1d source cube vertical coordinate to fully
-    # describe the spatial extent that will be interpolated.
-    broadcast_shape = cube.shape[z_axis:]
-    reshape = [1] * len(broadcast_shape)
-    reshape[0] = cube.shape[z_axis]
-    src_levels_reshaped = src_levels.points.reshape(reshape)
-    src_levels_broadcast = np.broadcast_to(src_levels_reshaped,
-                                           broadcast_shape)
-
-    # force mask onto data as nan's
-    if np.ma.is_masked(cube.data):
-        cube.data[cube.data.mask] = np.nan
-
-    # Now perform the actual vertical interpolation.
-    new_data = stratify.interpolate(
-        levels,
-        src_levels_broadcast,
-        cube.data,
-        axis=z_axis,
-        interpolation=interpolation,
-        extrapolation=extrapolation)
-
-    # Calculate the mask based on the any NaN values in the interpolated data.
-    mask = np.isnan(new_data)
-
-    if np.any(mask):
+    if np.any(new_mask):
         # Ensure that the data is masked appropriately.
-        new_data = np.ma.array(new_data, mask=mask, fill_value=_MDI)
+        new_data = np.ma.array(new_data, mask=new_mask, fill_value=_MDI)
 
     # Construct the resulting cube with the interpolated data.
     return _create_cube(cube, new_data, levels.astype(float))
 
 
-def extract_levels(cube, levels, scheme):
+def extract_levels(cube, levels, scheme, n_threads=1):
     """
     Perform vertical interpolation.
 
@@ -383,6 +560,9 @@ def extract_levels(cube, levels, scheme):
         'nearest',
         'nearest_horizontal_extrapolate_vertical',
         'linear_horizontal_extrapolate_vertical'.
+    n_threads : int
+        Number of threads used to interpolate chunks of realised data in
+        parallel. Lazy data is interpolated lazily.
 
     Returns
     -------
@@ -431,7 +611,8 @@ def extract_levels(cube, levels, scheme):
             raise ValueError(emsg.format(list(levels), name))
     else:
         # As a last resort, perform vertical interpolation.
-        result = _vertical_interpolate(cube, levels, scheme, extrap_scheme)
+        result = _vertical_interpolate(cube, levels, scheme, extrap_scheme,
+                                       n_threads)
 
     return result
 
@@ -1,12 +1,24 @@
 # -*- coding: utf-8 -*-
 """Provides regridding for irregular grids."""
 
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
 import ESMF
 import iris
 import numpy as np
+import scipy.sparse
+from netCDF4 import Dataset
 
+from ._io import IO_LOCK
 from ._mapping import get_empty_data, map_slices, ref_to_dims_index
 
+logger = logging.getLogger(__name__)
 
 ESMF_MANAGER = ESMF.Manager(debug=False)
 
@@ -32,6 +44,14 @@ MASK_REGRIDDING_MASK_VALUE = {
 #     'nearest_dtos': ESMF.RegridMethod.NEAREST_DTOS,
 # }
 
+# Maximum size in bytes of the regridding weights kept in memory
+MAX_CACHED_WEIGHTS_SIZE = 2**30
+
+# Regridding weights and destination masks by key, least recently used first
+_WEIGHTS_CACHE = OrderedDict()
+
+_WEIGHTS_LOCK = threading.RLock()
+
 
 def cf_2d_bounds_to_esmpy_corners(bounds, circular):
     """Convert cf style 2d bounds to normal (esmpy style) corners."""
@@ -144,8 +164,12 @@ def get_representant(cube, ref_to_slice):
     return cube[rep_ind]
 
 
-def build_regridder_2d(src_rep, dst_rep, regrid_method, mask_threshold):
-    """Build regridder for 2d regridding."""
+def _build_esmf_regridder_2d(src_rep, dst_rep, regrid_method, mask_threshold,
+                             filename=None):
+    """Build the ESMF regridder and destination mask for 2d regridding.
+
+    If `filename` is given, the regridding weights are written to that file.
+    """
     dst_field = cube_to_empty_field(dst_rep)
     src_field = cube_to_empty_field(src_rep)
     regridding_arguments = {
@@ -172,9 +196,19 @@ def build_regridder_2d(src_rep, dst_rep, regrid_method, mask_threshold):
         center_mask[...] = dst_mask.T
     else:
         dst_mask = False
+    if filename is not None:
+        regridding_arguments['filename'] = filename
     field_regridder = ESMF.Regrid(src_mask_values=np.array([1]),
                                   dst_mask_values=np.array([1]),
                                   **regridding_arguments)
+    return src_field, dst_field, field_regridder, dst_mask
+
+
+def build_regridder_2d(src_rep, dst_rep, regrid_method, mask_threshold):
+    """Build regridder for 2d regridding."""
+    src_field, dst_field, field_regridder, dst_mask = \
+        _build_esmf_regridder_2d(src_rep, dst_rep, regrid_method,
+                                 mask_threshold)
 
     def regridder(src):
         """Regrid 2d for irregular grids."""
@@ -225,6 +259,174 @@ def build_regridder(src_rep, dst_rep, method, mask_threshold=.99):
     return regridder
 
 
+def get_weights_key(src_rep, dst_rep, regrid_method, mask_threshold):
+    """Compute a key that identifies the weights for 2d regridding."""
+    sha = hashlib.sha256()
+    for cube in (src_rep, dst_rep):
+        for name in ('latitude', 'longitude'):
+            coord = cube.coord(name)
+            sha.update(str((name, coord.shape, coord.has_bounds(),
+                            getattr(coord, 'circular', None))).encode())
+            sha.update(np.asarray(coord.points, np.float64).tobytes())
+            if coord.has_bounds():
+                sha.update(np.asarray(coord.bounds, np.float64).tobytes())
+    sha.update(np.ma.getmaskarray(src_rep.data).tobytes())
+    sha.update(str((regrid_method, mask_threshold)).encode())
+    return sha.hexdigest()
+
+
+def _compute_weights_2d(src_rep, dst_rep, regrid_method, mask_threshold):
+    """Compute the 2d regridding weights and destination mask with ESMF.
+
+    Returns
+    -------
+    tuple:
+        A :class:`scipy.sparse.csr_matrix` with the weights that map the
+        flattened source data to the flattened destination data and the
+        destination mask.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='esmvaltool_regrid_')
+    filename = os.path.join(tmp_dir, 'weights.nc')
+    try:
+        # ESMF writes the weights with the netCDF library
+        with IO_LOCK:
+            dst_mask = _build_esmf_regridder_2d(
+                src_rep, dst_rep, regrid_method, mask_threshold,
+                filename)[-1]
+            with Dataset(filename, 'r') as dataset:
+                # ESMF uses one-based indices, with longitude varying fastest
+                rows = np.ma.getdata(dataset.variables['row'][:]) - 1
+                cols = np.ma.getdata(dataset.variables['col'][:]) - 1
+                factors = np.ma.getdata(dataset.variables['S'][:])
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    shape = (int(np.prod(dst_rep.shape)), int(np.prod(src_rep.shape)))
+    weights = scipy.sparse.csr_matrix((factors, (rows, cols)), shape=shape)
+    dst_mask = np.zeros(dst_rep.shape, dtype=bool) | dst_mask
+    return weights, dst_mask
+
+
+def _load_weights(filename):
+    """Load regridding weights and destination mask from file."""
+    with np.load(filename) as data:
+        weights = scipy.sparse.csr_matrix(
+            (data['data'], data['indices'], data['indptr']),
+            shape=tuple(data['shape']))
+        dst_mask = data['dst_mask']
+    return weights, dst_mask
+
+
+def _save_weights(filename, weights, dst_mask):
+    """Save regridding weights and destination mask to file."""
+    dirname = os.path.dirname(filename)
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    # Write to a temporary file first, so other processes never read an
+    # incomplete file
+    handle, tmp_filename = tempfile.mkstemp(suffix='.npz', dir=dirname)
+    with os.fdopen(handle, 'wb') as file:
+        np.savez(
+            file,
+            data=weights.data,
+            indices=weights.indices,
+            indptr=weights.indptr,
+            shape=weights.shape,
+            dst_mask=dst_mask)
+    os.rename(tmp_filename, filename)
+
+
+def _cache_weights(key, weights, dst_mask):
+    """Keep weights in memory, removing the least recently used ones.
+
+    Must be called with ``_WEIGHTS_LOCK`` held.
+    """
+    _WEIGHTS_CACHE[key] = (weights, dst_mask)
+    size = 0
+    for cached_key in reversed(list(_WEIGHTS_CACHE)):
+        cached_weights, cached_mask = _WEIGHTS_CACHE[cached_key]
+        size += (cached_weights.data.nbytes + cached_weights.indices.nbytes +
+                 cached_weights.indptr.nbytes + cached_mask.nbytes)
+        if size > MAX_CACHED_WEIGHTS_SIZE and cached_key != key:
+            del _WEIGHTS_CACHE[cached_key]
+
+
+def get_weights(src_rep, dst_rep, regrid_method, mask_threshold,
+                weights_dir=None):
+    """Get the weights and destination mask for 2d regridding.
+
+    The weights are computed with ESMF once and then kept in memory and,
+    if `weights_dir` is given, stored in that directory for use by other
+    processes and later runs.
+    """
+    key = get_weights_key(src_rep, dst_rep, regrid_method, mask_threshold)
+    with _WEIGHTS_LOCK:
+        if key in _WEIGHTS_CACHE:
+            weights, dst_mask = _WEIGHTS_CACHE.pop(key)
+            _WEIGHTS_CACHE[key] = (weights, dst_mask)
+            return weights, dst_mask
+
+        filename = None
+        if weights_dir is not None:
+            filename = os.path.join(weights_dir, key + '.npz')
+        if filename and os.path.exists(filename):
+            logger.debug("Loading regridding weights from %s", filename)
+            weights, dst_mask = _load_weights(filename)
+        else:
+            weights, dst_mask = _compute_weights_2d(
+                src_rep, dst_rep, regrid_method, mask_threshold)
+            if filename:
+                logger.debug("Saving regridding weights to %s", filename)
+                _save_weights(filename, weights, dst_mask)
+
+        _cache_weights(key, weights, dst_mask)
+        return weights, dst_mask
+
+
+def build_weights_regridder_2d(src_rep, dst_rep, regrid_method,
+                               mask_threshold, weights_dir=None):
+    """Build regridder for 2d regridding that applies cached weights."""
+    weights, dst_mask = get_weights(src_rep, dst_rep, regrid_method,
+                                    mask_threshold, weights_dir)
+
+    def regridder(src):
+        """Regrid 2d for irregular grids."""
+        res = get_empty_data(dst_rep.shape)
+        data = np.ma.getdata(src.data)
+        res.data[...] = weights.dot(data.ravel()).reshape(dst_rep.shape)
+        res.mask[...] = dst_mask
+        return res
+
+    return regridder
+
+
+def build_weights_regridder(src_rep, dst_rep, method, mask_threshold=.99,
+                            weights_dir=None):
+    """Build regridders that apply cached weights from representants.
+
+    Like :func:`build_regridder`, but ESMF is only used to compute the
+    weights for grids that were not seen before. The regridding itself is a
+    sparse matrix-vector product.
+    """
+    regrid_method = ESMF_REGRID_METHODS[method]
+    if src_rep.ndim == 2:
+        return build_weights_regridder_2d(src_rep, dst_rep, regrid_method,
+                                          mask_threshold, weights_dir)
+    level_regridders = [
+        build_weights_regridder_2d(src_rep[level], dst_rep[level],
+                                   regrid_method, mask_threshold, weights_dir)
+        for level in range(src_rep.shape[0])
+    ]
+
+    def regridder(src):
+        """Regrid 2.5d for irregular grids."""
+        res = get_empty_data(dst_rep.shape)
+        for i, level_regridder in enumerate(level_regridders):
+            res[i, ...] = level_regridder(src[i])
+        return res
+
+    return regridder
+
+
 def get_grid_representant(cube, horizontal_only=False):
     """Extract the spatial grid from a cube."""
     horizontal_slice = ['latitude', 'longitude']
@@ -290,7 +492,7 @@ def get_grid_representants(src, dst):
     return src_rep, dst_rep
 
 
-def regrid(src, dst, method='linear'):
+def regrid(src, dst, method='linear', weights_dir=None):
     """
     Regrid src_cube to the grid defined by dst_cube.
 
@@ -307,6 +509,9 @@ def regrid(src, dst, method='linear'):
         Selects the regridding method.
         Can be 'linear', 'area_weighted',
         or 'nearest'. See ESMPy_.
+    weights_dir: str
+        Directory where the regridding weights are stored, so they can be
+        reused by other processes and later runs.
 
     Returns
     -------
@@ -319,6 +524,7 @@ def regrid(src, dst, method='linear'):
        RegridMethod.html#ESMF.api.constants.RegridMethod
     """
     src_rep, dst_rep = get_grid_representants(src, dst)
-    regridder = build_regridder(src_rep, dst_rep, method)
+    regridder = build_weights_regridder(src_rep, dst_rep, method,
+                                        weights_dir=weights_dir)
     res = map_slices(src, regridder, src_rep, dst_rep)
     return res
@@ -3,13 +3,18 @@
 Allows for selecting data subsets using certain time bounds;
 constructing seasonal and area averages.
 """
+import datetime
 import logging
 
+import dask.array as da
 import iris
 import iris.coord_categorisation
 import numpy as np
+import scipy.sparse
 
 from .._config import use_legacy_iris
+from ._precision import get_float_dtype
+from ._weighting import expand_weights, weighted_mean
 
 logger = logging.getLogger(__name__)
 
@@ -127,14 +132,215 @@ def time_average(cube):
     time_thickness = time.bounds[..., 1] - time.bounds[..., 0]
 
     # The weights need to match the dimensionality of the cube.
-    slices = [None for i in cube.shape]
-    coord_dim = cube.coord_dims('time')[0]
-    slices[coord_dim] = slice(None)
-    time_thickness = np.abs(time_thickness[tuple(slices)])
-    ones = np.ones_like(cube.data)
-    time_weights = time_thickness * ones
+    time_weights = expand_weights(
+        np.abs(time_thickness), cube.coord_dims('time'), cube.ndim)
 
-    return cube.collapsed('time', iris.analysis.MEAN, weights=time_weights)
+    return weighted_mean(cube, 'time', time_weights)
+
+
+# Names of the seasons in the clim_season coordinate, by season index
+_SEASONS = ('djf', 'mam', 'jja', 'son')
+
+# Supported periods of climatologies
+CLIMATOLOGY_PERIODS = ('month', 'season', 'year')
+
+
+def _get_time_categories(time, period, cycle):
+    """Get the categorical coordinates that define the groups of times.
+
+    The categories are computed from the dates in the calendar of the time
+    coordinate and returned in the order in which the groups are sorted.
+    """
+    dates = time.units.num2date(time.points)
+    years = np.array([date.year for date in dates])
+    months = np.array([date.month for date in dates])
+    categories = []
+    if period == 'month':
+        if not cycle:
+            categories.append(('year', years))
+        categories.append(('month_number', months))
+    elif period == 'season':
+        if not cycle:
+            # December belongs to the DJF season of the next year
+            categories.append(('season_year', years + (months == 12)))
+        categories.append(('clim_season', months % 12 // 3))
+    elif not cycle:
+        categories.append(('year', years))
+    return categories
+
+
+def _get_groups(categories, n_times):
+    """Get the group index of every time and the first time of each group."""
+    if not categories:
+        return np.zeros(n_times, dtype=int), np.array([0])
+    keys = np.stack([values for _, values in categories], axis=-1)
+    _, first, groups = np.unique(
+        keys, axis=0, return_index=True, return_inverse=True)
+    return groups.ravel(), first
+
+
+def _get_period_bounds(categories, time_units):
+    """Get the calendar start and end of the periods of a climatology."""
+    values = dict(categories)
+    if 'month_number' in values:
+        starts = [(year, month)
+                  for year, month in zip(values['year'],
+                                         values['month_number'])]
+        length = 1
+    elif 'clim_season' in values:
+        starts = [(year - 1, 12) if season == 0 else (year, 3 * season)
+                  for year, season in zip(values['season_year'],
+                                          values['clim_season'])]
+        length = 3
+    else:
+        starts = [(year, 1) for year in values['year']]
+        length = 12
+
+    bounds = []
+    for year, month in starts:
+        end_year, end_month = divmod(month - 1 + length, 12)
+        bounds.append([
+            time_units.date2num(datetime.datetime(year, month, 1)),
+            time_units.date2num(
+                datetime.datetime(year + end_year, end_month + 1, 1)),
+        ])
+    return np.array(bounds)
+
+
+def _group_mean(data, matrix, time_axis):
+    """Compute the weighted mean of the groups of times in an array.
+
+    Multiplying with the sparse matrix of weights, with shape (number of
+    groups, number of times), reduces all groups in a single pass.
+    """
+    data = np.moveaxis(data, time_axis, 0)
+    shape = data.shape
+    data = data.reshape(shape[0], -1)
+    mask = np.ma.getmaskarray(data)
+    if np.any(mask):
+        total = matrix.dot(np.where(mask, 0, np.ma.getdata(data)))
+        weights = matrix.dot((~mask).astype(matrix.dtype))
+    else:
+        total = matrix.dot(np.ma.getdata(data))
+        weights = np.asarray(matrix.sum(axis=1))
+    invalid = np.broadcast_to(weights == 0, total.shape)
+    mean = total / np.where(weights == 0, 1, weights)
+    mean = np.ma.masked_array(mean, mask=invalid)
+    mean = mean.reshape((matrix.shape[0], ) + shape[1:])
+    return np.moveaxis(mean, 0, time_axis)
+
+
+def _aggregate_periods(cube, period, cycle):
+    """Compute the means of the periods, see :func:`climatology`.
+
+    Returns the result cube and the categories of its times.
+    """
+    time = cube.coord('time')
+    time_axis, = cube.coord_dims(time)
+    if not time.has_bounds():
+        time = time.copy()
+        time.guess_bounds()
+
+    categories = _get_time_categories(time, period, cycle)
+    groups, first = _get_groups(categories, len(time.points))
+    n_groups = len(first)
+    weights = np.abs(time.bounds[:, 1] - time.bounds[:, 0])
+    matrix = scipy.sparse.csr_matrix(
+        (weights, (groups, np.arange(len(groups)))),
+        shape=(n_groups, len(groups)))
+    # Accumulate in double precision, but keep the floating point type of
+    # the data for the result
+    dtype = get_float_dtype(cube.dtype)
+
+    if cube.has_lazy_data():
+        data = cube.core_data().rechunk({time_axis: -1})
+        chunks = list(data.chunks)
+        chunks[time_axis] = (n_groups, )
+        data = data.map_blocks(
+            _group_mean,
+            matrix,
+            time_axis,
+            chunks=tuple(chunks),
+            dtype=dtype)
+    else:
+        data = _group_mean(cube.data, matrix, time_axis)
+        if not np.ma.is_masked(data):
+            data = data.data
+    data = data.astype(dtype)
+
+    # Create the result cube from the cube without the coordinates along
+    # the time dimension, using dummy data to avoid copying the data
+    template = cube.copy(
+        data=da.zeros(cube.shape, dtype=dtype, chunks=cube.shape))
+    for coord in template.coords(contains_dimension=time_axis):
+        template.remove_coord(coord)
+    index = [slice(None)] * cube.ndim
+    index[time_axis] = first
+    result = template[tuple(index)]
+    result.data = data
+
+    lower = np.full(n_groups, np.inf)
+    upper = np.full(n_groups, -np.inf)
+    np.minimum.at(lower, groups, np.min(time.bounds, axis=1))
+    np.maximum.at(upper, groups, np.max(time.bounds, axis=1))
+    kwargs = dict(
+        bounds=np.stack([lower, upper], axis=-1),
+        standard_name=time.standard_name,
+        long_name=time.long_name,
+        var_name=time.var_name,
+        units=time.units,
+        attributes=time.attributes,
+        coord_system=time.coord_system)
+    try:
+        new_time = iris.coords.DimCoord((lower + upper) / 2., **kwargs)
+        result.add_dim_coord(new_time, time_axis)
+    except ValueError:
+        new_time = iris.coords.AuxCoord((lower + upper) / 2., **kwargs)
+        result.add_aux_coord(new_time, time_axis)
+
+    categories = [(name, values[first]) for name, values in categories]
+    for name, values in categories:
+        if name == 'clim_season':
+            values = np.array([_SEASONS[season] for season in values])
+        result.add_aux_coord(
+            iris.coords.AuxCoord(values, long_name=name, units='1'),
+            time_axis)
+    return result, categories
+
+
+def climatology(cube, period, cycle=False):
+    """Compute monthly, seasonal or annual means or cycles.
+
+    The times are grouped by the months, seasons (DJF, MAM, JJA, SON) or
+    years in the calendar of the time coordinate and the mean of every
+    group is computed, weighted by the length of the time bounds. All
+    groups are reduced in a single pass over the data, lazy data is
+    reduced lazily.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Input cube.
+    period: str
+        Period of the means: 'month', 'season' or 'year'.
+    cycle: bool
+        If True, compute the mean annual or seasonal cycle, i.e. the mean of
+        every month or season over all years, or for 'year' the mean over
+        all years, instead of a mean for every month, season or year.
+
+    Returns
+    -------
+    iris.cube.Cube
+        Cube with one time for every group. The categorical coordinates
+        'month_number', 'year', 'clim_season' and 'season_year' of the
+        groups are added, like :mod:`iris.coord_categorisation` does.
+
+    """
+    if period not in CLIMATOLOGY_PERIODS:
+        raise ValueError("Unknown climatology period {!r}, choose from "
+                         "{}".format(period, ', '.join(CLIMATOLOGY_PERIODS)))
+    result, _ = _aggregate_periods(cube, period, cycle)
+    return result
 
 
 # get the seasonal mean
@@ -142,7 +348,10 @@ def seasonal_mean(cube):
     """
     Function to compute seasonal means with MEAN
 
-    Chunks time in 3-month periods and computes means over them;
+    Chunks time in 3-month periods and computes means over them, weighted
+    by the length of the time bounds. Seasons that are not completely
+    covered by the time bounds are removed, the length of the seasons is
+    determined from the calendar of the time coordinate.
 
     Arguments
     ---------
@@ -154,18 +363,15 @@ def seasonal_mean(cube):
     iris.cube.Cube
         Seasonal mean cube
     """
-    if not cube.coords('clim_season'):
-        iris.coord_categorisation.add_season(cube, 'time', name='clim_season')
-    if not cube.coords('season_year'):
-        iris.coord_categorisation.add_season_year(
-            cube, 'time', name='season_year')
-    cube = cube.aggregated_by(['clim_season', 'season_year'],
-                              iris.analysis.MEAN)
+    cube, categories = _aggregate_periods(cube, 'season', cycle=False)
 
-    # TODO: This preprocessor is not calendar independent.
-    def spans_three_months(time):
-        """Check for three months"""
-        return (time.bound[1] - time.bound[0]) == 2160
-
-    three_months_bound = iris.Constraint(time=spans_three_months)
-    return cube.extract(three_months_bound)
+    time = cube.coord('time')
+    expected = _get_period_bounds(categories, time.units)
+    complete = np.isclose(time.bounds, expected).all(axis=1)
+    if not np.any(complete):
+        raise ValueError("No complete seasons found in {}".format(
+            cube.summary(shorten=True)))
+
+    index = [slice(None)] * cube.ndim
+    index[cube.coord_dims(time)[0]] = np.flatnonzero(complete)
+    return cube[tuple(index)]
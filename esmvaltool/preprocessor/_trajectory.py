@@ -0,0 +1,307 @@
+"""Extract data along a trajectory.
+
+The values at the trajectory points are computed from the data on the
+horizontal grid with a stencil: for each point the indices of the grid cells
+that contribute to it and their weights. On grids with one dimensional
+latitude and longitude coordinates the stencil contains the bilinear
+interpolation weights of the four surrounding grid points, on other grids
+the nearest grid point is found with a KD-tree. The stencil is computed once
+for every grid and trajectory and applied to all times and levels at once.
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import partial
+
+import iris
+import numpy as np
+from scipy.spatial import cKDTree
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHED_STENCILS = 32
+
+# Trajectory stencils by grid and trajectory, least recently used first
+_STENCIL_CACHE = OrderedDict()
+
+_STENCIL_LOCK = threading.RLock()
+
+
+def _get_stencil_key(cube, latitudes, longitudes):
+    """Get a key that identifies the horizontal grid and trajectory."""
+    sha = hashlib.sha256()
+    for name in ('latitude', 'longitude'):
+        coord = cube.coord(name)
+        sha.update(repr((cube.coord_dims(coord), coord.shape,
+                         str(coord.units), coord.circular
+                         if isinstance(coord, iris.coords.DimCoord) else
+                         None)).encode('utf-8'))
+        sha.update(np.ascontiguousarray(coord.points, dtype='f8').tobytes())
+    for values in (latitudes, longitudes):
+        sha.update(np.ascontiguousarray(values, dtype='f8').tobytes())
+    return sha.hexdigest()
+
+
+def _get_linear_weights(coord, samples):
+    """Get the indices and weights for linear interpolation along coord.
+
+    Points outside the coordinate are linearly extrapolated, samples of
+    coordinates with a modulus (e.g. longitudes) are wrapped.
+    """
+    points = coord.points.astype(np.float64)
+    order = np.arange(len(points))
+    if len(points) > 1 and points[0] > points[-1]:
+        points = points[::-1]
+        order = order[::-1]
+    modulus = coord.units.modulus
+    if modulus:
+        samples = points[0] + (samples - points[0]) % modulus
+        if coord.circular:
+            points = np.append(points, points[0] + modulus)
+            order = np.append(order, order[0])
+    if len(points) == 1:
+        zeros = np.zeros(len(samples), dtype=int)
+        return zeros, zeros, np.ones(len(samples)), np.zeros(len(samples))
+
+    index = np.searchsorted(points, samples, side='right') - 1
+    index = np.clip(index, 0, len(points) - 2)
+    fraction = (samples - points[index]) / (points[index + 1] -
+                                            points[index])
+    return order[index], order[index + 1], 1. - fraction, fraction
+
+
+def _get_linear_stencil(cube, latitudes, longitudes):
+    """Get a bilinear stencil on a grid with 1D latitudes and longitudes."""
+    lat = cube.coord('latitude')
+    lon = cube.coord('longitude')
+    y_0, y_1, wy_0, wy_1 = _get_linear_weights(lat, latitudes)
+    x_0, x_1, wx_0, wx_1 = _get_linear_weights(lon, longitudes)
+    y_index = np.stack([y_0, y_0, y_1, y_1], axis=-1)
+    x_index = np.stack([x_0, x_1, x_0, x_1], axis=-1)
+    weights = np.stack(
+        [wy_0 * wx_0, wy_0 * wx_1, wy_1 * wx_0, wy_1 * wx_1], axis=-1)
+
+    y_dim, = cube.coord_dims(lat)
+    x_dim, = cube.coord_dims(lon)
+    if y_dim < x_dim:
+        return (y_dim, x_dim), (y_index, x_index), weights
+    return (x_dim, y_dim), (x_index, y_index), weights
+
+
+def _to_cartesian(latitudes, longitudes):
+    """Convert latitudes and longitudes to points on the unit sphere."""
+    lat = np.radians(latitudes)
+    lon = np.radians(longitudes)
+    return np.stack(
+        [np.cos(lat) * np.cos(lon),
+         np.cos(lat) * np.sin(lon),
+         np.sin(lat)], axis=-1)
+
+
+def _get_nearest_stencil(cube, latitudes, longitudes):
+    """Get a nearest neighbour stencil on any grid."""
+    lat = cube.coord('latitude')
+    lon = cube.coord('longitude')
+    dims = tuple(sorted(set(cube.coord_dims(lat) + cube.coord_dims(lon))))
+    lat_points = _broadcast_to_dims(lat.points, cube.coord_dims(lat), dims,
+                                    cube.shape)
+    lon_points = _broadcast_to_dims(lon.points, cube.coord_dims(lon), dims,
+                                    cube.shape)
+
+    tree = cKDTree(_to_cartesian(lat_points.ravel(), lon_points.ravel()))
+    _, index = tree.query(_to_cartesian(latitudes, longitudes))
+    indices = tuple(
+        i[:, np.newaxis] for i in np.unravel_index(index, lat_points.shape))
+    weights = np.ones((len(latitudes), 1))
+    return dims, indices, weights
+
+
+def get_stencil(cube, latitudes, longitudes):
+    """Get the stencil for a trajectory on the horizontal grid of a cube.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Cube with latitude and longitude coordinates.
+    latitudes, longitudes: numpy.ndarray
+        The trajectory points.
+
+    Returns
+    -------
+    tuple
+        The horizontal dimensions, a tuple with an array of grid indices
+        along each of them, and an array of weights. The arrays have shape
+        (number of points, number of grid cells per point).
+
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    key = _get_stencil_key(cube, latitudes, longitudes)
+    with _STENCIL_LOCK:
+        if key in _STENCIL_CACHE:
+            stencil = _STENCIL_CACHE.pop(key)
+        else:
+            lat = cube.coord('latitude')
+            lon = cube.coord('longitude')
+            if (lat.ndim == 1 and lon.ndim == 1
+                    and cube.coord_dims(lat) != cube.coord_dims(lon)):
+                stencil = _get_linear_stencil(cube, latitudes, longitudes)
+            else:
+                logger.debug("Using nearest neighbours for trajectory on grid "
+                             "with %sD latitudes and longitudes", lat.ndim)
+                stencil = _get_nearest_stencil(cube, latitudes, longitudes)
+        _STENCIL_CACHE[key] = stencil
+        while len(_STENCIL_CACHE) > MAX_CACHED_STENCILS:
+            _STENCIL_CACHE.popitem(last=False)
+    return stencil
+
+
+def _broadcast_to_dims(array, array_dims, dims, shape):
+    """Broadcast an array spanning array_dims to span dims."""
+    index = tuple(slice(None) if dim in array_dims else np.newaxis
+                  for dim in dims)
+    order = sorted(range(len(array_dims)), key=lambda i: array_dims[i])
+    array = np.transpose(array, order)[index]
+    return np.broadcast_to(array, tuple(shape[dim] for dim in dims))
+
+
+def apply_stencil(stencil, array, dims):
+    """Apply a stencil to an array.
+
+    Parameters
+    ----------
+    stencil: tuple
+        Stencil from :func:`get_stencil`.
+    array: numpy.ndarray
+        Array spanning the horizontal dimensions of the stencil.
+    dims: tuple of int
+        The (cube) dimensions spanned by the array, in order.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array with the horizontal dimensions replaced by a last dimension
+        along the trajectory. Points are masked if any grid cell
+        contributing to them is masked.
+
+    """
+    hdims, indices, weights = stencil
+    other = [i for i, dim in enumerate(dims) if dim not in hdims]
+    horizontal = [dims.index(dim) for dim in hdims]
+    array = np.transpose(array, other + horizontal)
+    # Gather the values of all grid cells that contribute to each point at
+    # once for all times and levels
+    values = array[(Ellipsis, ) + indices]
+    if weights.shape[-1] == 1:
+        # Nearest neighbours
+        return values[..., 0]
+    dtype = np.result_type(array.dtype, np.float16)
+    result = np.sum(np.ma.filled(values, 0) * weights, axis=-1).astype(dtype)
+    if np.ma.is_masked(values):
+        mask = np.any(np.ma.getmaskarray(values) & (weights != 0), axis=-1)
+        result = np.ma.masked_array(result, mask=mask)
+    return result
+
+
+def interpolate(cube, latitudes, longitudes):
+    """Interpolate the data to the points of a trajectory.
+
+    The result has the same dimensions as the input cube, except for the
+    horizontal dimensions that are replaced by a last dimension along the
+    trajectory, like :func:`iris.analysis.trajectory.interpolate`. Lazy
+    data stays lazy.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Input cube.
+    latitudes, longitudes: list of float
+        The trajectory points.
+
+    Returns
+    -------
+    iris.cube.Cube
+        Cube along the trajectory.
+
+    """
+    stencil = get_stencil(cube, latitudes, longitudes)
+    hdims = stencil[0]
+    remaining = [dim for dim in range(cube.ndim) if dim not in hdims]
+    remap = {dim: i for i, dim in enumerate(remaining)}
+    trajectory_dim = len(remaining)
+
+    dims = tuple(range(cube.ndim))
+    if cube.has_lazy_data():
+        # Apply the stencil to chunks spanning the whole horizontal grid
+        data = cube.core_data().rechunk({dim: -1 for dim in hdims})
+        chunks = tuple(data.chunks[dim] for dim in remaining)
+        chunks += ((len(stencil[2]), ), )
+        if stencil[2].shape[-1] == 1:
+            dtype = data.dtype
+        else:
+            dtype = np.result_type(data.dtype, np.float16)
+        data = data.map_blocks(
+            partial(apply_stencil, stencil),
+            dims,
+            chunks=chunks,
+            drop_axis=hdims,
+            new_axis=trajectory_dim,
+            dtype=dtype)
+    else:
+        data = apply_stencil(stencil, cube.data, dims)
+    result = iris.cube.Cube(data)
+    result.metadata = cube.metadata
+
+    coord_mapping = {}
+    for coord in cube.dim_coords:
+        dims = cube.coord_dims(coord)
+        if set(hdims).isdisjoint(dims):
+            new_coord = coord.copy()
+            result.add_dim_coord(new_coord, [remap[dim] for dim in dims])
+            coord_mapping[id(coord)] = new_coord
+    for coord in cube.aux_coords:
+        dims = cube.coord_dims(coord)
+        if set(hdims).isdisjoint(dims):
+            new_coord = coord.copy()
+            result.add_aux_coord(new_coord, [remap[dim] for dim in dims])
+            coord_mapping[id(coord)] = new_coord
+
+    # Sample the horizontal coordinates along the trajectory
+    interpolated = stencil[2].shape[-1] > 1
+    samples = {
+        id(cube.coord('latitude')): np.asarray(latitudes, dtype=np.float64),
+        id(cube.coord('longitude')): np.asarray(longitudes, dtype=np.float64),
+    }
+    for coord in cube.dim_coords + cube.aux_coords:
+        dims = cube.coord_dims(coord)
+        if set(hdims).isdisjoint(dims):
+            continue
+        if interpolated and id(coord) in samples:
+            # Use the trajectory points, interpolating the coordinate does
+            # not work for longitudes across the date line
+            points = samples[id(coord)]
+            new_dims = [trajectory_dim]
+        else:
+            all_dims = tuple(sorted(set(dims) | set(hdims)))
+            points = apply_stencil(
+                stencil,
+                _broadcast_to_dims(coord.points, dims, all_dims, cube.shape),
+                all_dims)
+            new_dims = [remap[dim] for dim in all_dims if dim not in hdims]
+            new_dims.append(trajectory_dim)
+        new_coord = iris.coords.AuxCoord(
+            points,
+            var_name=coord.var_name,
+            standard_name=coord.standard_name,
+            long_name=coord.long_name,
+            units=coord.units,
+            attributes=coord.attributes,
+            coord_system=coord.coord_system)
+        result.add_aux_coord(new_coord, new_dims)
+        coord_mapping[id(coord)] = new_coord
+
+    for factory in cube.aux_factories:
+        result.add_aux_factory(factory.updated(coord_mapping))
+
+    return result
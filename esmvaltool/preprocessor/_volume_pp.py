@@ -4,13 +4,15 @@ Volume and z coordinate operations on data cubes.
 Allows for selecting data subsets using certain volume bounds;
 selecting depth or height regions; constructing volumetric averages;
 """
-from copy import deepcopy
-
 import logging
 
 import iris
 import numpy as np
 
+from ._fx import get_fx_weights, load_fx_cube
+from ._trajectory import interpolate as interpolate_trajectory
+from ._weighting import expand_weights, weighted_mean, weighted_sum
+
 logger = logging.getLogger(__name__)
 
 
@@ -55,84 +57,6 @@ def volume_slice(cube, z_min, z_max):
     return region_subset
 
 
-def _create_cube_time(src_cube, data, times):
-    """
-    Generate a new cube with the volume averaged data.
-
-    The resultant cube is seeded with `src_cube` metadata and coordinates,
-    excluding any source coordinates that span the associated vertical
-    dimension. The `times` of interpolation are used along with the
-    associated source cube time coordinate metadata to add a new
-    time coordinate to the resultant cube.
-
-    Based on the _create_cube method from _regrid.py.
-
-    Parameters
-    ----------
-    src_cube : cube
-        The source cube that was vertically interpolated.
-    data : array
-        The payload resulting from interpolating the source cube
-        over the specified times.
-    times : array
-        The array of times.
-
-    Returns
-    -------
-    cube
-
-    .. note::
-
-        If there is only one level of interpolation, the resultant cube
-        will be collapsed over the associated vertical dimension, and a
-        scalar vertical coordinate will be added.
-
-    """
-    # Get the source cube vertical coordinate and associated dimension.
-    src_times = src_cube.coord('time')
-    t_dim, = src_cube.coord_dims(src_times)
-
-    if data.shape[t_dim] != len(times):
-        emsg = ('Mismatch between data and times for data dimension {!r}, '
-                'got data shape {!r} with times shape {!r}.')
-        raise ValueError(emsg.format(t_dim, data.shape, times.shape))
-
-    # Construct the resultant cube with the interpolated data
-    # and the source cube metadata.
-    kwargs = deepcopy(src_cube.metadata)._asdict()
-    result = iris.cube.Cube(data, **kwargs)
-
-    # Add the appropriate coordinates to the cube, excluding
-    # any coordinates that span the z-dimension of interpolation.
-    for coord in src_cube.dim_coords:
-        [dim] = src_cube.coord_dims(coord)
-        if dim != t_dim:
-            result.add_dim_coord(coord.copy(), dim)
-
-    for coord in src_cube.aux_coords:
-        dims = src_cube.coord_dims(coord)
-        if t_dim not in dims:
-            result.add_aux_coord(coord.copy(), dims)
-
-    for coord in src_cube.derived_coords:
-        dims = src_cube.coord_dims(coord)
-        if t_dim not in dims:
-            result.add_aux_coord(coord.copy(), dims)
-
-    # Construct the new vertical coordinate for the interpolated
-    # z-dimension, using the associated source coordinate metadata.
-    kwargs = deepcopy(src_times._as_defn())._asdict()
-
-    try:
-        coord = iris.coords.DimCoord(times, **kwargs)
-        result.add_dim_coord(coord, t_dim)
-    except ValueError:
-        coord = iris.coords.AuxCoord(times, **kwargs)
-        result.add_aux_coord(coord, t_dim)
-
-    return result
-
-
 def calculate_volume(cube, coordz):
     """
     Calculate volume from a cube.
@@ -195,11 +119,6 @@ def volume_average(
         collapsed cube.
     """
     # TODO: Test sigma depth coordinates.
-
-    # ####
-    # Load depth field and figure out which dim is which.
-    t_dim = cube.coord_dims('time')[0]
-
     grid_volume_found = False
     grid_volume = None
     if fx_files:
@@ -207,72 +126,23 @@ def volume_average(
             if fx_file is None:
                 continue
             logger.info('Attempting to load %s from file: %s', key, fx_file)
-            fx_cube = iris.load_cube(fx_file)
-
-            grid_volume = fx_cube.data
+            grid_volume = load_fx_cube(fx_file).data
             grid_volume_found = True
-            cube_shape = cube.data.shape
+            # Check whether the dimensions are right.
+            if cube.ndim == 4 and grid_volume.ndim == 3:
+                # Use a read-only view instead of a copy for every time step
+                grid_volume = get_fx_weights(fx_file, cube.shape)
 
     if not grid_volume_found:
         grid_volume = calculate_volume(cube, coordz)
 
-    # Check whether the dimensions are right.
-    if cube.data.ndim == 4 and grid_volume.ndim == 3:
-        grid_volume = np.tile(grid_volume,
-                              [cube_shape[0], 1, 1, 1])
-
-    if cube.data.shape != grid_volume.shape:
+    if cube.shape != grid_volume.shape:
         raise ValueError('Cube shape ({}) doesn`t match grid volume shape '
-                         '({})'.format(cube.data.shape, grid_volume.shape))
-
-    # #####
-    # Calculate global volume weighted average
-    result = []
-    # #####
-    # iterate over time and depth dimensions.
-    for time_itr in range(cube.shape[t_dim]):
-        # ####
-        # create empty output arrays
-        column = []
-        depth_volume = []
+                         '({})'.format(cube.shape, grid_volume.shape))
 
-        # ####
-        # iterate over time and depth dimensions.
-        for z_itr in range(cube.shape[1]):
-            # ####
-            # Calculate weighted mean for this time and layer
-            total = cube[time_itr, z_itr].collapsed(
-                [coordz, coord1, coord2],
-                iris.analysis.MEAN,
-                weights=grid_volume[time_itr, z_itr]).data
-            column.append(total)
-
-            try:
-                layer_vol = np.ma.masked_where(
-                    cube[time_itr, z_itr].data.mask,
-                    grid_volume[time_itr, z_itr]).sum()
-
-            except AttributeError:
-                # ####
-                # No mask in the cube data.
-                layer_vol = grid_volume.sum()
-            depth_volume.append(layer_vol)
-        # ####
-        # Calculate weighted mean over the water volumn
-        result.append(np.average(column, weights=depth_volume))
-
-    # ####
-    # Send time series and dummy cube to cube creating tool.
-    times = np.array(cube.coord('time').points.astype(float))
-    result = np.array(result)
-
-    # #####
-    # Create a small dummy output array for the output cube
-    src_cube = cube[:2, :2].collapsed([coordz, coord1, coord2],
-                                      iris.analysis.MEAN,
-                                      weights=grid_volume[:2, :2], )
-
-    return _create_cube_time(src_cube, result, times)
+    # Calculate the volume weighted average over all depth levels and grid
+    # cells at once, masked cells do not contribute to the volume.
+    return weighted_mean(cube, [coordz, coord1, coord2], grid_volume)
 
 
 def depth_integration(cube, coordz):
@@ -301,17 +171,10 @@ def depth_integration(cube, coordz):
     thickness = depth.bounds[..., 1] - depth.bounds[..., 0]
 
     if depth.ndim == 1:
-        slices = [None for i in cube.shape]
-        coord_dim = cube.coord_dims(coordz)[0]
-        slices[coord_dim] = slice(None)
-        thickness = np.abs(thickness[tuple(slices)])
-
-    ones = np.ones_like(cube.data)
+        thickness = np.abs(thickness)
+    thickness = expand_weights(thickness, cube.coord_dims(coordz), cube.ndim)
 
-    weights = thickness * ones
-
-    result = cube.collapsed(coordz, iris.analysis.SUM,
-                            weights=weights)
+    result = weighted_sum(cube, coordz, thickness)
 
     result.rename('Depth_integrated_' + str(cube.name()))
     # result.units = Unit('m') * result.units # This doesn't work:
@@ -340,9 +203,9 @@ def extract_transect(cube, latitude=None, longitude=None):
         will produce a transect along 28 West  between 50 south and 50 North.
 
     This function is not yet implemented for irregular arrays - instead
-    try the extract_trajectory function, but note that it is currently
-    very slow. Alternatively, use the regrid preprocessor to regrid along
-    a regular grid and then extract the transect.
+    try the extract_trajectory function. Alternatively, use the regrid
+    preprocessor to regrid along a regular grid and then extract the
+    transect.
 
     Arguments
     ---------
@@ -413,8 +276,11 @@ def extract_trajectory(cube, latitudes, longitudes, number_points=2):
     latitudes and longitudes are the pairs of coordinates for two points.
     number_points is the number of points between the two points.
 
-    This version uses the expensive interpolate method, but it may be
-    necceasiry for irregular grids.
+    The data is interpolated bilinearly on grids with one dimensional
+    latitude and longitude coordinates and taken from the nearest grid
+    point on irregular grids. The interpolation weights are computed once
+    for every grid and trajectory and reused for other cubes on the same
+    grid.
 
     If only two latitude and longitude coordinates are given,
     extract_trajectory will produce a cube will extrapolate along a line
@@ -444,20 +310,15 @@ def extract_trajectory(cube, latitudes, longitudes, number_points=2):
     iris.cube.Cube
         collapsed cube.
     """
-    from iris.analysis.trajectory import interpolate
-
     if len(latitudes) != len(longitudes):
         raise ValueError(
             'Longitude & Latitude coordinates have different lengths'
         )
 
     if len(latitudes) == len(longitudes) == 2:
-        minlat, maxlat = np.min(latitudes), np.max(latitudes)
-        minlon, maxlon = np.min(longitudes), np.max(longitudes)
-
-        longitudes = np.linspace(minlat, maxlat, num=number_points)
-        latitudes = np.linspace(minlon, maxlon, num=number_points)
+        latitudes = np.linspace(
+            latitudes[0], latitudes[1], num=number_points)
+        longitudes = np.linspace(
+            longitudes[0], longitudes[1], num=number_points)
 
-    points = [('latitude', latitudes), ('longitude', longitudes)]
-    interpolated_cube = interpolate(cube, points)  # Very slow!
-    return interpolated_cube
+    return interpolate_trajectory(cube, latitudes, longitudes)
@@ -0,0 +1,211 @@
+"""Weighted reductions of cubes.
+
+Collapsing a cube with :meth:`iris.cube.Cube.collapsed` and weights needs
+weights of the same shape as the data and creates several temporary arrays
+of that size. The functions in this module take weights that can be
+broadcast to the shape of the data, e.g. cell thicknesses or areas, and
+reduce realised data in chunks, so the extra memory used is limited to a
+few chunks. Lazy data is reduced lazily.
+"""
+import logging
+import warnings
+
+import dask.array as da
+import iris
+import numpy as np
+import six
+
+from ._precision import get_float_dtype
+
+logger = logging.getLogger(__name__)
+
+# Size in bytes of the chunks of realised data that are reduced at once
+CHUNK_SIZE = 2**26
+
+
+def expand_weights(weights, dims, ndim):
+    """Insert new axes into weights so they can be broadcast to the data.
+
+    Parameters
+    ----------
+    weights: numpy.ndarray
+        Weights spanning data dimensions `dims`, in the same order.
+    dims: tuple of int
+        The data dimensions spanned by the weights.
+    ndim: int
+        The number of data dimensions.
+
+    Returns
+    -------
+    numpy.ndarray
+        View of the weights with `ndim` dimensions.
+
+    """
+    index = tuple(slice(None) if dim in dims else None for dim in range(ndim))
+    return np.asanyarray(weights)[index]
+
+
+def _get_axes(cube, coords):
+    """Get the data dimensions spanned by coords."""
+    if isinstance(coords, (six.string_types, iris.coords.Coord)):
+        coords = [coords]
+    axes = set()
+    for coord in coords:
+        axes.update(cube.coord_dims(coord))
+    return coords, tuple(sorted(axes))
+
+
+def _reduce_chunk(data, weights, axes, mean):
+    """Compute the weighted sum and sum of weights of a chunk of data."""
+    valid = ~np.ma.getmaskarray(data)
+    total = np.sum(np.ma.filled(data, 0) * weights, axis=axes, keepdims=True)
+    if mean:
+        wsum = np.sum(
+            np.where(valid, weights, 0), axis=axes, keepdims=True)
+    else:
+        wsum = 0
+    return total, wsum, np.any(valid, axis=axes, keepdims=True)
+
+
+def _reduce_realised(data, weights, axes, mean):
+    """Reduce realised data in chunks.
+
+    Chunks are taken along the first dimension. If a single index along it
+    is larger than the chunk size, the next dimension is used and so on.
+    """
+    chunk_dim = 0
+    while (chunk_dim < data.ndim - 1 and data.itemsize * int(
+            np.prod(data.shape[chunk_dim + 1:])) > CHUNK_SIZE):
+        chunk_dim += 1
+    row_size = data.itemsize * int(np.prod(data.shape[chunk_dim + 1:]))
+    step = max(1, CHUNK_SIZE // max(1, row_size))
+    chunk_axes = tuple(axis - chunk_dim for axis in axes
+                       if axis >= chunk_dim)
+
+    shape = tuple(1 if dim in axes else length
+                  for dim, length in enumerate(data.shape))
+    total = np.zeros(shape, dtype=np.result_type(data, weights))
+    wsum = np.zeros(shape, dtype=weights.dtype)
+    valid = np.zeros(shape, dtype=bool)
+    for outer in np.ndindex(*data.shape[:chunk_dim]):
+        out_outer = tuple(0 if dim in axes else i
+                          for dim, i in enumerate(outer))
+        for start in range(0, data.shape[chunk_dim], step):
+            index = outer + (slice(start, start + step), )
+            if chunk_dim in axes:
+                # Accumulate chunks along a collapsed dimension
+                out_index = out_outer + (slice(None), )
+            else:
+                out_index = out_outer + index[-1:]
+            chunk = _reduce_chunk(data[index], weights[index], chunk_axes,
+                                  mean)
+            total[out_index] += chunk[0]
+            wsum[out_index] += chunk[1]
+            valid[out_index] |= chunk[2]
+
+    total = np.squeeze(total, axis=axes)
+    valid = np.squeeze(valid, axis=axes)
+    if mean:
+        wsum = np.squeeze(wsum, axis=axes)
+        valid &= wsum != 0
+        total = total / np.where(valid, wsum, 1)
+    if np.all(valid):
+        return np.asarray(total)
+    return np.ma.masked_array(total, mask=~valid)
+
+
+def _reduce_lazy(data, weights, axes, mean):
+    """Reduce lazy data."""
+    weights = da.from_array(weights, chunks=data.chunks)
+    valid = ~da.ma.getmaskarray(data)
+    total = da.sum(da.ma.filled(data, 0) * weights, axis=axes)
+    valid_any = da.any(valid, axis=axes)
+    if mean:
+        wsum = da.sum(da.where(valid, weights, 0), axis=axes)
+        valid_any = valid_any & (wsum != 0)
+        total = total / da.where(valid_any, wsum, 1)
+    return da.ma.masked_array(total, mask=~valid_any)
+
+
+def _weighted_reduce(cube, coords, weights, aggregator):
+    """Collapse cube over coords using broadcastable weights."""
+    coords, axes = _get_axes(cube, coords)
+    try:
+        # Read-only view of the weights with the shape of the data, masked
+        # weights do not contribute
+        weights = np.broadcast_to(np.ma.filled(weights, 0), cube.shape)
+    except ValueError:
+        raise ValueError("Weights with shape {} cannot be broadcast to cube "
+                         "shape {}".format(np.shape(weights), cube.shape))
+    mean = aggregator is iris.analysis.MEAN
+    # Accumulate in the precision of the weights, but keep the floating
+    # point type of the data for the result
+    dtype = get_float_dtype(cube.dtype)
+
+    if cube.has_lazy_data():
+        data = _reduce_lazy(cube.core_data(), weights, axes, mean)
+    else:
+        data = _reduce_realised(cube.data, weights, axes, mean)
+    data = data.astype(dtype)
+
+    # Collapse lazy dummy data to get the metadata of the result cube
+    template = cube.copy(
+        data=da.zeros(cube.shape, dtype=dtype, chunks=cube.shape))
+    with warnings.catch_warnings():
+        # The weights were applied above
+        warnings.filterwarnings(
+            'ignore', message='Collapsing spatial coordinate')
+        result = template.collapsed(coords, aggregator)
+    result.data = data
+    return result
+
+
+def weighted_mean(cube, coords, weights):
+    """Compute the weighted mean of a cube over coords.
+
+    The result is equivalent to ``cube.collapsed(coords, iris.analysis.MEAN,
+    weights=np.broadcast_to(weights, cube.shape))``, but the weights are
+    not copied to the full shape of the data. Masked data points do not
+    contribute, points with only masked data or zero weights are masked.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Input cube.
+    coords: str or list of str
+        Coordinate(s) to collapse.
+    weights: numpy.ndarray
+        Weights that can be broadcast to the shape of the cube, see
+        :func:`expand_weights`.
+
+    Returns
+    -------
+    iris.cube.Cube
+        Collapsed cube.
+
+    """
+    return _weighted_reduce(cube, coords, weights, iris.analysis.MEAN)
+
+
+def weighted_sum(cube, coords, weights):
+    """Compute the weighted sum of a cube over coords.
+
+    Like :func:`weighted_mean`, but computes the sum. Points with only
+    masked data are masked.
+
+    Parameters
+    ----------
+    cube: iris.cube.Cube
+        Input cube.
+    coords: str or list of str
+        Coordinate(s) to collapse.
+    weights: numpy.ndarray
+        Weights that can be broadcast to the shape of the cube.
+
+    Returns
+    -------
+    iris.cube.Cube
+        Collapsed cube.
+
+    """
+    return _weighted_reduce(cube, coords, weights, iris.analysis.SUM)
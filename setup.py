@@ -41,6 +41,7 @@ REQUIREMENTS = {
         'prov[dot]',
         'psutil',
         'pyyaml',
+        'scipy',
         'shapely',
         'six',
         'stratify',
@@ -233,6 +234,7 @@ with open('README.md') as readme:
         entry_points={
             'console_scripts': [
                 'esmvaltool = esmvaltool._main:run',
+                'esmvaltool_worker = esmvaltool._distributed:run_worker',
                 'cmorize_obs = esmvaltool.'
                 'utils.cmorizers.obs.cmorize_obs:execute_cmorize',
                 'nclcodestyle = esmvaltool.'
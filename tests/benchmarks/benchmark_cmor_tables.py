@@ -0,0 +1,90 @@
+"""Benchmark of reading the CMOR tables at startup.
+
+Compares reading all tables for every project, like
+:func:`esmvaltool.cmor.table.read_cmor_tables` did before tables were
+loaded lazily, with reading only the tables used by a typical recipe, with
+and without the compiled index. Checks that all give the same variable
+information and prints their run times.
+
+Run with::
+
+    python tests/benchmarks/benchmark_cmor_tables.py
+
+"""
+import shutil
+import tempfile
+import time
+
+from esmvaltool._config import read_config_developer_file
+from esmvaltool.cmor import table
+from esmvaltool.cmor.table import CMOR_TABLES, read_cmor_tables
+
+# Variables used by a typical recipe
+VARIABLES = [
+    ('CMIP5', 'Amon', 'tas'),
+    ('CMIP5', 'Omon', 'thetao'),
+    ('OBS', 'Amon', 'pr'),
+    ('CMIP6', 'Amon', 'tas'),
+    ('CMIP6', 'Omon', 'thetao'),
+    ('obs4mips', 'Amon', 'pr'),
+]
+
+
+def _read_tables(cfg_developer, index_dir=None, load_all=False):
+    """Read the tables as a new process would."""
+    table._PARSED_TABLES.clear()
+    start = time.time()
+    read_cmor_tables(cfg_developer, index_dir=index_dir)
+    if load_all:
+        for project in sorted(CMOR_TABLES):
+            # Tables were read separately for every project
+            table._PARSED_TABLES.clear()
+            assert CMOR_TABLES[project].tables
+    variables = [
+        CMOR_TABLES[project].get_variable(mip, short_name)
+        for project, mip, short_name in VARIABLES
+    ]
+    return time.time() - start, variables
+
+
+def _check(expected, variables):
+    """Check that the variable information is the same."""
+    for var_1, var_2 in zip(expected, variables):
+        for key in ('short_name', 'standard_name', 'units', 'frequency',
+                    'dimensions'):
+            assert getattr(var_1, key) == getattr(var_2, key)
+        assert sorted(var_1.coordinates) == sorted(var_2.coordinates)
+
+
+def main():
+    """Run the benchmarks."""
+    cfg_developer = read_config_developer_file()
+    index_dir = tempfile.mkdtemp()
+    try:
+        eager_time, expected = _read_tables(cfg_developer, load_all=True)
+        lazy_time, variables = _read_tables(cfg_developer)
+        _check(expected, variables)
+        # Compile the index for the tables in use
+        _read_tables(cfg_developer, index_dir=index_dir)
+        indexed_time, variables = _read_tables(
+            cfg_developer, index_dir=index_dir)
+        _check(expected, variables)
+        # Compile the index for all tables
+        _read_tables(cfg_developer, index_dir=index_dir, load_all=True)
+        indexed_all_time, variables = _read_tables(
+            cfg_developer, index_dir=index_dir, load_all=True)
+        _check(expected, variables)
+    finally:
+        shutil.rmtree(index_dir)
+
+    for name, run_time in (
+            ('lazy', lazy_time),
+            ('lazy, compiled index', indexed_time),
+            ('all tables, compiled index', indexed_all_time),
+    ):
+        print("{:<30} eager {:8.3f} s, {:8.3f} s, speedup {:6.1f}x".format(
+            name, eager_time, run_time, eager_time / run_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Benchmark of concatenating datasets that are split into many files.
+
+Compares :func:`esmvaltool.preprocessor._io.concatenate` with the
+implementation that compared all attributes with :func:`numpy.array_equal`
+and all cubes with :meth:`iris.cube.CubeList.concatenate_cube`, on 1000
+cubes with lazy data like those loaded from 1000 monthly files of daily
+data. Checks that both give the same results and prints their run times.
+
+Run with::
+
+    python tests/benchmarks/benchmark_concatenate.py
+
+"""
+import time
+
+import dask.array as da
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+
+from esmvaltool.preprocessor._io import concatenate
+
+TIME_UNITS = Unit('days since 1950-01-01', calendar='360_day')
+
+# Global attributes of a typical CMIP5 file
+ATTRIBUTES = {
+    'branch_time': 0.,
+    'cmor_version': '2.8.0',
+    'contact': 'ESMValTool benchmark',
+    'Conventions': 'CF-1.4',
+    'experiment': 'historical',
+    'experiment_id': 'historical',
+    'forcing': 'GHG, Oz, SA, Sl, Vl, BC, OC',
+    'frequency': 'day',
+    'initialization_method': 1,
+    'institute_id': 'BENCH',
+    'institution': 'ESMValTool benchmark',
+    'model_id': 'BENCH-1',
+    'modeling_realm': 'atmos',
+    'parent_experiment_id': 'piControl',
+    'parent_experiment_rip': 'r1i1p1',
+    'physics_version': 1,
+    'product': 'output',
+    'project_id': 'CMIP5',
+    'realization': 1,
+    'table_id': 'Table day (11 April 2011) 1cfdc7322cf2f4a32614826fab42c1ab',
+}
+
+
+# The implementation of concatenate before the fast path was added
+def _legacy_fix_cube_attributes(cubes):
+    """Unify attributes of different cubes to allow concatenation."""
+    attributes = {}
+    for cube in cubes:
+        for (attr, val) in cube.attributes.items():
+            if attr not in attributes:
+                attributes[attr] = val
+            else:
+                if not np.array_equal(val, attributes[attr]):
+                    attributes[attr] = '{};{}'.format(
+                        str(attributes[attr]), str(val))
+    for cube in cubes:
+        cube.attributes = attributes
+
+
+def _legacy_concatenate(cubes):
+    """Concatenate all cubes after fixing metadata."""
+    _legacy_fix_cube_attributes(cubes)
+    return iris.cube.CubeList(cubes).concatenate_cube()
+
+
+def create_cubes(n_files, shape, seed=0):
+    """Create cubes with 30 days of data each, in random order."""
+    random = np.random.RandomState(seed)
+    lat = iris.coords.DimCoord(
+        np.linspace(-89., 89., shape[0]),
+        standard_name='latitude',
+        units='degrees')
+    lon = iris.coords.DimCoord(
+        np.linspace(0., 360., shape[1], endpoint=False),
+        standard_name='longitude',
+        units='degrees',
+        circular=True)
+    for coord in (lat, lon):
+        coord.guess_bounds()
+    height = iris.coords.AuxCoord(2., standard_name='height', units='m')
+    cubes = []
+    for i in random.permutation(n_files):
+        days = i * 30. + np.arange(30)
+        time_coord = iris.coords.DimCoord(
+            days + .5,
+            bounds=np.stack([days, days + 1.], axis=-1),
+            standard_name='time',
+            units=TIME_UNITS)
+        data = da.full((30, ) + tuple(shape), 250. + i / 10.,
+                       dtype=np.float32, chunks=-1)
+        cube = iris.cube.Cube(
+            data,
+            var_name='tas',
+            units='K',
+            # Every file has its own coordinates
+            dim_coords_and_dims=[(time_coord, 0), (lat.copy(), 1),
+                                 (lon.copy(), 2)],
+            aux_coords_and_dims=[(height.copy(), ())],
+            attributes=dict(
+                ATTRIBUTES, source_file='tas_day_{:04d}.nc'.format(i)))
+        cubes.append(cube)
+    return cubes
+
+
+def benchmark(name, n_files, shape):
+    """Run and compare both implementations."""
+    cubes = create_cubes(n_files, shape)
+    start = time.time()
+    expected = _legacy_concatenate(cubes)
+    legacy_time = time.time() - start
+
+    cubes = create_cubes(n_files, shape)
+    start = time.time()
+    result = concatenate(cubes)
+    new_time = time.time() - start
+
+    assert result.has_lazy_data()
+    assert result.metadata == expected.metadata
+    assert result.coords() == expected.coords()
+    # Compare some days of every file
+    np.testing.assert_array_equal(result[::7].data, expected[::7].data)
+    print("{:<40} legacy {:8.2f} s, fast path {:8.2f} s, "
+          "speedup {:6.1f}x".format(name, legacy_time, new_time,
+                                    legacy_time / new_time))
+
+
+def main():
+    """Run the benchmarks."""
+    benchmark('1000 files, 10x20 grid', 1000, (10, 20))
+    benchmark('1000 files, 96x192 grid', 1000, (96, 192))
+
+
+if __name__ == '__main__':
+    main()
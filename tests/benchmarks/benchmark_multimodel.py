@@ -0,0 +1,265 @@
+"""Benchmark of the multimodel statistics engine.
+
+Compares the chunked engine in :mod:`esmvaltool.preprocessor._multimodel`
+with the time step by time step implementation it replaced, checks that
+both give the same results and prints their run times.
+
+Run with::
+
+    python tests/benchmarks/benchmark_multimodel.py
+
+"""
+import logging
+import time
+from datetime import datetime
+
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+
+from esmvaltool.preprocessor._multimodel import (
+    _assemble_full_data, _assemble_overlap_data, _datetime_to_int_days,
+    _get_overlap, _monthly_t, _put_in_cube, _slice_cube)
+
+logger = logging.getLogger(__name__)
+
+TIME_UNITS = Unit('days since 1950-01-01', calendar='gregorian')
+
+
+# The implementation of the multimodel statistics before the chunked engine
+def _legacy_plev_fix(dataset, pl_idx):
+    """Extract valid plev data.
+
+    this function takes care of situations
+    in which certain plevs are completely
+    masked due to unavailable interpolation
+    boundaries.
+    """
+    if np.ma.is_masked(dataset):
+        # keep only the valid plevs
+        if not np.all(dataset.mask[pl_idx]):
+            statj = np.ma.array(dataset[pl_idx], mask=dataset.mask[pl_idx])
+        else:
+            logger.debug('All vals in plev are masked, ignoring.')
+            statj = None
+    else:
+        mask = np.zeros_like(dataset[pl_idx], bool)
+        statj = np.ma.array(dataset[pl_idx], mask=mask)
+
+    return statj
+
+
+def _legacy_compute_statistic(datas, statistic_name):
+    """Compute multimodel statistic."""
+    datas = np.ma.array(datas)
+    statistic = datas[0]
+
+    if statistic_name == 'median':
+        statistic_function = np.ma.median
+    elif statistic_name == 'mean':
+        statistic_function = np.ma.mean
+    else:
+        raise NotImplementedError
+
+    # no plevs
+    if len(datas[0].shape) < 3:
+        # get all NOT fully masked data - u_data
+        # datas is per time point
+        # so we can safely NOT compute stats for single points
+        if datas.ndim == 1:
+            u_datas = [data for data in datas]
+        else:
+            u_datas = [data for data in datas if not np.all(data.mask)]
+        if len(u_datas) > 1:
+            statistic = statistic_function(datas, axis=0)
+        else:
+            statistic.mask = True
+        return statistic
+
+    # plevs
+    for j in range(statistic.shape[0]):
+        plev_check = []
+        for cdata in datas:
+            fixed_data = _legacy_plev_fix(cdata, j)
+            if fixed_data is not None:
+                plev_check.append(fixed_data)
+
+        # check for nr datasets
+        if len(plev_check) > 1:
+            plev_check = np.ma.array(plev_check)
+            statistic[j] = statistic_function(plev_check, axis=0)
+        else:
+            statistic.mask[j] = True
+
+    return statistic
+
+
+def _legacy_full_time_slice(cubes, ndat, indices, ndatarr, t_idx):
+    """Construct a contiguous collection over time."""
+    for idx_cube, cube in enumerate(cubes):
+        # reset mask
+        ndat.mask = True
+        ndat[indices[idx_cube]] = cube.data
+        if np.ma.is_masked(cube.data):
+            ndat.mask[indices[idx_cube]] = cube.data.mask
+        else:
+            ndat.mask[indices[idx_cube]] = False
+        ndatarr[idx_cube] = ndat[t_idx]
+
+    # return time slice
+    return ndatarr
+
+
+def _legacy_assemble_overlap_data(cubes, interval, statistic):
+    """Get statistical data in iris cubes for OVERLAP."""
+    start, stop = interval
+    sl_1, sl_2 = _slice_cube(cubes[0], start, stop)
+    stats_dats = np.ma.zeros(cubes[0].data[sl_1:sl_2 + 1].shape)
+
+    # keep this outside the following loop
+    # this speeds up the code by a factor of 15
+    indices = [_slice_cube(cube, start, stop) for cube in cubes]
+
+    for i in range(stats_dats.shape[0]):
+        time_data = [
+            cube.data[indx[0]:indx[1] + 1][i]
+            for cube, indx in zip(cubes, indices)
+        ]
+        stats_dats[i] = _legacy_compute_statistic(time_data, statistic)
+    stats_cube = _put_in_cube(
+        cubes[0][sl_1:sl_2 + 1], stats_dats, statistic, t_axis=None)
+    return stats_cube
+
+
+def _legacy_assemble_full_data(cubes, statistic):
+    """Get statistical data in iris cubes for FULL."""
+    # all times, new MONTHLY data time axis
+    time_axis = [float(fl) for fl in _monthly_t(cubes)]
+
+    # new big time-slice array shape
+    new_shape = [len(time_axis)] + list(cubes[0].shape[1:])
+
+    # assemble an array to hold all time data
+    # for all cubes; shape is (ncubes,(plev), lat, lon)
+    new_arr = np.ma.empty([len(cubes)] + list(new_shape[1:]))
+
+    # data array for stats computation
+    stats_dats = np.ma.zeros(new_shape)
+
+    # assemble indices list to chop new_arr on
+    indices_list = []
+
+    # empty data array to hold time slices
+    empty_arr = np.ma.empty(new_shape)
+
+    # loop through cubes and populate empty_arr with points
+    for cube in cubes:
+        time_redone = _datetime_to_int_days(cube)
+        oidx = [time_axis.index(s) for s in time_redone]
+        indices_list.append(oidx)
+    for i in range(new_shape[0]):
+        # hold time slices only
+        new_datas_array = _legacy_full_time_slice(
+            cubes, empty_arr, indices_list, new_arr, i)
+        # list to hold time slices
+        time_data = []
+        for j in range(len(cubes)):
+            time_data.append(new_datas_array[j])
+        stats_dats[i] = _legacy_compute_statistic(time_data, statistic)
+    stats_cube = _put_in_cube(cubes[0], stats_dats, statistic, time_axis)
+    return stats_cube
+
+
+def create_cube(start_year, n_years, shape, seed, n_levels=None):
+    """Create a monthly cube with random, partly masked, data."""
+    random = np.random.RandomState(seed)
+    dates = [
+        datetime(year, month, 15)
+        for year in range(start_year, start_year + n_years)
+        for month in range(1, 13)
+    ]
+    times = iris.coords.DimCoord(
+        TIME_UNITS.date2num(dates), standard_name='time', units=TIME_UNITS)
+    lats = iris.coords.DimCoord(
+        np.linspace(-89., 89., shape[0]), standard_name='latitude',
+        units='degrees')
+    lons = iris.coords.DimCoord(
+        np.linspace(0., 358., shape[1]), standard_name='longitude',
+        units='degrees')
+    cspec = [(times, 0), (lats, 1), (lons, 2)]
+    data_shape = (len(dates), ) + tuple(shape)
+    if n_levels:
+        plev = iris.coords.DimCoord(
+            np.linspace(100000., 1000., n_levels),
+            standard_name='air_pressure', units='Pa')
+        cspec = [(times, 0), (plev, 1), (lats, 2), (lons, 3)]
+        data_shape = (len(dates), n_levels) + tuple(shape)
+    data = random.uniform(200., 300., data_shape).astype(np.float32)
+    mask = random.uniform(size=data_shape) < 0.1
+    # Datasets that are fully masked in a time step or at a level
+    mask[seed % len(dates)] = True
+    if n_levels:
+        mask[:, seed % n_levels] = True
+    data = np.ma.array(data, mask=mask)
+    return iris.cube.Cube(
+        data, var_name='ta', units='K', dim_coords_and_dims=cspec)
+
+
+def check_results(expected, result):
+    """Check that the legacy and the new implementation agree."""
+    np.testing.assert_array_equal(
+        np.ma.getmaskarray(expected.data), np.ma.getmaskarray(result.data))
+    np.testing.assert_allclose(
+        np.ma.filled(expected.data, 0.),
+        np.ma.filled(result.data, 0.),
+        rtol=1e-5)
+    assert expected.coord('time') == result.coord('time')
+
+
+def benchmark(name, cubes, statistics=('mean', 'median')):
+    """Run and compare both implementations for both time spans."""
+    interval = _get_overlap(cubes)
+    for span in ('overlap', 'full'):
+        start = time.time()
+        if span == 'overlap':
+            expected = {
+                statistic: _legacy_assemble_overlap_data(
+                    cubes, interval, statistic)
+                for statistic in statistics
+            }
+        else:
+            expected = {
+                statistic: _legacy_assemble_full_data(cubes, statistic)
+                for statistic in statistics
+            }
+        legacy_time = time.time() - start
+
+        start = time.time()
+        if span == 'overlap':
+            result = _assemble_overlap_data(cubes, interval, statistics)
+        else:
+            result = _assemble_full_data(cubes, statistics)
+        new_time = time.time() - start
+
+        for statistic in statistics:
+            check_results(expected[statistic], result[statistic])
+        print("{:<30} {:<8} legacy {:8.2f} s, chunked {:8.2f} s, "
+              "speedup {:6.1f}x".format(name, span, legacy_time, new_time,
+                                        legacy_time / new_time))
+
+
+def main():
+    """Run the benchmarks."""
+    benchmark('10 datasets, 3D, 30 years', [
+        create_cube(1970 + i, 30, (45, 90), seed=i) for i in range(10)
+    ])
+    benchmark('5 datasets, 4D, 10 years', [
+        create_cube(1980 + i, 10, (45, 90), seed=i, n_levels=8)
+        for i in range(5)
+    ])
+
+
+if __name__ == '__main__':
+    main()
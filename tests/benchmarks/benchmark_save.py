@@ -0,0 +1,177 @@
+"""Benchmark of saving preprocessed datasets.
+
+Compares saving files with ``optimize_access`` and reading them one map or
+one time series at a time, with chunks of length one along the other
+dimensions, like :func:`esmvaltool.preprocessor._io.save` did before the
+chunk shape was chosen from a target chunk size, with reading from files
+saved with the new chunks. Also compares a preprocessing task that saves its
+datasets one after the other with one that saves them from writer threads
+while the next datasets are preprocessed. Checks that the saved data is the
+same and prints the run times.
+
+Run with::
+
+    python tests/benchmarks/benchmark_save.py
+
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import dask.array as da
+import iris
+import iris.coords
+import iris.cube
+import netCDF4
+import numpy as np
+from cf_units import Unit
+
+from esmvaltool._provenance import TrackedFile
+from esmvaltool.preprocessor import PreprocessingTask, PreprocessorFile
+from esmvaltool.preprocessor._io import concatenate_callback, save
+
+TIME_UNITS = Unit('days since 1950-01-01', calendar='360_day')
+
+
+def create_cube(n_times, shape, seed=0):
+    """Create a cube with daily data on a global grid."""
+    lat = iris.coords.DimCoord(
+        np.linspace(-89., 89., shape[0]),
+        standard_name='latitude',
+        units='degrees')
+    lon = iris.coords.DimCoord(
+        np.linspace(0., 360., shape[1], endpoint=False),
+        standard_name='longitude',
+        units='degrees')
+    time_coord = iris.coords.DimCoord(
+        np.arange(n_times) + .5, standard_name='time', units=TIME_UNITS)
+    data = da.random.RandomState(seed).random_sample(
+        (n_times, ) + tuple(shape), chunks=(100, ) + tuple(shape))
+    return iris.cube.Cube(
+        data.astype(np.float32),
+        var_name='tas',
+        units='K',
+        dim_coords_and_dims=[(time_coord, 0), (lat, 1), (lon, 2)])
+
+
+def _legacy_save(cube, filename, optimize_access):
+    """Save with chunks of length one outside the accessed dimensions."""
+    if optimize_access == 'map':
+        dims = {1, 2}
+    else:
+        dims = {0}
+    chunksizes = tuple(length if dim in dims else 1
+                       for dim, length in enumerate(cube.shape))
+    iris.save(cube, filename, zlib=True, chunksizes=chunksizes)
+
+
+def _read(filename, optimize_access):
+    """Read all maps or all time series from a file, one at a time."""
+    start = time.time()
+    with netCDF4.Dataset(filename) as dataset:
+        variable = dataset.variables['tas']
+        if optimize_access == 'map':
+            for i in range(variable.shape[0]):
+                variable[i]
+        else:
+            for j in range(variable.shape[1]):
+                for k in range(variable.shape[2]):
+                    variable[:, j, k]
+    return time.time() - start
+
+
+def benchmark_chunks(name, cube, optimize_access, tmp_dir):
+    """Compare reading files saved with legacy and new chunks."""
+    legacy_file = os.path.join(tmp_dir, 'legacy_' + optimize_access + '.nc')
+    new_file = os.path.join(tmp_dir, optimize_access + '.nc')
+    start = time.time()
+    _legacy_save(cube, legacy_file, optimize_access)
+    legacy_save_time = time.time() - start
+    start = time.time()
+    save([cube], new_file, optimize_access=optimize_access, compress=True)
+    new_save_time = time.time() - start
+
+    with netCDF4.Dataset(legacy_file) as expected, \
+            netCDF4.Dataset(new_file) as result:
+        np.testing.assert_array_equal(result.variables['tas'][:],
+                                      expected.variables['tas'][:])
+
+    legacy_time = _read(legacy_file, optimize_access)
+    new_time = _read(new_file, optimize_access)
+    print("{:<40} save legacy {:6.2f} s, new {:6.2f} s; read legacy "
+          "{:6.2f} s, new {:6.2f} s, speedup {:6.1f}x".format(
+              name, legacy_save_time, new_save_time, legacy_time, new_time,
+              legacy_time / new_time))
+
+
+def _run_task(input_files, tmp_dir, max_parallel_writes):
+    """Regrid and save datasets with a preprocessing task."""
+    output_dir = os.path.join(tmp_dir,
+                              'writers_{}'.format(max_parallel_writes))
+    settings = {
+        'load': {
+            'callback': concatenate_callback
+        },
+        'concatenate': {},
+        'regrid': {
+            'target_grid': create_cube(1, (180, 360))[0],
+            'scheme': 'linear'
+        },
+        'save': {
+            'compress': True
+        },
+    }
+    products = [
+        PreprocessorFile(
+            attributes={
+                'filename': os.path.join(output_dir,
+                                         os.path.basename(filename))
+            },
+            settings=settings,
+            ancestors=[TrackedFile(filename, attributes={})])
+        for filename in input_files
+    ]
+    task = PreprocessingTask(
+        products, max_parallel_writes=max_parallel_writes)
+    start = time.time()
+    task._preprocess(task.products)  # pylint: disable=protected-access
+    return time.time() - start, sorted(p.filename for p in products)
+
+
+def benchmark_writers(name, n_datasets, n_times, shape, tmp_dir):
+    """Compare saving datasets sequentially and from writer threads."""
+    input_files = []
+    for i in range(n_datasets):
+        filename = os.path.join(tmp_dir, 'input', 'tas_{}.nc'.format(i))
+        save([create_cube(n_times, shape, seed=i)], filename)
+        input_files.append(filename)
+    legacy_time, expected = _run_task(input_files, tmp_dir, 1)
+    new_time, result = _run_task(input_files, tmp_dir, 2)
+    for expected_file, result_file in zip(expected, result):
+        with netCDF4.Dataset(expected_file) as expected_data, \
+                netCDF4.Dataset(result_file) as result_data:
+            np.testing.assert_array_equal(
+                result_data.variables['tas'][:],
+                expected_data.variables['tas'][:])
+    print("{:<40} sequential {:8.2f} s, 2 writers {:8.2f} s, "
+          "speedup {:6.1f}x".format(name, legacy_time, new_time,
+                                    legacy_time / new_time))
+
+
+def main():
+    """Run the benchmarks."""
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        cube = create_cube(3600, (45, 90))
+        benchmark_chunks('maps, 3600 days 2x4 degree', cube, 'map', tmp_dir)
+        benchmark_chunks('time series, 3600 days 2x4 degree', cube,
+                         'timeseries', tmp_dir)
+        benchmark_writers('4 datasets, 360 days 4x4 to 1x1 degree', 4, 360,
+                          (45, 90), tmp_dir)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
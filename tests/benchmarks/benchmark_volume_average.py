@@ -0,0 +1,143 @@
+"""Benchmark of the volume average.
+
+Compares :func:`esmvaltool.preprocessor._volume_pp.volume_average` with the
+implementation looping over time steps and depth levels it replaced, on a
+synthetic grid the size of the ORCA1 and ORCA025 ocean grids. Checks that
+both give the same results and prints their run times.
+
+Run with::
+
+    python tests/benchmarks/benchmark_volume_average.py
+
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+
+from esmvaltool.preprocessor._fx import load_fx_cube
+from esmvaltool.preprocessor._volume_pp import volume_average
+
+TIME_UNITS = Unit('days since 1950-01-01', calendar='gregorian')
+
+
+# The implementation of the volume average before it was vectorised
+def _legacy_volume_average(cube, coordz, coord1, coord2, grid_volume):
+    """Determine the volume average one time step and level at a time."""
+    t_dim = cube.coord_dims('time')[0]
+    result = []
+    for time_itr in range(cube.shape[t_dim]):
+        column = []
+        depth_volume = []
+        for z_itr in range(cube.shape[1]):
+            total = cube[time_itr, z_itr].collapsed(
+                [coordz, coord1, coord2],
+                iris.analysis.MEAN,
+                weights=grid_volume[time_itr, z_itr]).data
+            column.append(total)
+            try:
+                layer_vol = np.ma.masked_where(
+                    cube[time_itr, z_itr].data.mask,
+                    grid_volume[time_itr, z_itr]).sum()
+            except AttributeError:
+                layer_vol = grid_volume.sum()
+            depth_volume.append(layer_vol)
+        result.append(np.average(column, weights=depth_volume))
+    return np.array(result)
+
+
+def create_cube(n_months, n_levels, shape, seed=0):
+    """Create a monthly cube on a curvilinear grid with land masked."""
+    random = np.random.RandomState(seed)
+    times = iris.coords.DimCoord(
+        np.arange(n_months) * 30. + 15.,
+        bounds=np.stack([np.arange(n_months) * 30.,
+                         np.arange(n_months) * 30. + 30.], axis=-1),
+        standard_name='time',
+        units=TIME_UNITS)
+    depth_bounds = np.linspace(0., 5000., n_levels + 1)**2 / 5000.
+    depth = iris.coords.DimCoord(
+        depth_bounds[:-1] + np.diff(depth_bounds) / 2.,
+        bounds=np.stack([depth_bounds[:-1], depth_bounds[1:]], axis=-1),
+        standard_name='depth',
+        units='m')
+    j_index = iris.coords.DimCoord(
+        np.arange(shape[0]), var_name='j', units='1')
+    i_index = iris.coords.DimCoord(
+        np.arange(shape[1]), var_name='i', units='1')
+    lons, lats = np.meshgrid(
+        np.linspace(0., 360., shape[1], endpoint=False),
+        np.linspace(-78., 89., shape[0]))
+    # Distort the grid a bit, like the tripolar ORCA grids
+    lats = lats + 2. * np.sin(np.radians(lons))
+    lats = iris.coords.AuxCoord(
+        lats, standard_name='latitude', units='degrees')
+    lons = iris.coords.AuxCoord(
+        lons, standard_name='longitude', units='degrees')
+
+    data_shape = (n_months, n_levels) + tuple(shape)
+    data = random.uniform(-2., 30., data_shape).astype(np.float32)
+    # Land and sea floor: deeper levels have less ocean
+    bathymetry = random.uniform(0., 1.2, shape) * n_levels
+    land = np.arange(n_levels)[:, None, None] >= bathymetry[None]
+    mask = np.broadcast_to(land, data_shape)
+    cube = iris.cube.Cube(
+        np.ma.array(data, mask=mask),
+        var_name='thetao',
+        units='degC',
+        dim_coords_and_dims=[(times, 0), (depth, 1), (j_index, 2),
+                             (i_index, 3)],
+        aux_coords_and_dims=[(lats, (2, 3)), (lons, (2, 3))])
+
+    area = random.uniform(0.5e9, 1.5e10, shape)
+    volume = area[None] * np.diff(depth_bounds)[:, None, None]
+    volume = np.ma.array(volume, mask=land)
+    volcello = iris.cube.Cube(volume, var_name='volcello', units='m3')
+    return cube, volcello
+
+
+def benchmark(name, n_months, n_levels, shape):
+    """Run and compare both implementations."""
+    cube, volcello = create_cube(n_months, n_levels, shape)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        fx_file = os.path.join(tmp_dir, 'volcello.nc')
+        iris.save(volcello, fx_file)
+        # Both implementations start from the volumes in memory
+        load_fx_cube(fx_file)
+
+        start = time.time()
+        grid_volume = np.tile(volcello.data, [n_months, 1, 1, 1])
+        expected = _legacy_volume_average(cube, 'depth', 'latitude',
+                                          'longitude', grid_volume)
+        legacy_time = time.time() - start
+
+        start = time.time()
+        result = volume_average(
+            cube, 'depth', 'latitude', 'longitude',
+            fx_files={'volcello': fx_file})
+        new_time = time.time() - start
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    np.testing.assert_allclose(result.data, expected, rtol=1e-6)
+    assert result.coord('time') == cube.coord('time')
+    print("{:<40} legacy {:8.2f} s, vectorised {:8.2f} s, "
+          "speedup {:6.1f}x".format(name, legacy_time, new_time,
+                                    legacy_time / new_time))
+
+
+def main():
+    """Run the benchmarks."""
+    benchmark('ORCA1-like, 75 levels, 1 year', 12, 75, (292, 362))
+    benchmark('ORCA025-like, 75 levels, 1 month', 1, 75, (1021, 1442))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,17 @@
 """Integration tests for the variable_info module"""
 
+import glob
 import os
+import shutil
+import tempfile
 import unittest
 
+import mock
+
 from esmvaltool.cmor.table import CMIP5Info, CMIP6Info, CustomInfo
 
+PARSED_TABLES = 'esmvaltool.cmor.table._PARSED_TABLES'
+
 
 class TestCMIP6Info(unittest.TestCase):
     """Test for the CMIP6 info class."""
@@ -133,3 +140,67 @@ class TestCustomInfo(unittest.TestCase):
     def test_get_bad_variable(self):
         """Get none if a variable is not in the given table."""
         self.assertIsNone(self.variables_info.get_variable('Omon', 'badvar'))
+
+
+class TestCompiledIndex(unittest.TestCase):
+    """Test lazy loading and the compiled index of the tables."""
+
+    def setUp(self):
+        """Prepare a tables directory and an index directory."""
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_dir = os.path.join(self.tmp_dir, 'index')
+        cwd = os.path.dirname(os.path.realpath(__file__))
+        tables_dir = os.path.join(self.tmp_dir, 'cmip5', 'Tables')
+        os.makedirs(tables_dir)
+        for mip in ('Amon', 'Omon'):
+            shutil.copy(
+                os.path.join(cwd, '..', '..', '..', 'esmvaltool', 'cmor',
+                             'tables', 'cmip5', 'Tables', 'CMIP5_' + mip),
+                tables_dir)
+        self.tables_path = os.path.dirname(tables_dir)
+
+    def tearDown(self):
+        """Remove the temporary directories."""
+        shutil.rmtree(self.tmp_dir)
+
+    def _get_tas(self):
+        """Read the tables and get tas from a fresh info object."""
+        info = CMIP5Info(self.tables_path, index_dir=self.index_dir)
+        return info, info.get_variable('Amon', 'tas')
+
+    @mock.patch.dict(PARSED_TABLES, clear=True)
+    def test_lazy_loading(self):
+        """Only the requested table is read."""
+        info, var = self._get_tas()
+        self.assertEqual(var.short_name, 'tas')
+        self.assertEqual(len(glob.glob(os.path.join(self.index_dir, '*'))), 1)
+        self.assertIn('thetao', info.tables['Omon'])
+        self.assertEqual(len(glob.glob(os.path.join(self.index_dir, '*'))), 2)
+
+    def test_index_reused(self):
+        """The index is used by later runs."""
+        with mock.patch.dict(PARSED_TABLES, clear=True):
+            self._get_tas()
+        with mock.patch.dict(PARSED_TABLES, clear=True):
+            with mock.patch.object(CMIP5Info, '_read_table') as read:
+                _, var = self._get_tas()
+        read.assert_not_called()
+        self.assertEqual(var.short_name, 'tas')
+        self.assertEqual(var.coordinates['time'].standard_name, 'time')
+
+    def test_index_invalidated(self):
+        """Tables are read again when the file changes."""
+        with mock.patch.dict(PARSED_TABLES, clear=True):
+            self._get_tas()
+        table_file = os.path.join(self.tables_path, 'Tables', 'CMIP5_Amon')
+        stat = os.stat(table_file)
+        os.utime(table_file, (stat.st_atime, stat.st_mtime + 10))
+        with mock.patch.dict(PARSED_TABLES, clear=True):
+            with mock.patch.object(
+                    CMIP5Info, '_read_table',
+                    autospec=True,
+                    side_effect=CMIP5Info._read_table) as read:
+                _, var = self._get_tas()
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(var.short_name, 'tas')
+        self.assertEqual(len(glob.glob(os.path.join(self.index_dir, '*'))), 2)
@@ -5,8 +5,9 @@ from __future__ import absolute_import, division, print_function
 import unittest
 
 import numpy as np
-from iris.coords import DimCoord
-from iris.cube import Cube
+from cf_units import Unit
+from iris.coords import AuxCoord, DimCoord
+from iris.cube import Cube, CubeList
 from iris.exceptions import ConcatenateError
 
 from esmvaltool.preprocessor import _io
@@ -51,6 +52,63 @@ class TestConcatenate(unittest.TestCase):
         with self.assertRaises(ConcatenateError):
             _io.concatenate(self.raw_cubes)
 
+    def _get_time_cubes(self):
+        """Get cubes with 3 time steps each, in random order."""
+        cubes = []
+        for year in (1952, 1950, 1951):
+            days = (year - 1950) * 360. + np.arange(0., 360., 120.)
+            time = DimCoord(
+                days + 60.,
+                bounds=np.stack([days, days + 120.], axis=-1),
+                standard_name='time',
+                units=Unit('days since 1950-01-01', calendar='360_day'))
+            lat = DimCoord(
+                [0., 10.], standard_name='latitude', units='degrees')
+            year_coord = AuxCoord([year] * 3, long_name='year', units='1')
+            data = np.ma.masked_greater(
+                np.arange(6.).reshape(3, 2) + year * 10., year * 10. + 4.)
+            cubes.append(
+                Cube(
+                    data,
+                    var_name='sample',
+                    units='K',
+                    attributes={'source_file': '{}.nc'.format(year)},
+                    dim_coords_and_dims=((time, 0), (lat, 1)),
+                    aux_coords_and_dims=((year_coord, 0), )))
+        return cubes
+
+    def test_concatenate_time(self):
+        """Test concatenation of cubes in random order along time."""
+        cubes = self._get_time_cubes()
+        _io._fix_cube_attributes(cubes)  # noqa
+        expected = CubeList(cubes).concatenate_cube()
+        concatenated = _io.concatenate(self._get_time_cubes())
+        self.assertTrue(concatenated.has_lazy_data())
+        self.assertEqual(concatenated.coords(), expected.coords())
+        # Attributes are joined in the order of the input cubes
+        self.assertEqual(concatenated.attributes['source_file'],
+                         '1952.nc;1950.nc;1951.nc')
+        np.testing.assert_array_equal(concatenated.coord('year').points,
+                                      [1950] * 3 + [1951] * 3 + [1952] * 3)
+        np.testing.assert_array_equal(
+            np.ma.getmaskarray(concatenated.data),
+            np.ma.getmaskarray(expected.data))
+        np.testing.assert_array_equal(concatenated.data, expected.data)
+
+    def test_concatenate_time_overlapping(self):
+        """Test exception raised if cubes overlap in time."""
+        cubes = self._get_time_cubes()
+        cubes.append(cubes[0].copy())
+        with self.assertRaises(ConcatenateError):
+            _io.concatenate(cubes)
+
+    def test_concatenate_time_different_grid(self):
+        """Test exception raised if cubes have different grids."""
+        cubes = self._get_time_cubes()
+        cubes[1].coord('latitude').points = [0., 20.]
+        with self.assertRaises(ConcatenateError):
+            _io.concatenate(cubes)
+
     def test_fix_attributes(self):
         """Test fixing attributes for concatenation."""
         identical_attrs = {
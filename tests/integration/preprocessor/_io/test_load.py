@@ -4,14 +4,18 @@ from __future__ import absolute_import, division, print_function
 
 import os
 import tempfile
+import threading
 import unittest
 
 import iris
+import mock
 import numpy as np
+from cf_units import Unit
 from iris.coords import DimCoord
 from iris.cube import Cube
 
-from esmvaltool.preprocessor._io import concatenate_callback, load
+from esmvaltool.preprocessor._io import (IO_LOCK, concatenate_callback, load,
+                                         realise)
 
 
 def _create_sample_cube():
@@ -20,6 +24,31 @@ def _create_sample_cube():
     return cube
 
 
+def _create_yearly_cube():
+    """Create a cube with a time step per year from 1950 to 1959."""
+    time = DimCoord(
+        np.arange(10) * 360. + 180.,
+        bounds=np.stack([np.arange(10), np.arange(1, 11)], axis=-1) * 360.,
+        standard_name='time',
+        units=Unit('days since 1950-01-01', calendar='360_day'))
+    lat = DimCoord([1, 2], standard_name='latitude', units='degrees_north')
+    cube = Cube(
+        np.arange(20.).reshape(10, 2),
+        var_name='sample',
+        dim_coords_and_dims=((time, 0), (lat, 1)))
+    return cube
+
+
+TIME_RANGE = {
+    'start_year': 1953,
+    'start_month': 1,
+    'start_day': 1,
+    'end_year': 1956,
+    'end_month': 1,
+    'end_day': 1,
+}
+
+
 class TestLoad(unittest.TestCase):
     """Tests for :func:`esmvaltool.preprocessor.load`."""
 
@@ -85,3 +114,95 @@ class TestLoad(unittest.TestCase):
         self.assertTrue((cube.coord('latitude').points == np.array([1,
                                                                     2])).all())
         self.assertEquals(cube.coord('latitude').units, 'degrees_north')
+
+    def test_load_time_range(self):
+        """Test only reading the time steps in a period."""
+        temp_file = self._save_cube(_create_yearly_cube())
+
+        cubes = load(temp_file, time_range=TIME_RANGE)
+        cube = cubes[0]
+        self.assertEqual(1, len(cubes))
+        self.assertEqual(temp_file, cube.attributes['source_file'])
+        # 1953 to 1955 and one extra year on either side
+        years = [d.year for d in cube.coord('time').units.num2date(
+            cube.coord('time').points)]
+        self.assertEqual(years, [1952, 1953, 1954, 1955, 1956])
+        np.testing.assert_array_equal(cube.data,
+                                      np.arange(4., 14.).reshape(5, 2))
+
+    def test_load_time_range_no_overlap(self):
+        """Test loading a file that does not overlap with the period."""
+        cube = _create_yearly_cube()[:2]
+        temp_file = self._save_cube(cube)
+
+        cubes = load(temp_file, time_range=TIME_RANGE)
+        self.assertEqual(cubes[0].shape, (2, 2))
+
+    def test_load_time_range_no_time(self):
+        """Test loading a file without time dimension."""
+        temp_file = self._save_cube(_create_sample_cube())
+
+        cubes = load(temp_file, time_range=TIME_RANGE)
+        self.assertEqual(cubes[0].shape, (2, ))
+
+    def test_load_region(self):
+        """Test only reading the grid cells and depths in a region."""
+        lat = DimCoord(
+            np.linspace(-80., 80., 9),
+            standard_name='latitude',
+            units='degrees_north')
+        lon = DimCoord(
+            np.linspace(0., 340., 18),
+            standard_name='longitude',
+            units='degrees_east')
+        depth = DimCoord([5., 15., 25., 35.], standard_name='depth', units='m')
+        cube = Cube(
+            np.arange(4. * 9 * 18).reshape(4, 9, 18),
+            var_name='sample',
+            dim_coords_and_dims=((depth, 0), (lat, 1), (lon, 2)))
+        temp_file = self._save_cube(cube)
+        region = {
+            'start_longitude': 45.,
+            'end_longitude': 85.,
+            'start_latitude': -15.,
+            'end_latitude': 25.,
+        }
+
+        cubes = load(
+            temp_file,
+            region=region,
+            depth_range={
+                'z_min': 0.,
+                'z_max': 20.
+            })
+        # One extra grid cell and level on either side
+        np.testing.assert_array_equal(
+            cubes[0].coord('longitude').points, [40., 60., 80., 100.])
+        np.testing.assert_array_equal(
+            cubes[0].coord('latitude').points, [-20., 0., 20., 40.])
+        np.testing.assert_array_equal(
+            cubes[0].coord('depth').points, [5., 15., 25.])
+        np.testing.assert_array_equal(cubes[0].data,
+                                      cube[:3, 3:7, 2:6].data)
+
+    def test_load_io_lock(self):
+        """Test that files are read while holding the I/O lock."""
+        temp_file = self._save_cube(_create_sample_cube())
+        acquired = []
+        iris_load_raw = iris.load_raw
+
+        def load_raw(*args, **kwargs):
+            """Try to get the lock from another thread while loading."""
+            thread = threading.Thread(
+                target=lambda: acquired.append(IO_LOCK.acquire(False)))
+            thread.start()
+            thread.join()
+            return iris_load_raw(*args, **kwargs)
+
+        with mock.patch.object(iris, 'load_raw', side_effect=load_raw):
+            cubes = load(temp_file)
+        self.assertEqual(acquired, [False])
+
+        realise(cubes)
+        self.assertFalse(cubes[0].has_lazy_data())
+        np.testing.assert_array_equal(cubes[0].data, [1, 2])
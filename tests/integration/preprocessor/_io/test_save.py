@@ -80,7 +80,8 @@ class TestSave(unittest.TestCase):
     def test_save_optimized_map(self):
         """Test save"""
         cube, filename = self._create_sample_cube()
-        path = save([cube], filename, optimize_access='map')
+        path = save(
+            [cube], filename, optimize_access='map', chunk_size=1)
         loaded_cube = iris.load_cube(path)
         self._compare_cubes(cube, loaded_cube)
         self._check_chunks(path, [2, 2, 1])
@@ -88,7 +89,8 @@ class TestSave(unittest.TestCase):
     def test_save_optimized_timeseries(self):
         """Test save"""
         cube, filename = self._create_sample_cube()
-        path = save([cube], filename, optimize_access='timeseries')
+        path = save(
+            [cube], filename, optimize_access='timeseries', chunk_size=1)
         loaded_cube = iris.load_cube(path)
         self._compare_cubes(cube, loaded_cube)
         self._check_chunks(path, [1, 1, 2])
@@ -96,7 +98,8 @@ class TestSave(unittest.TestCase):
     def test_save_optimized_lat(self):
         """Test save"""
         cube, filename = self._create_sample_cube()
-        path = save([cube], filename, optimize_access='latitude')
+        path = save(
+            [cube], filename, optimize_access='latitude', chunk_size=1)
         loaded_cube = iris.load_cube(path)
         self._compare_cubes(cube, loaded_cube)
         expected_chunks = [2, 1, 1]
@@ -111,11 +114,46 @@ class TestSave(unittest.TestCase):
     def test_save_optimized_lon_time(self):
         """Test save"""
         cube, filename = self._create_sample_cube()
-        path = save([cube], filename, optimize_access='longitude time')
+        path = save(
+            [cube], filename, optimize_access='longitude time', chunk_size=1)
         loaded_cube = iris.load_cube(path)
         self._compare_cubes(cube, loaded_cube)
         self._check_chunks(path, [1, 2, 2])
 
+    def test_save_optimized_map_chunk_size(self):
+        """Test save adds whole maps to the chunks up to the chunk size"""
+        cube, filename = self._create_sample_cube()
+        cube = cube[:, :, [0, 1, 0, 1, 0]]
+        # Two maps of 2x2 double precision values
+        path = save([cube], filename, optimize_access='map', chunk_size=64)
+        self._check_chunks(path, [2, 2, 2])
+
+    def test_save_optimized_default_chunk_size(self):
+        """Test save puts small data in one chunk by default"""
+        cube, filename = self._create_sample_cube()
+        path = save([cube], filename, optimize_access='timeseries')
+        self._check_chunks(path, [2, 2, 2])
+
+    def test_save_zlib_chunks(self):
+        """Test save chunks compressed data by rows"""
+        cube, filename = self._create_sample_cube()
+        path = save([cube], filename, compress=True, chunk_size=32)
+        self._check_chunks(path, [1, 2, 2])
+
+    def test_save_zlib_complevel(self):
+        """Test save with compression level and without shuffle filter"""
+        cube, filename = self._create_sample_cube()
+        path = save(
+            [cube], filename, compress=True, complevel=1, shuffle=False)
+        loaded_cube = iris.load_cube(path)
+        self._compare_cubes(cube, loaded_cube)
+        handler = netCDF4.Dataset(path, 'r')
+        sample_filters = handler.variables['sample'].filters()
+        self.assertTrue(sample_filters['zlib'])
+        self.assertFalse(sample_filters['shuffle'])
+        self.assertEqual(sample_filters['complevel'], 1)
+        handler.close()
+
     def _compare_cubes(self, cube, loaded_cube):
         self.assertTrue((cube.data == loaded_cube.data).all())
         for coord in cube.coords():
@@ -9,16 +9,22 @@ module.
 from __future__ import absolute_import, division, print_function
 
 import os
+import shutil
 import tempfile
 import unittest
 
 import iris
+import mock
 import numpy as np
+import shapely.vectorized
 
 import tests
-from esmvaltool.preprocessor import (PreprocessorFile, mask_fillvalues,
+from esmvaltool.preprocessor import (PreprocessorFile, _mask, mask_fillvalues,
                                      mask_landsea, mask_landseaice)
 
+OCEAN_SHAPEFILE = os.path.join(
+    os.path.dirname(_mask.__file__), 'ne_masks', 'ne_50m_ocean.shp')
+
 
 class Test(tests.Test):
     """Test class"""
@@ -144,5 +150,50 @@ class Test(tests.Test):
         self.assertArrayEqual(result_1.data, data_1)
 
 
+class TestNaturalEarthMask(tests.Test):
+    """Test rasterising and caching Natural Earth masks"""
+
+    def setUp(self):
+        """Define a grid with points on the tile boundaries"""
+        self.lons = np.arange(-178.5, 180., 3.)
+        self.lons[[50, 60]] = [-30., 0.]
+        self.lats = np.arange(-88.5, 90., 3.)
+        self.lats[[20, 30]] = [-30., 0.]
+        self.masks_dir = tempfile.mkdtemp()
+        _mask._SHP_MASKS.clear()
+
+    def tearDown(self):
+        """Remove the masks directory"""
+        shutil.rmtree(self.masks_dir)
+        _mask._SHP_MASKS.clear()
+
+    def test_rasterise(self):
+        """Test that rasterising by tiles finds the same points"""
+        geometry = _mask._get_geometry_from_shp(OCEAN_SHAPEFILE)
+        result = _mask._rasterise(geometry, self.lons, self.lats)
+        x_p, y_p = np.meshgrid(self.lons, self.lats)
+        expected = shapely.vectorized.contains(geometry, x_p, y_p)
+        self.assertArrayEqual(result, expected)
+        self.assertTrue(result.any() and not result.all())
+
+    def test_mask_stored(self):
+        """Test that masks are computed once for every grid"""
+        with mock.patch.object(
+                _mask, '_rasterise', wraps=_mask._rasterise) as rasterise:
+            mask = _mask._get_shp_mask(OCEAN_SHAPEFILE, self.lons,
+                                       self.lats, self.masks_dir)
+            _mask._get_shp_mask(OCEAN_SHAPEFILE, self.lons, self.lats,
+                                self.masks_dir)
+            _mask._SHP_MASKS.clear()
+            result = _mask._get_shp_mask(OCEAN_SHAPEFILE, self.lons,
+                                         self.lats, self.masks_dir)
+            self.assertEqual(rasterise.call_count, 1)
+            self.assertArrayEqual(result, mask)
+
+            _mask._get_shp_mask(OCEAN_SHAPEFILE, self.lons[1:], self.lats,
+                                self.masks_dir)
+            self.assertEqual(rasterise.call_count, 2)
+
+
 if __name__ == '__main__':
     unittest.main()
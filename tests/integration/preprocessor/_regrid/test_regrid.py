@@ -6,14 +6,16 @@ function.
 
 from __future__ import absolute_import, division, print_function
 
+import threading
 import unittest
 
 import iris
+import mock
 import numpy as np
 from numpy import ma
 
 import tests
-from esmvaltool.preprocessor import regrid
+from esmvaltool.preprocessor import _regrid, regrid
 from tests.unit.preprocessor._regrid import _make_cube
 
 
@@ -151,6 +153,82 @@ class Test(tests.Test):
         expected = np.array([1.499886, 5.499886, 9.499886])
         self.assertArrayAlmostEqual(result.data, expected)
 
+    def _make_grid(self, points):
+        lons = iris.coords.DimCoord(
+            points,
+            standard_name='longitude',
+            units='degrees_east',
+            coord_system=self.cs)
+        lats = iris.coords.DimCoord(
+            points,
+            standard_name='latitude',
+            units='degrees_north',
+            coord_system=self.cs)
+        coords_spec = [(lats, 0), (lons, 1)]
+        return iris.cube.Cube(
+            np.empty((len(points), len(points))),
+            dim_coords_and_dims=coords_spec)
+
+    def test_regrid__reuse_regridder(self):
+        _regrid._REGRIDDER_CACHE.clear()
+        grid = self._make_grid([1.5])
+        scheme = _regrid.HORIZONTAL_SCHEMES['linear'].scheme
+        with mock.patch.object(
+                scheme, 'regridder', wraps=scheme.regridder) as regridder:
+            result = regrid(self.cube, grid, 'linear')
+            self.assertArrayEqual(result.data, [[[1.5]], [[5.5]], [[9.5]]])
+            result = regrid(self.cube[:1] * 2, grid, 'linear')
+            self.assertArrayEqual(result.data, [[[3.]]])
+            self.assertEqual(regridder.call_count, 1)
+
+            regrid(self.cube, self._make_grid([1.6]), 'linear')
+            self.assertEqual(regridder.call_count, 2)
+        self.assertEqual(len(_regrid._REGRIDDER_CACHE), 2)
+
+    def test_regrid__coord_metadata(self):
+        _regrid._REGRIDDER_CACHE.clear()
+        grid = self._make_grid([1.5])
+        other = self.cube.copy()
+        other.coord('longitude').var_name = 'lon_other'
+        for scheme in ('linear', 'nearest'):
+            regrid(self.cube, grid, scheme)
+            result = regrid(other, grid, scheme)
+            self.assertEqual(result.shape, (3, 1, 1))
+        self.assertEqual(len(_regrid._REGRIDDER_CACHE), 4)
+
+    @mock.patch('esmvaltool.preprocessor._regrid.MAX_CACHED_REGRIDDERS', 2)
+    def test_regrid__evict_regridder(self):
+        _regrid._REGRIDDER_CACHE.clear()
+        grids = [self._make_grid([point]) for point in (1.2, 1.4, 1.6)]
+        for grid in grids:
+            regrid(self.cube, grid, 'nearest')
+        regrid(self.cube, grids[1], 'nearest')
+        keys = [key[-1] for key in _regrid._REGRIDDER_CACHE]
+        self.assertEqual(
+            keys, [_regrid._get_grid_key(grid) for grid in grids[2:0:-1]])
+
+    @mock.patch('esmvaltool.preprocessor._regrid.MAX_CACHED_REGRIDDERS', 1)
+    def test_regrid__threads(self):
+        _regrid._REGRIDDER_CACHE.clear()
+        grids = [self._make_grid([point]) for point in (1.2, 1.4)]
+        errors = []
+
+        def run():
+            try:
+                for _ in range(20):
+                    for grid in grids:
+                        regrid(self.cube, grid, 'nearest')
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(_regrid._REGRIDDER_CACHE), 1)
+
     def test_regrid__unstructured_nearest(self):
         data = np.empty((1, 1))
         lons = iris.coords.DimCoord(
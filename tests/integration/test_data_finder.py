@@ -7,6 +7,8 @@ import pytest
 import yaml
 
 import esmvaltool._config
+import esmvaltool._data_finder
+from esmvaltool._catalogue import Catalogue
 from esmvaltool._data_finder import (get_input_filelist, get_input_fx_filelist,
                                      get_output_file)
 from esmvaltool.cmor.table import read_cmor_tables
@@ -94,6 +96,26 @@ def test_get_input_filelist(root, cfg):
     assert sorted(input_filelist) == sorted(reference)
 
 
+@pytest.mark.parametrize('cfg', CONFIG['get_input_filelist'])
+def test_get_input_filelist_from_catalogue(root, cfg, monkeypatch):
+    """Test retrieving input filelist from the catalogue."""
+    create_tree(root, cfg.get('available_files'),
+                cfg.get('available_symlinks'))
+    catalogue = Catalogue(os.path.join(os.path.dirname(root), 'catalogue'))
+    catalogue.update(root)
+    monkeypatch.setattr(esmvaltool._data_finder, 'get_catalogue',
+                        lambda: catalogue)
+
+    # Find files
+    rootpath = {cfg['variable']['project']: [root]}
+    drs = {cfg['variable']['project']: cfg['drs']}
+    input_filelist = get_input_filelist(cfg['variable'], rootpath, drs)
+
+    # Test result
+    reference = [os.path.join(root, file) for file in cfg['found_files']]
+    assert sorted(input_filelist) == sorted(reference)
+
+
 @pytest.mark.parametrize('cfg', CONFIG['get_input_fx_filelist'])
 def test_get_input_fx_filelist(root, cfg):
     """Test retrieving fx filelist."""
@@ -1,4 +1,6 @@
 import os
+import threading
+import time
 from pprint import pformat
 from textwrap import dedent
 
@@ -9,12 +11,13 @@ from mock import create_autospec
 from six import text_type
 
 import esmvaltool
-from esmvaltool._recipe import TASKSEP, read_recipe_file
+from esmvaltool._recipe import (MAX_DISCOVERY_THREADS, TASKSEP,
+                                _map_in_threads, read_recipe_file)
 from esmvaltool._task import DiagnosticTask
 from esmvaltool.diag_scripts.shared import (
     ProvenanceLogger, get_diagnostic_filename, get_plot_filename)
 from esmvaltool.preprocessor import DEFAULT_ORDER, PreprocessingTask
-from esmvaltool.preprocessor._io import concatenate_callback
+from esmvaltool.preprocessor._io import IO_LOCK, concatenate_callback
 
 from .test_diagnostic_run import write_config_user_file
 from .test_provenance import check_provenance
@@ -112,8 +115,10 @@ def patched_datafinder(tmp_path, monkeypatch):
         else:
             filenames.append(filename)
 
-        for file in filenames:
-            create_test_file(file, next(tracking_id))
+        # Input files are looked for from several threads at once
+        with IO_LOCK:
+            for file in filenames:
+                create_test_file(file, next(tracking_id))
         return filenames
 
     monkeypatch.setattr(esmvaltool._data_finder, 'find_files', find_files)
@@ -261,8 +266,15 @@ def test_default_preprocessor(tmp_path, patched_datafinder, config_user):
         'CMIP5_CanESM2_Oyr_historical_r1i1p1_TO3Y_chl_2000-2005_fixed')
     defaults = {
         'load': {
-            'callback':
-            concatenate_callback,
+            'callback': concatenate_callback,
+            'time_range': {
+                'start_year': 2000,
+                'end_year': 2006,
+                'start_month': 1,
+                'end_month': 1,
+                'start_day': 1,
+                'end_day': 1,
+            },
         },
         'concatenate': {},
         'fix_file': {
@@ -318,6 +330,64 @@ def test_default_preprocessor(tmp_path, patched_datafinder, config_user):
     assert product.settings == defaults
 
 
+def test_load_subset(tmp_path, patched_datafinder, config_user):
+
+    content = dedent("""
+        preprocessors:
+          regional:
+            extract_region: &region
+              start_longitude: 10
+              end_longitude: 40
+              start_latitude: -20
+              end_latitude: 30
+            extract_volume:
+              z_min: 0
+              z_max: 100
+          regridded:
+            regrid:
+              target_grid: 1x1
+              scheme: linear
+            extract_region: *region
+
+        diagnostics:
+          regional:
+            variables:
+              chl: &chl
+                preprocessor: regional
+                project: CMIP5
+                mip: Oyr
+                exp: historical
+                start_year: 2000
+                end_year: 2005
+                field: TO3Y
+                ensemble: r1i1p1
+                additional_datasets:
+                  - {dataset: CanESM2}
+            scripts: null
+          regridded:
+            variables:
+              chl:
+                <<: *chl
+                preprocessor: regridded
+                additional_datasets:
+                  - {dataset: MPI-ESM-LR}
+            scripts: null
+        """)
+
+    recipe = get_recipe(tmp_path, content, config_user)
+
+    assert len(recipe.tasks) == 2
+    for task in recipe.tasks:
+        product = next(iter(task.products))
+        load = product.settings['load']
+        if 'regrid' in product.settings:
+            # Regridding needs the full grid
+            assert 'region' not in load
+        else:
+            assert load['region'] == product.settings['extract_region']
+            assert load['depth_range'] == {'z_min': 0, 'z_max': 100}
+
+
 def test_reference_dataset(tmp_path, patched_datafinder, config_user,
                            monkeypatch):
 
@@ -660,3 +730,27 @@ def test_diagnostic_task_provenance(tmp_path, patched_datafinder, config_user):
     prefix = os.path.splitext(product.filename)[0] + '_provenance'
     assert os.path.exists(prefix + '.xml')
     assert os.path.exists(prefix + '.svg')
+
+
+def test_map_in_threads_nested():
+    """Check that nested calls share a limited number of threads."""
+    lock = threading.Lock()
+    running = [0]
+    max_running = [0]
+
+    def inner(item):
+        with lock:
+            running[0] += 1
+            max_running[0] = max(max_running[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return item * 2
+
+    def outer(item):
+        return _map_in_threads(inner, range(item, item + 10))
+
+    result = _map_in_threads(outer, range(0, 40, 10))
+    assert result == [[2 * i for i in range(j, j + 10)]
+                      for j in range(0, 40, 10)]
+    assert 1 < max_running[0] <= MAX_DISCOVERY_THREADS
@@ -0,0 +1,81 @@
+"""Unit tests for the :mod:`esmvaltool.preprocessor._fx` module."""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import iris
+import mock
+import numpy as np
+
+import tests
+from esmvaltool.preprocessor import _fx
+
+
+def _get_mask(fx_data, threshold):
+    return fx_data > threshold
+
+
+class Test(tests.Test):
+    """Test class for the :mod:`esmvaltool.preprocessor._fx` module."""
+
+    def setUp(self):
+        """Write an fx file."""
+        self.temp_dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.temp_dir, 'sftlf.nc')
+        data = np.ma.masked_equal([[10., 60.], [-1., 90.]], -1.)
+        iris.save(iris.cube.Cube(data, var_name='sftlf'), self.filename)
+        _fx.clear_fx_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        _fx.clear_fx_cache()
+
+    def test_load_fx_cube_once(self):
+        """Test that the file is loaded once and the data is shared."""
+        with mock.patch.object(
+                _fx.iris, 'load_cube', wraps=iris.load_cube) as load_cube:
+            cube1 = _fx.load_fx_cube(self.filename)
+            cube2 = _fx.load_fx_cube(self.filename)
+        load_cube.assert_called_once_with(self.filename)
+        self.assertIsNot(cube1, cube2)
+        self.assertTrue(np.shares_memory(cube1.data, cube2.data))
+        self.assertFalse(cube1.data.flags.writeable)
+        with self.assertRaises(ValueError):
+            cube1.data[0, 0] = 0.
+        # Changing the metadata of one cube does not affect the others
+        cube1.var_name = 'sftof'
+        self.assertEqual(cube2.var_name, 'sftlf')
+
+    def test_get_fx_array(self):
+        """Test that derived arrays are computed once."""
+        mask1 = _fx.get_fx_array(self.filename, _get_mask, 50.)
+        mask2 = _fx.get_fx_array(self.filename, _get_mask, 50.)
+        self.assertIs(mask1, mask2)
+        self.assertFalse(mask1.flags.writeable)
+        np.testing.assert_array_equal(
+            np.ma.filled(mask1, False), [[False, True], [False, True]])
+        mask3 = _fx.get_fx_array(self.filename, _get_mask, 70.)
+        np.testing.assert_array_equal(
+            np.ma.filled(mask3, False), [[False, False], [False, True]])
+
+    def test_get_fx_weights(self):
+        """Test that weights are broadcast without copying."""
+        weights = _fx.get_fx_weights(self.filename, (3, 2, 2))
+        self.assertEqual(weights.shape, (3, 2, 2))
+        self.assertEqual(weights.strides[0], 0)
+        np.testing.assert_array_equal(weights[2], [[10., 60.], [0., 90.]])
+
+    def test_evict(self):
+        """Test that the least recently used items are removed."""
+        with mock.patch.object(_fx, 'MAX_CACHED_FX_SIZE', 1):
+            _fx.load_fx_cube(self.filename)
+            _fx.get_fx_array(self.filename, _get_mask, 50.)
+            self.assertEqual(len(_fx._FX_CACHE), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
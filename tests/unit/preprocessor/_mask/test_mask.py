@@ -4,16 +4,21 @@ from __future__ import absolute_import, division, print_function
 
 import unittest
 
+import dask.array as da
 import iris
+import mock
 import numpy as np
 
 import tests
 
+from esmvaltool.preprocessor._mask import _get_fillvalues_mask, count_spells
 from esmvaltool.preprocessor._mask import mask_above_threshold
 from esmvaltool.preprocessor._mask import mask_below_threshold
 from esmvaltool.preprocessor._mask import mask_inside_range
 from esmvaltool.preprocessor._mask import mask_outside_range
 
+CHUNK_SIZE = 'esmvaltool.preprocessor._mask._CHUNK_SIZE'
+
 
 class Test(tests.Test):
     """Test class for _mask"""
@@ -66,5 +71,54 @@ class Test(tests.Test):
         self.assertArrayEqual(result.data, expected)
 
 
+class TestFillvaluesMask(tests.Test):
+    """Test the fillvalues mask computed in chunks of time."""
+
+    def setUp(self):
+        """Prepare tests"""
+        random = np.random.RandomState(0)
+        shape = (23, 3, 4)
+        data = random.normal(size=shape)
+        mask = random.uniform(size=shape) < 0.3
+        mask[:, 0, 0] = True
+        time = iris.coords.DimCoord(
+            np.arange(shape[0], dtype=float),
+            standard_name='time',
+            units='days since 2000-01-01')
+        self.cube = iris.cube.Cube(
+            np.ma.array(data, mask=mask), dim_coords_and_dims=[(time, 0)])
+
+    def _expected(self, time_window):
+        """Compute the mask with the count_spells aggregator."""
+        counts_threshold = int(23 / time_window * 0.3)
+        spell_count = iris.analysis.Aggregator(
+            'spell_count', count_spells, units_func=lambda units: 1)
+        counts = self.cube.collapsed(
+            'time', spell_count, threshold=-0.5, spell_length=time_window)
+        mask = counts.data < counts_threshold
+        return np.ma.getdata(mask) | np.ma.getmaskarray(mask)
+
+    def test_get_fillvalues_mask(self):
+        """Test the mask for several time windows and chunk sizes."""
+        for time_window in (1, 2, 5):
+            expected = self._expected(time_window)
+            for chunk_size in (2**26, 100):
+                with mock.patch(CHUNK_SIZE, chunk_size):
+                    result = _get_fillvalues_mask(
+                        self.cube, 0.3, -0.5, time_window)
+                self.assertArrayEqual(result, expected)
+        self.assertTrue(result[0, 0])
+
+    def test_get_fillvalues_mask_lazy(self):
+        """Test that lazy data is only realised in chunks."""
+        expected = self._expected(2)
+        cube = self.cube.copy(
+            data=da.from_array(self.cube.data, chunks=(5, 3, 4)))
+        with mock.patch(CHUNK_SIZE, 100):
+            result = _get_fillvalues_mask(cube, 0.3, -0.5, 2)
+        self.assertArrayEqual(result, expected)
+        self.assertTrue(cube.has_lazy_data())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,149 @@
+"""Unit tests for :mod:`esmvaltool.preprocessor._multimodel`."""
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import iris
+import iris.coords
+import iris.cube
+import numpy as np
+from cf_units import Unit
+
+import tests
+from esmvaltool.preprocessor._multimodel import (
+    _assemble_full_data, _assemble_overlap_data, _compute_statistic,
+    _get_overlap)
+
+
+def _create_cube(data, times):
+    """Create a (TIME-LAT-LON) cube with monthly time points."""
+    time = iris.coords.DimCoord(
+        times,
+        standard_name='time',
+        units=Unit('days since 1950-01-01', calendar='gregorian'))
+    lat = iris.coords.DimCoord([0., 1.], standard_name='latitude',
+                               units='degrees')
+    lon = iris.coords.DimCoord([0., 1.], standard_name='longitude',
+                               units='degrees')
+    return iris.cube.Cube(
+        np.ma.array(data, dtype=np.float32),
+        var_name='tas',
+        units='K',
+        dim_coords_and_dims=[(time, 0), (lat, 1), (lon, 2)])
+
+
+class TestComputeStatistic(tests.Test):
+    """Tests for _compute_statistic."""
+
+    def setUp(self):
+        """Prepare tests."""
+        self.data = np.ma.array(
+            [[1., 2.], [2., 4.], [3., 9.], [4., 5.]])[..., np.newaxis]
+
+    def test_mean(self):
+        """Test mean."""
+        result = _compute_statistic(self.data, 'mean')
+        self.assertArrayAlmostEqual(result, [[2.5], [5.]])
+
+    def test_median(self):
+        """Test median."""
+        result = _compute_statistic(self.data, 'median')
+        self.assertArrayAlmostEqual(result, [[2.5], [4.5]])
+
+    def test_min_max(self):
+        """Test min and max."""
+        self.assertArrayAlmostEqual(
+            _compute_statistic(self.data, 'min'), [[1.], [2.]])
+        self.assertArrayAlmostEqual(
+            _compute_statistic(self.data, 'max'), [[4.], [9.]])
+
+    def test_std(self):
+        """Test standard deviation."""
+        result = _compute_statistic(self.data, 'std')
+        self.assertArrayAlmostEqual(result, np.std(self.data, axis=0))
+
+    def test_percentile(self):
+        """Test percentiles."""
+        for percent in (0, 10, 50, 75, 100):
+            result = _compute_statistic(self.data, 'p{}'.format(percent))
+            expected = np.percentile(self.data.data, percent, axis=0)
+            self.assertArrayAlmostEqual(result, expected)
+
+    def test_masked_values_ignored(self):
+        """Test that masked values do not contribute."""
+        self.data[3, 1] = np.ma.masked
+        self.assertArrayAlmostEqual(
+            _compute_statistic(self.data, 'mean'), [[2.5], [5.]])
+        self.assertArrayAlmostEqual(
+            _compute_statistic(self.data, 'median'), [[2.5], [4.]])
+        self.assertArrayAlmostEqual(
+            _compute_statistic(self.data, 'p100'), [[4.], [9.]])
+
+    def test_single_valid_dataset(self):
+        """Test that time steps with less than two datasets are masked."""
+        self.data[1:, 1] = np.ma.masked
+        result = _compute_statistic(self.data, 'mean')
+        self.assertArrayEqual(result.mask, [[False], [True]])
+
+    def test_unknown_statistic(self):
+        """Test that an unknown statistic raises an error."""
+        self.assertRaises(ValueError, _compute_statistic, self.data, 'mode')
+        self.assertRaises(ValueError, _compute_statistic, self.data, 'p101')
+
+
+class TestAssemble(tests.Test):
+    """Tests for the overlap and full time spans."""
+
+    def setUp(self):
+        """Prepare tests."""
+        data = np.arange(3 * 2 * 2).reshape(3, 2, 2)
+        self.cubes = [
+            _create_cube(data, [15., 45., 74.]),
+            _create_cube(data + 2., [45., 74., 105.]),
+        ]
+
+    def test_overlap(self):
+        """Test statistics over the common time span."""
+        interval = _get_overlap(self.cubes)
+        result = _assemble_overlap_data(self.cubes, interval,
+                                        ['mean', 'max'])
+        self.assertArrayEqual(result['mean'].coord('time').points,
+                              [45., 74.])
+        self.assertArrayAlmostEqual(result['mean'].data,
+                                    np.arange(3, 11).reshape(2, 2, 2))
+        self.assertArrayAlmostEqual(result['max'].data,
+                                    np.arange(4, 12).reshape(2, 2, 2))
+
+    def test_full(self):
+        """Test statistics over the full time span."""
+        result = _assemble_full_data(self.cubes, ['mean'])['mean']
+        self.assertEqual(result.shape, (4, 2, 2))
+        self.assertTrue(result.data.mask[0].all())
+        self.assertTrue(result.data.mask[3].all())
+        self.assertFalse(result.data.mask[1:3].any())
+        self.assertArrayAlmostEqual(result.data[1:3],
+                                    np.arange(3, 11).reshape(2, 2, 2))
+
+    def test_integer_data(self):
+        """Test that statistics of integer data are not truncated."""
+        for i, cube in enumerate(self.cubes):
+            cube.data = np.ma.array(cube.data + i, dtype=np.int32)
+        result = _assemble_overlap_data(self.cubes,
+                                        _get_overlap(self.cubes),
+                                        ['mean'])['mean']
+        self.assertEqual(result.dtype, np.float64)
+        self.assertArrayAlmostEqual(result.data,
+                                    np.arange(3.5, 11.5).reshape(2, 2, 2))
+
+    def test_full_chunked(self):
+        """Test that computing in chunks gives the same result."""
+        expected = _assemble_full_data(self.cubes, ['median'])['median']
+        self.patch('esmvaltool.preprocessor._multimodel.MAX_CHUNK_SIZE', 1)
+        result = _assemble_full_data(self.cubes, ['median'])['median']
+        self.assertArrayEqual(expected.data.mask, result.data.mask)
+        self.assertArrayAlmostEqual(expected.data, result.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
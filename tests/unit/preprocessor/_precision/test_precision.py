@@ -0,0 +1,73 @@
+"""Unit tests for the :mod:`esmvaltool.preprocessor._precision` module."""
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import iris
+import mock
+import numpy as np
+
+import tests
+from esmvaltool.preprocessor import _precision
+
+
+class Test(tests.Test):
+    """Test class for the :mod:`esmvaltool.preprocessor._precision` module."""
+
+    def setUp(self):
+        """Prepare tests."""
+        self.cube = iris.cube.Cube(
+            np.arange(4, dtype=np.float64), var_name='tas')
+
+    def test_get_float_dtype(self):
+        """Test that floating point types are kept."""
+        self.assertEqual(
+            _precision.get_float_dtype(np.float32), np.dtype(np.float32))
+        self.assertEqual(
+            _precision.get_float_dtype(np.float64), np.dtype(np.float64))
+        self.assertEqual(
+            _precision.get_float_dtype(np.int16), np.dtype(np.float64))
+
+    def test_set_precision(self):
+        """Test that double precision data is converted to float32."""
+        lazy_cube = self.cube.copy(data=self.cube.lazy_data())
+        int_cube = self.cube.copy(data=np.arange(4))
+        _precision.set_precision([self.cube, lazy_cube, int_cube], 'float32')
+        self.assertEqual(self.cube.dtype, np.float32)
+        self.assertTrue(lazy_cube.has_lazy_data())
+        self.assertEqual(lazy_cube.dtype, np.float32)
+        self.assertEqual(int_cube.dtype, np.arange(4).dtype)
+
+    def test_set_precision_native(self):
+        """Test that the native precision does not change the data."""
+        _precision.set_precision([self.cube], 'native')
+        self.assertEqual(self.cube.dtype, np.float64)
+
+    def test_unknown_precision(self):
+        """Test that an unknown precision raises an error."""
+        with self.assertRaises(ValueError):
+            _precision.set_precision([self.cube], 'float16')
+
+    def test_check_precision_audit(self):
+        """Test that upcasts are reported and undone."""
+        with mock.patch.object(_precision, 'logger') as logger:
+            cubes = _precision.check_precision(
+                'regrid', [self.cube], [np.dtype(np.float32)],
+                precision='float32',
+                audit=True)
+        self.assertEqual(logger.warning.call_count, 1)
+        self.assertIn('regrid', logger.warning.call_args[0])
+        self.assertEqual(cubes[0].dtype, np.float32)
+
+    def test_check_precision_no_upcast(self):
+        """Test that data that keeps its type is not reported."""
+        with mock.patch.object(_precision, 'logger') as logger:
+            _precision.check_precision(
+                'regrid', [self.cube], [np.dtype(np.float64)], audit=True)
+        logger.warning.assert_not_called()
+        self.assertEqual(self.cube.dtype, np.float64)
+
+
+if __name__ == '__main__':
+    unittest.main()
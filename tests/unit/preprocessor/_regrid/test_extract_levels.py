@@ -4,6 +4,7 @@ from __future__ import absolute_import, division, print_function
 
 import unittest
 
+import dask.array as da
 import iris
 import mock
 import numpy as np
@@ -70,110 +71,89 @@ class Test(tests.Test):
                 extract_levels(self.cube, levels, 'linear')
 
     def test_interpolation(self):
-        new_data = np.array(True)
         levels = np.array([0.5, 1.5])
         scheme = 'linear'
-        with mock.patch(
-                'stratify.interpolate', return_value=new_data) as mocker:
-            result = extract_levels(self.cube, levels, scheme)
-            self.assertEqual(result, self.created_cube)
-            args, kwargs = mocker.call_args
-            # Check the stratify.interpolate args ...
-            self.assertEqual(len(args), 3)
-            self.assertArrayEqual(args[0], levels)
-            pts = self.cube.coord(axis='z', dim_coords=True).points
-            src_levels_broadcast = np.broadcast_to(
-                pts.reshape(self.z, 1, 1), self.cube.shape)
-            self.assertArrayEqual(args[1], src_levels_broadcast)
-            self.assertArrayEqual(args[2], self.cube.data)
-            # Check the stratify.interpolate kwargs ...
-            self.assertEqual(
-                kwargs, dict(
-                    axis=0, interpolation=scheme, extrapolation='nan'))
+        result = extract_levels(self.cube, levels, scheme)
+        self.assertEqual(result, self.created_cube)
         args, kwargs = self.mock_create_cube.call_args
         # Check the _create_cube args ...
         self.assertEqual(len(args), 3)
         self.assertEqual(args[0], self.cube)
-        self.assertArrayEqual(args[1], new_data)
+        expected = np.array([[[1.], [2.]], [[3.], [4.]]])
+        self.assertArrayEqual(args[1], expected)
+        self.assertFalse(ma.isMaskedArray(args[1]))
         self.assertArrayEqual(args[2], levels)
         # Check the _create_cube kwargs ...
         self.assertEqual(kwargs, dict())
 
     def test_interpolation__extrapolated_NaN_filling(self):
-        new_data = np.array([0, np.nan])
-        levels = [0.5, 1.5]
+        levels = [0.4, 2.5]
         scheme = 'nearest'
-        with mock.patch(
-                'stratify.interpolate', return_value=new_data) as mocker:
-            result = extract_levels(self.cube, levels, scheme)
-            self.assertEqual(result, self.created_cube)
-            args, kwargs = mocker.call_args
-            # Check the stratify.interpolate args ...
-            self.assertEqual(len(args), 3)
-            self.assertArrayEqual(args[0], levels)
-            pts = self.cube.coord(axis='z', dim_coords=True).points
-            src_levels_broadcast = np.broadcast_to(
-                pts.reshape(self.z, 1, 1), self.cube.shape)
-            self.assertArrayEqual(args[1], src_levels_broadcast)
-            self.assertArrayEqual(args[2], self.cube.data)
-            # Check the stratify.interpolate kwargs ...
-            self.assertEqual(
-                kwargs, dict(
-                    axis=0, interpolation=scheme, extrapolation='nan'))
+        result = extract_levels(self.cube, levels, scheme)
+        self.assertEqual(result, self.created_cube)
         args, kwargs = self.mock_create_cube.call_args
         # Check the _create_cube args ...
         self.assertEqual(len(args), 3)
         self.assertArrayEqual(args[0], self.cube)
-        new_data[np.isnan(new_data)] = _MDI
-        self.assertArrayEqual(args[1], new_data)
+        expected = ma.masked_array(
+            [[[0.], [1.]], [[0.], [0.]]],
+            mask=[[[False], [False]], [[True], [True]]])
+        self.assertArrayEqual(args[1], expected)
+        self.assertArrayEqual(args[1].mask, expected.mask)
+        self.assertEqual(args[1].fill_value, _MDI)
         self.assertArrayEqual(args[2], levels)
         # Check the _create_cube kwargs ...
         self.assertEqual(kwargs, dict())
 
     def test_interpolation__masked(self):
         levels = np.array([0.5, 1.5])
-        new_data = np.empty([len(levels)] + list(self.shape[1:]), dtype=float)
-        new_data[:, 0, :] = np.nan
-        new_data_mask = np.isnan(new_data)
         scheme = 'linear'
         mask = [[[False], [True]], [[True], [False]], [[False], [False]]]
-        masked = ma.empty(self.shape)
-        masked.mask = mask
+        masked = ma.masked_array(self.cube.data, mask=mask)
         cube = _make_cube(masked, dtype=self.dtype)
-        with mock.patch(
-                'stratify.interpolate', return_value=new_data) as mocker:
-            result = extract_levels(cube, levels, scheme)
-            self.assertEqual(result, self.created_cube)
-            args, kwargs = mocker.call_args
-            # Check the stratify.interpolate args ...
-            self.assertEqual(len(args), 3)
-            self.assertArrayEqual(args[0], levels)
-            pts = cube.coord(axis='z', dim_coords=True).points
-            src_levels_broadcast = np.broadcast_to(
-                pts.reshape(self.z, 1, 1), cube.shape)
-            self.assertArrayEqual(args[1], src_levels_broadcast)
-            self.assertArrayEqual(args[2], cube.data)
-            # Check the stratify.interpolate kwargs ...
-            self.assertEqual(
-                kwargs, dict(
-                    axis=0, interpolation=scheme, extrapolation='nan'))
+        result = extract_levels(cube, levels, scheme)
+        self.assertEqual(result, self.created_cube)
         args, kwargs = self.mock_create_cube.call_args
-        # in-place for new extract_levels with nan's
-        new_data[np.isnan(new_data)] = _MDI
+        # Any masked source level used for a point masks it
+        expected = ma.masked_array(
+            [[[0.], [0.]], [[0.], [4.]]],
+            mask=[[[True], [True]], [[True], [False]]])
         # Check the _create_cube args ...
         self.assertEqual(len(args), 3)
         self.assertEqual(args[0].metadata, cube.metadata)
         coord_comparison = iris.analysis.coord_comparison(args[0], cube)
         self.assertFalse(coord_comparison['not_equal']
                          or coord_comparison['non_equal_data_dimension'])
-        self.assertArrayEqual(args[0].data, cube.data)
-        self.assertArrayEqual(args[1], new_data)
+        self.assertArrayEqual(args[0].data, masked)
+        self.assertArrayEqual(args[1], expected)
         self.assertTrue(ma.isMaskedArray(args[1]))
-        self.assertArrayEqual(args[1].mask, new_data_mask)
+        self.assertArrayEqual(args[1].mask, expected.mask)
         self.assertArrayEqual(args[2], levels)
         # Check the _create_cube kwargs ...
         self.assertEqual(kwargs, dict())
 
+    def test_interpolation__chunked(self):
+        levels = np.array([0.5, 1.5])
+        scheme = 'linear'
+        with mock.patch(
+                'esmvaltool.preprocessor._regrid._VERTICAL_CHUNK_SIZE', 1):
+            extract_levels(self.cube, levels, scheme, n_threads=2)
+        args, _ = self.mock_create_cube.call_args
+        expected = np.array([[[1.], [2.]], [[3.], [4.]]])
+        self.assertArrayEqual(args[1], expected)
+
+    def test_interpolation__lazy(self):
+        levels = np.array([0.5, 1.5])
+        scheme = 'linear'
+        cube = self.cube.copy(data=da.from_array(
+            self.cube.data, chunks=(3, 1, 1)))
+        extract_levels(cube, levels, scheme)
+        args, _ = self.mock_create_cube.call_args
+        self.assertIsInstance(args[1], da.Array)
+        self.assertTrue(cube.has_lazy_data())
+        expected = np.array([[[1.], [2.]], [[3.], [4.]]])
+        self.assertArrayEqual(args[1].compute(), expected)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,16 +2,24 @@
 # pylint: disable=invalid-name, no-self-use, too-few-public-methods
 from __future__ import absolute_import, division, print_function
 
+import shutil
+import tempfile
+import threading
+
 import cf_units
 import iris
 from iris.exceptions import CoordinateNotFoundError
 import mock
 import numpy as np
+import scipy.sparse
+from netCDF4 import Dataset
 
 import tests
+from esmvaltool.preprocessor import _regrid_esmpy
 from esmvaltool.preprocessor._regrid_esmpy import (
     build_regridder,
     build_regridder_2d,
+    build_weights_regridder_2d,
     coords_iris_to_esmpy,
     cube_to_empty_field,
     get_grid,
@@ -683,7 +691,8 @@ class TestHelpers(tests.Test):
         )
 
     @mock.patch('esmvaltool.preprocessor._regrid_esmpy.map_slices')
-    @mock.patch('esmvaltool.preprocessor._regrid_esmpy.build_regridder')
+    @mock.patch(
+        'esmvaltool.preprocessor._regrid_esmpy.build_weights_regridder')
     @mock.patch('esmvaltool.preprocessor._regrid_esmpy.get_grid_representants',
                 mock.Mock(side_effect=identity))
     def test_regrid(self, mock_build_regridder, mock_map_slices):
@@ -694,9 +703,161 @@ class TestHelpers(tests.Test):
         mock_build_regridder.assert_called_once_with(
             self.cube_3d,
             self.cube,
-            'linear')
+            'linear',
+            weights_dir=None)
         mock_map_slices.assert_called_once_with(
             self.cube_3d,
             mock.sentinel.regridder,
             self.cube_3d,
             self.cube)
+
+
+@mock.patch('esmvaltool.preprocessor._regrid_esmpy._compute_weights_2d')
+class TestWeightsCache(tests.Test):
+    """Unit tests for regridding with cached weights."""
+
+    def setUp(self):
+        """Set up fixtures."""
+        self.src_rep = self._create_cube(np.arange(6.).reshape(2, 3))
+        self.dst_rep = self._create_cube(np.zeros((2, 3)))
+        # Regridding weights that reverse the order of the grid cells
+        self.weights = scipy.sparse.csr_matrix(np.eye(6)[::-1])
+        self.dst_mask = np.zeros((2, 3), dtype=bool)
+        self.dst_mask[0, 0] = True
+        self.weights_dir = tempfile.mkdtemp()
+        _regrid_esmpy._WEIGHTS_CACHE.clear()
+
+    def tearDown(self):
+        """Remove the weights directory."""
+        shutil.rmtree(self.weights_dir)
+        _regrid_esmpy._WEIGHTS_CACHE.clear()
+
+    @staticmethod
+    def _create_cube(data):
+        lat = iris.coords.DimCoord([-45., 45.], standard_name='latitude')
+        lon = iris.coords.DimCoord([0., 120., 240.],
+                                   standard_name='longitude')
+        return iris.cube.Cube(
+            data, dim_coords_and_dims=[(lat, 0), (lon, 1)])
+
+    def test_regridder(self, mock_compute_weights):
+        """Test that the weights are applied to the data."""
+        mock_compute_weights.return_value = (self.weights, self.dst_mask)
+        regridder = build_weights_regridder_2d(
+            self.src_rep, self.dst_rep, mock.sentinel.rm_bilinear, .99)
+        result = regridder(self.src_rep)
+        expected = np.ma.masked_array(
+            np.arange(6.)[::-1].reshape(2, 3), mask=self.dst_mask)
+        self.assertArrayEqual(result, expected)
+        self.assertArrayEqual(result.mask, self.dst_mask)
+
+    def test_weights_computed_once(self, mock_compute_weights):
+        """Test that the weights are reused for the same grid."""
+        mock_compute_weights.return_value = (self.weights, self.dst_mask)
+        for _ in range(2):
+            build_weights_regridder_2d(self.src_rep, self.dst_rep,
+                                       mock.sentinel.rm_bilinear, .99)
+        mock_compute_weights.assert_called_once()
+
+        build_weights_regridder_2d(self.src_rep, self.dst_rep,
+                                   mock.sentinel.rm_conserve, .99)
+        self.assertEqual(mock_compute_weights.call_count, 2)
+
+    def test_weights_depend_on_mask(self, mock_compute_weights):
+        """Test that different source masks use different weights."""
+        mock_compute_weights.return_value = (self.weights, self.dst_mask)
+        build_weights_regridder_2d(self.src_rep, self.dst_rep,
+                                   mock.sentinel.rm_bilinear, .99)
+        self.src_rep.data = np.ma.masked_greater(self.src_rep.data, 4.)
+        build_weights_regridder_2d(self.src_rep, self.dst_rep,
+                                   mock.sentinel.rm_bilinear, .99)
+        self.assertEqual(mock_compute_weights.call_count, 2)
+
+    def test_weights_stored(self, mock_compute_weights):
+        """Test that weights stored on disk are used by other processes."""
+        mock_compute_weights.return_value = (self.weights, self.dst_mask)
+        build_weights_regridder_2d(self.src_rep, self.dst_rep,
+                                   mock.sentinel.rm_bilinear, .99,
+                                   self.weights_dir)
+        _regrid_esmpy._WEIGHTS_CACHE.clear()
+        regridder = build_weights_regridder_2d(
+            self.src_rep, self.dst_rep, mock.sentinel.rm_bilinear, .99,
+            self.weights_dir)
+        mock_compute_weights.assert_called_once()
+        result = regridder(self.src_rep)
+        self.assertArrayEqual(result.data,
+                              np.arange(6.)[::-1].reshape(2, 3))
+        self.assertArrayEqual(result.mask, self.dst_mask)
+
+    def test_threads(self, mock_compute_weights):
+        """Test that the cache can be used from several threads at once."""
+        mock_compute_weights.return_value = (self.weights, self.dst_mask)
+        other_src_rep = self._create_cube(np.ones((2, 3)))
+        other_src_rep.data = np.ma.masked_greater(other_src_rep.data, 0.)
+        errors = []
+
+        def run():
+            try:
+                for _ in range(50):
+                    for src_rep in (self.src_rep, other_src_rep):
+                        build_weights_regridder_2d(
+                            src_rep, self.dst_rep, mock.sentinel.rm_bilinear,
+                            .99)
+            except Exception as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        # Keep only one set of weights in memory, so every call evicts some
+        with mock.patch.object(_regrid_esmpy, 'MAX_CACHED_WEIGHTS_SIZE', 1):
+            threads = [threading.Thread(target=run) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+
+
+class TestComputeWeights(tests.Test):
+    """Unit tests for reading the weights computed by ESMF."""
+
+    def setUp(self):
+        """Set up fixtures."""
+        self.src_rep = TestWeightsCache._create_cube(
+            np.arange(6.).reshape(2, 3))
+        self.dst_rep = TestWeightsCache._create_cube(np.zeros((2, 3)))
+        self.dst_mask = np.zeros((2, 3), dtype=bool)
+        self.dst_mask[1, 2] = True
+        # Each destination cell takes the value of the next source cell,
+        # except the last one, which averages the first two
+        self.expected = np.zeros((6, 6))
+        for i in range(5):
+            self.expected[i, i + 1] = 1.
+        self.expected[5, :2] = .5
+
+    def _write_weights(self, src_rep, dst_rep, regrid_method,
+                       mask_threshold, filename):
+        """Write the weights like ESMF, with one-based indices."""
+        rows, cols = np.nonzero(self.expected)
+        with Dataset(filename, 'w') as dataset:
+            dataset.createDimension('n_s', len(rows))
+            for name, values in (('row', rows + 1), ('col', cols + 1),
+                                 ('S', self.expected[rows, cols])):
+                variable = dataset.createVariable(name, values.dtype,
+                                                  ('n_s', ))
+                variable[:] = values
+        return (mock.sentinel.src_field, mock.sentinel.dst_field,
+                mock.sentinel.regridder, self.dst_mask)
+
+    @mock.patch(
+        'esmvaltool.preprocessor._regrid_esmpy._build_esmf_regridder_2d')
+    def test_compute_weights(self, mock_build):
+        """Test that the weights file is converted to a sparse matrix."""
+        mock_build.side_effect = self._write_weights
+        weights, dst_mask = _regrid_esmpy._compute_weights_2d(
+            self.src_rep, self.dst_rep, mock.sentinel.rm_bilinear, .99)
+        self.assertIsInstance(weights, scipy.sparse.csr_matrix)
+        self.assertEqual(weights.shape, (6, 6))
+        self.assertArrayEqual(weights.toarray(), self.expected)
+        self.assertArrayEqual(dst_mask, self.dst_mask)
+
+        result = weights.dot(self.src_rep.data.ravel()).reshape(2, 3)
+        self.assertArrayEqual(result, [[1., 2., 3.], [4., 5., .5]])
@@ -2,6 +2,7 @@
 
 from __future__ import absolute_import, division, print_function
 
+import datetime
 import unittest
 
 import iris
@@ -12,7 +13,8 @@ from cf_units import Unit
 from iris.cube import Cube
 
 import tests
-from esmvaltool.preprocessor._time_area import (extract_month, extract_season,
+from esmvaltool.preprocessor._time_area import (climatology, extract_month,
+                                                extract_season, seasonal_mean,
                                                 time_average, time_slice)
 
 
@@ -179,5 +181,102 @@ class TestTimeAverage(tests.Test):
         self.assertArrayEqual(result.data, expected)
 
 
+def _create_monthly_cube(n_years, calendar):
+    """Create a monthly cube with time bounds in the given calendar."""
+    units = Unit('days since 1950-01-01', calendar=calendar)
+    edges = units.date2num([
+        datetime.datetime(1950 + month // 12, month % 12 + 1, 1)
+        for month in range(12 * n_years + 1)
+    ])
+    time = iris.coords.DimCoord(
+        (edges[:-1] + edges[1:]) / 2.,
+        bounds=np.stack([edges[:-1], edges[1:]], axis=-1),
+        standard_name='time',
+        units=units)
+    data = np.arange(12. * n_years)
+    return iris.cube.Cube(data, dim_coords_and_dims=[(time, 0)])
+
+
+class TestClimatology(tests.Test):
+    """Test class for :func:`esmvaltool.preprocessor._time_area.climatology`"""
+
+    def setUp(self):
+        """Prepare tests"""
+        self.cube = _create_monthly_cube(2, '360_day')
+
+    def test_monthly_mean(self):
+        """Test monthly means of monthly data."""
+        result = climatology(self.cube, 'month')
+        self.assertArrayEqual(result.data, self.cube.data)
+        self.assertArrayEqual(result.coord('month_number').points,
+                              np.tile(np.arange(1, 13), 2))
+        self.assertArrayEqual(result.coord('year').points,
+                              np.repeat([1950, 1951], 12))
+        self.assertArrayEqual(result.coord('time').bounds,
+                              self.cube.coord('time').bounds)
+
+    def test_annual_cycle(self):
+        """Test the mean annual cycle."""
+        result = climatology(self.cube, 'month', cycle=True)
+        self.assertArrayEqual(result.data, np.arange(6., 18.))
+        self.assertArrayEqual(result.coord('month_number').points,
+                              np.arange(1, 13))
+        self.assertArrayEqual(result.coord('time').bounds[0], [0., 390.])
+
+    def test_seasonal_cycle(self):
+        """Test the mean seasonal cycle."""
+        result = climatology(self.cube, 'season', cycle=True)
+        self.assertArrayEqual(result.data, [10., 9., 12., 15.])
+        self.assertArrayEqual(result.coord('clim_season').points,
+                              ['djf', 'mam', 'jja', 'son'])
+
+    def test_annual_mean_weighted(self):
+        """Test annual means weighted by the length of the months."""
+        cube = _create_monthly_cube(1, 'gregorian')
+        result = climatology(cube, 'year')
+        days = np.diff(cube.coord('time').bounds, axis=1).ravel()
+        expected = np.sum(cube.data * days) / 365.
+        self.assertArrayAlmostEqual(result.data, [expected])
+        self.assertArrayEqual(result.coord('year').points, [1950])
+
+    def test_masked(self):
+        """Test that masked values do not contribute."""
+        self.cube.data = np.ma.masked_greater(self.cube.data, 20.)
+        result = climatology(self.cube, 'month', cycle=True)
+        expected = np.append(np.arange(6., 15.), [9., 10., 11.])
+        self.assertArrayEqual(result.data, expected)
+        self.cube.data.mask[:] = True
+        result = climatology(self.cube, 'year', cycle=True)
+        self.assertTrue(np.ma.getmaskarray(result.data).all())
+
+    def test_lazy(self):
+        """Test that lazy data stays lazy."""
+        cube = self.cube.copy(data=self.cube.lazy_data())
+        result = climatology(cube, 'month', cycle=True)
+        self.assertTrue(result.has_lazy_data())
+        self.assertArrayEqual(result.data, np.arange(6., 18.))
+
+    def test_invalid_period(self):
+        """Test that an unknown period raises an error."""
+        with self.assertRaises(ValueError):
+            climatology(self.cube, 'week')
+
+
+class TestSeasonalMean(tests.Test):
+    """Test :func:`esmvaltool.preprocessor._time_area.seasonal_mean`"""
+
+    def test_seasonal_mean(self):
+        """Test that only complete seasons are kept in all calendars."""
+        for calendar in ('360_day', '365_day', 'gregorian'):
+            cube = _create_monthly_cube(2, calendar)
+            result = seasonal_mean(cube)
+            self.assertArrayEqual(result.coord('clim_season').points,
+                                  ['mam', 'jja', 'son', 'djf'] + [
+                                      'mam', 'jja', 'son'])
+            self.assertArrayEqual(result.coord('season_year').points,
+                                  [1950] * 3 + [1951] * 4)
+            self.assertArrayAlmostEqual(result.data[3], 12., decimal=1)
+
+
 if __name__ == '__main__':
     unittest.main()
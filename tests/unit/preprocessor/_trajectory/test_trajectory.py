@@ -0,0 +1,111 @@
+"""Unit tests for the :mod:`esmvaltool.preprocessor._trajectory` module."""
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import dask.array as da
+import iris
+import mock
+import numpy as np
+
+import tests
+from esmvaltool.preprocessor import _trajectory
+
+
+class Test(tests.Test):
+    """Test class for the :mod:`esmvaltool.preprocessor._trajectory` module."""
+
+    def setUp(self):
+        """Prepare tests."""
+        _trajectory._STENCIL_CACHE.clear()
+        depth = iris.coords.DimCoord(
+            [1., 2.], standard_name='depth', units='m')
+        lats = iris.coords.DimCoord(
+            [30., 20., 10., 0.], standard_name='latitude', units='degrees')
+        lons = iris.coords.DimCoord(
+            [0., 90., 180., 270.],
+            standard_name='longitude',
+            units='degrees',
+            circular=True)
+        data = (lats.points[None, :, None] + lons.points[None, None, :] / 10.
+                + 100. * depth.points[:, None, None])
+        self.cube = iris.cube.Cube(
+            np.ma.masked_array(data),
+            var_name='thetao',
+            units='K',
+            dim_coords_and_dims=[(depth, 0), (lats, 1), (lons, 2)])
+
+    def test_linear(self):
+        """Test bilinear interpolation on a regular grid."""
+        result = _trajectory.interpolate(self.cube, [5., 25.], [45., 180.])
+        self.assertEqual(result.shape, (2, 2))
+        self.assertEqual(result.metadata, self.cube.metadata)
+        self.assertEqual(result.coord('depth'), self.cube.coord('depth'))
+        self.assertArrayEqual(result.coord('latitude').points, [5., 25.])
+        self.assertArrayEqual(result.coord('longitude').points, [45., 180.])
+        self.assertArrayAlmostEqual(result.data,
+                                    [[109.5, 143.], [209.5, 243.]])
+
+    def test_linear_circular(self):
+        """Test interpolation across the last longitude."""
+        result = _trajectory.interpolate(self.cube, [10., 10.], [315., -45.])
+        # Halfway between 270 and 360 == 0 degrees
+        self.assertArrayAlmostEqual(result.data[0], [123.5, 123.5])
+
+    def test_linear_masked(self):
+        """Test that points next to masked grid cells are masked."""
+        self.cube.data[:, 0, 0] = np.ma.masked
+        result = _trajectory.interpolate(self.cube, [25., 15., 10.],
+                                         [45., 45., 0.])
+        self.assertArrayEqual(result.data.mask,
+                              [[True, False, False], [True, False, False]])
+
+    def test_linear_lazy(self):
+        """Test that lazy data is interpolated lazily."""
+        self.cube.data[1, 0, 0] = np.ma.masked
+        expected = _trajectory.interpolate(self.cube, [5., 25.], [45., 45.])
+        self.cube.data = da.ma.masked_array(
+            da.from_array(self.cube.data.data, chunks=(1, 2, 2)),
+            mask=da.from_array(self.cube.data.mask, chunks=(1, 2, 2)))
+        result = _trajectory.interpolate(self.cube, [5., 25.], [45., 45.])
+        self.assertTrue(result.has_lazy_data())
+        self.assertEqual(result.dtype, expected.dtype)
+        self.assertArrayAlmostEqual(result.data, expected.data)
+        self.assertArrayEqual(result.data.mask, [[False, False],
+                                                 [False, True]])
+
+    def test_nearest_curvilinear(self):
+        """Test nearest neighbours on a grid with 2D coordinates."""
+        lats, lons = np.meshgrid([0., 10., 20.], [0., 10.], indexing='ij')
+        cube = iris.cube.Cube(
+            np.arange(12.).reshape((2, 3, 2)),
+            dim_coords_and_dims=[(iris.coords.DimCoord([0., 1.],
+                                                       long_name='x'), 0)],
+            aux_coords_and_dims=[
+                (iris.coords.AuxCoord(
+                    lats, standard_name='latitude', units='degrees'),
+                 (1, 2)),
+                (iris.coords.AuxCoord(
+                    lons, standard_name='longitude', units='degrees'),
+                 (1, 2)),
+            ])
+        result = _trajectory.interpolate(cube, [1., 19.], [9., 361.])
+        self.assertArrayEqual(result.data, [[1., 4.], [7., 10.]])
+        self.assertArrayEqual(result.coord('latitude').points, [0., 20.])
+        self.assertArrayEqual(result.coord('longitude').points, [10., 0.])
+
+    def test_reuse_stencil(self):
+        """Test that the stencil is computed once for a grid."""
+        with mock.patch.object(
+                _trajectory,
+                '_get_linear_stencil',
+                wraps=_trajectory._get_linear_stencil) as get_stencil:
+            _trajectory.interpolate(self.cube, [5.], [45.])
+            _trajectory.interpolate(self.cube.copy(), [5.], [45.])
+            _trajectory.interpolate(self.cube, [6.], [45.])
+        self.assertEqual(get_stencil.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -95,6 +95,16 @@ class Test(tests.Test):
         expected = np.array([1., 1., 1., 1.])
         self.assertArrayEqual(result.data, expected)
 
+    def test_volume_average_weighted(self):
+        """Test that the average is weighted by the layer thickness."""
+        cube = self.grid_4d_2.copy()
+        cube.data = cube.data * np.arange(1., 4.)[None, :, None, None]
+        result = volume_average(cube, 'depth', 'latitude', 'longitude')
+        expected = (1. * 2.5 + 2. * 22.5 + 3. * 225.) / 250.
+        self.assertArrayAlmostEqual(result.data[1:], [expected] * 3)
+        self.assertTrue(result.data[0] > expected)
+        self.assertEqual(result.coord('time'), cube.coord('time'))
+
     def test_depth_integration_1d(self):
         """Test to take the depth integration of a 3 layer cube."""
         result = depth_integration(self.grid_3d[:, 0, 0], 'depth')
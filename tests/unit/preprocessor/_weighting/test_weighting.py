@@ -0,0 +1,101 @@
+"""Unit tests for the :mod:`esmvaltool.preprocessor._weighting` module."""
+
+from __future__ import absolute_import, division, print_function
+
+import unittest
+
+import dask.array as da
+import iris
+import mock
+import numpy as np
+
+import tests
+from esmvaltool.preprocessor import _weighting
+from esmvaltool.preprocessor._weighting import (expand_weights, weighted_mean,
+                                                weighted_sum)
+
+
+class Test(tests.Test):
+    """Test class for the :mod:`esmvaltool.preprocessor._weighting` module."""
+
+    def setUp(self):
+        """Prepare tests."""
+        data = np.ma.arange(24.).reshape((4, 3, 2))
+        data[1, 2, 0] = np.ma.masked
+        data[2] = np.ma.masked
+        time = iris.coords.DimCoord(
+            [0., 1., 2., 3.],
+            standard_name='time',
+            units='days since 2000-01-01')
+        depth = iris.coords.DimCoord(
+            [1., 2., 3.], standard_name='depth', units='m')
+        xcoord = iris.coords.DimCoord([0., 1.], long_name='x')
+        self.cube = iris.cube.Cube(
+            data,
+            var_name='thetao',
+            units='K',
+            dim_coords_and_dims=[(time, 0), (depth, 1), (xcoord, 2)])
+        self.weights = np.array([1., 2., 5.])
+
+    def check(self, result, expected):
+        """Compare a result to the equivalent iris result."""
+        self.assertEqual(result.metadata, expected.metadata)
+        self.assertEqual(result.coords(), expected.coords())
+        self.assertArrayEqual(
+            np.ma.getmaskarray(result.data), np.ma.getmaskarray(expected.data))
+        self.assertArrayAlmostEqual(result.data, expected.data)
+
+    def test_expand_weights(self):
+        """Test that weights are expanded to the number of dimensions."""
+        weights = expand_weights(self.weights, (1, ), 3)
+        self.assertEqual(weights.shape, (1, 3, 1))
+
+    def test_weighted_mean(self):
+        """Test the weighted mean over the first dimension in chunks."""
+        weights = expand_weights(self.weights, (1, ), 3)
+        expected = self.cube.collapsed(
+            'depth',
+            iris.analysis.MEAN,
+            weights=np.broadcast_to(weights, self.cube.shape).copy())
+        for chunk_size in (2**26, 1, 3 * 2 * 8):
+            with mock.patch.object(_weighting, 'CHUNK_SIZE', chunk_size):
+                result = weighted_mean(self.cube, 'depth', weights)
+            self.check(result, expected)
+
+    def test_weighted_mean_time(self):
+        """Test the weighted mean over a chunked dimension."""
+        weights = np.array([1., 3., 1., 2.])[:, None, None]
+        expected = self.cube.collapsed(
+            'time',
+            iris.analysis.MEAN,
+            weights=np.broadcast_to(weights, self.cube.shape).copy())
+        with mock.patch.object(_weighting, 'CHUNK_SIZE', 1):
+            result = weighted_mean(self.cube, 'time', weights)
+        self.check(result, expected)
+
+    def test_weighted_sum_lazy(self):
+        """Test that the weighted sum of lazy data is lazy."""
+        weights = expand_weights(self.weights, (1, ), 3)
+        expected = self.cube.collapsed(
+            ['depth', 'x'],
+            iris.analysis.SUM,
+            weights=np.broadcast_to(weights, self.cube.shape).copy())
+        cube = self.cube.copy(da.from_array(self.cube.data, chunks=(1, 3, 2)))
+        result = weighted_sum(cube, ['depth', 'x'], weights)
+        self.assertTrue(result.has_lazy_data())
+        self.check(result, expected)
+
+    def test_weighted_mean_float32(self):
+        """Test that single precision data stays single precision."""
+        cube = self.cube.copy(data=self.cube.data.astype(np.float32))
+        result = weighted_mean(cube, 'depth', self.weights[:, None])
+        self.assertEqual(result.dtype, np.float32)
+
+    def test_incompatible_weights(self):
+        """Test that weights that cannot be broadcast are rejected."""
+        with self.assertRaises(ValueError):
+            weighted_mean(self.cube, 'depth', np.ones((2, 3)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,15 @@
+import threading
+import time
+
+import dask.array as da
+import iris.cube
+import mock
+import pytest
+
 from esmvaltool.preprocessor import (DEFAULT_ORDER, MULTI_MODEL_FUNCTIONS,
-                                     _get_itype)
+                                     PreprocessingTask, _get_itype,
+                                     _ProductWriter)
+from esmvaltool.preprocessor._io import IO_LOCK
 
 
 def test_first_argument_name():
@@ -14,3 +24,93 @@ def test_first_argument_name():
 
 def test_multi_model_exist():
     assert MULTI_MODEL_FUNCTIONS.issubset(set(DEFAULT_ORDER))
+
+
+class SlowProduct(object):
+    """Product that takes some time to save."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.cubes = [iris.cube.Cube(da.arange(3.))]
+        self.threads = set()
+        self.is_closed = False
+
+    def close(self):
+        # The data is computed before saving
+        assert not any(cube.has_lazy_data() for cube in self.cubes)
+        with IO_LOCK:
+            time.sleep(0.05)
+        self.threads.add(threading.current_thread().name)
+        if self.fail:
+            raise ValueError("Failed to save")
+        self.is_closed = True
+
+
+@pytest.mark.parametrize('max_parallel_writes', [1, 2, None])
+def test_product_writer(max_parallel_writes):
+    """Check that the writer closes all products."""
+    products = [SlowProduct() for _ in range(5)]
+    writer = _ProductWriter(max_parallel_writes)
+    n_writers = writer.n_writers
+    try:
+        for product in products:
+            product.cubes[0].data = product.cubes[0].data
+            writer.close(product)
+            assert len(writer._pending) <= writer.n_writers
+        writer.wait()
+    finally:
+        writer.terminate()
+    assert all(product.is_closed for product in products)
+    threads = set.union(*(product.threads for product in products))
+    main_thread = threading.current_thread().name
+    if n_writers == 1:
+        assert not writer.background
+        assert threads == {main_thread}
+    else:
+        assert main_thread not in threads
+
+
+def test_product_writer_realises_data():
+    """Check that the writer computes lazy data before saving."""
+    product = SlowProduct()
+    writer = _ProductWriter(2)
+    assert writer.background
+    try:
+        writer.close(product)
+        writer.wait()
+    finally:
+        writer.terminate()
+    assert product.is_closed
+
+
+def test_product_writer_fail():
+    """Check that errors while saving are raised."""
+    writer = _ProductWriter(2)
+    try:
+        writer.close(SlowProduct(fail=True))
+        with pytest.raises(ValueError):
+            writer.wait()
+    finally:
+        writer.terminate()
+
+
+@pytest.mark.parametrize('executor,max_parallel_products,children', [
+    ('process', 1, False),
+    ('process', 2, True),
+    ('process', None, True),
+    ('thread', 2, False),
+])
+def test_resource_log_children(tmp_path, executor, max_parallel_products,
+                               children):
+    """Check that the memory of parallel processes is logged."""
+    task = PreprocessingTask(
+        [],
+        resource_log=str(tmp_path / 'run' / 'resource_usage.txt'),
+        max_parallel_products=max_parallel_products,
+        parallel_products_executor=executor)
+    with mock.patch.object(task, '_run_preprocessor'):
+        with mock.patch(
+                'esmvaltool.preprocessor.resource_usage_logger') as log:
+            task._run(None)
+    log.assert_called_once_with(
+        mock.ANY, task.resource_log, children=children)
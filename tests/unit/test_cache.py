@@ -0,0 +1,75 @@
+"""Unit tests for :mod:`esmvaltool._cache`."""
+import os
+
+from esmvaltool._cache import Cache, get_key
+
+
+def write(path, text):
+    """Write text to a file and return its path as a string."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+    return str(path)
+
+
+def test_get_key_is_stable():
+    key1 = get_key('1.0', {'b': [1, 2.5], 'a': {'x': None}}, {3, 1})
+    key2 = get_key('1.0', {'a': {'x': None}, 'b': [1, 2.5]}, {1, 3})
+    assert key1 == key2
+    assert key1 != get_key('1.1', {'b': [1, 2.5], 'a': {'x': None}}, {3, 1})
+
+
+def test_get_key_depends_on_file(tmp_path):
+    filename = write(tmp_path / 'input.nc', 'a')
+    key = get_key([filename])
+    assert key == get_key([filename])
+    write(tmp_path / 'input.nc', 'ab')
+    assert key != get_key([filename])
+
+
+def test_get_key_of_function():
+    assert get_key(os.path.join) == get_key(os.path.join)
+    assert get_key(os.path.join) != get_key(os.path.exists)
+
+
+def test_store_restore(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    output = write(tmp_path / 'run1' / 'tas.nc', 'data')
+    cache.store('abcdef', [output])
+
+    target = str(tmp_path / 'run2' / 'tas.nc')
+    assert cache.restore('abcdef', {'tas.nc': target}) == [target]
+    with open(target) as file:
+        assert file.read() == 'data'
+
+
+def test_restore_missing(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    output = write(tmp_path / 'run1' / 'tas.nc', 'data')
+    cache.store('abcdef', [output])
+
+    target = str(tmp_path / 'run2' / 'tas.nc')
+    assert cache.restore('012345', {'tas.nc': target}) is None
+    # Files in the entry that are not requested
+    assert cache.restore('abcdef', {'pr.nc': target}) is None
+    assert not os.path.exists(target)
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache = Cache(str(tmp_path / 'cache'))
+    targets = {}
+    for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+        filename = write(tmp_path / 'run' / key, 'x')
+        targets[key] = filename
+        cache.store(key, [filename])
+        # Make sure the entries have distinct access times
+        entry = os.path.join(str(tmp_path / 'cache'), key[:2], key)
+        os.utime(entry, (i, i))
+
+    # Use the oldest entry, so the second one is evicted next
+    assert cache.restore('aa1', {'aa1': targets['aa1']}) is not None
+    cache.max_size = 2. / 2**30
+    cache.evict()
+
+    assert cache.restore('bb2', {'bb2': targets['bb2']}) is None
+    assert cache.restore('aa1', {'aa1': targets['aa1']}) is not None
+    assert cache.restore('cc3', {'cc3': targets['cc3']}) is not None
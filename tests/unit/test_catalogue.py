@@ -0,0 +1,111 @@
+"""Unit tests for :mod:`esmvaltool._catalogue`."""
+import os
+
+from esmvaltool._catalogue import Catalogue
+
+
+def create_files(root, filenames):
+    """Create empty files below root."""
+    for filename in filenames:
+        path = root / filename
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text('')
+
+
+def test_query(tmp_path):
+    root = tmp_path / 'data'
+    create_files(root, ['a/x.nc', 'a/b/y.nc', 'c/z.nc'])
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.update(str(root)) == (4, 4)
+
+    # Read the stored catalogue
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.roots == [str(root)]
+
+    assert catalogue.isdir(str(root / 'a' / 'b'))
+    assert not catalogue.isdir(str(root / 'a' / 'x.nc'))
+    assert not catalogue.isdir(str(root / 'd'))
+    assert catalogue.listdir(str(root / 'a')) == ['b', 'x.nc']
+    walk = list(catalogue.walk(str(root / 'a')))
+    assert walk == [
+        (str(root / 'a'), ['b'], ['x.nc']),
+        (str(root / 'a' / 'b'), [], ['y.nc']),
+    ]
+
+
+def test_query_outdated(tmp_path, caplog):
+    root = tmp_path / 'data'
+    create_files(root, ['a/x.nc', 'c/z.nc'])
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    catalogue.update(str(root))
+
+    # Data added after the build is found, with a warning
+    create_files(root, ['a/y.nc', 'd/w.nc'])
+    for path in (root, root / 'a'):
+        os.utime(str(path), (0, 0))
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.listdir(str(root / 'c')) == ['z.nc']
+    assert not [r for r in caplog.records if r.levelname == 'WARNING']
+    assert catalogue.listdir(str(root / 'a')) == ['x.nc', 'y.nc']
+    assert catalogue.isdir(str(root / 'd'))
+    assert catalogue.listdir(str(root)) == ['a', 'c', 'd']
+    warnings = [r for r in caplog.records if r.levelname == 'WARNING']
+    assert len(warnings) == 1
+    assert 'esmvaltool catalogue build' in warnings[0].getMessage()
+
+
+def test_find_files(tmp_path):
+    root = tmp_path / 'data'
+    create_files(root, [
+        'a/tas_Amon_A_historical_r1i1p1_1850-1899.nc',
+        'a/tas_Amon_A_historical_r1i1p1_1900-1949.nc',
+        'a/tas_Amon_A_historical_r2i1p1_1850-1899.nc',
+        'a/tas_day_A_historical_r1i1p1_1850-1899.nc',
+        'a/b/tas_Amon_A_historical_r1i1p1_1950-1999.nc',
+        'a/tasmax_Amon_A_historical_r1i1p1_1850-1899.nc',
+    ])
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    catalogue.update(str(root))
+
+    files = catalogue.find_files(
+        str(root / 'a'), ['tas_Amon_A_historical_r1i1p1*.nc', 'tas_day*'])
+    assert files == [
+        str(root / 'a' / name) for name in [
+            'tas_Amon_A_historical_r1i1p1_1850-1899.nc',
+            'tas_Amon_A_historical_r1i1p1_1900-1949.nc',
+            'tas_day_A_historical_r1i1p1_1850-1899.nc',
+        ]
+    ] + [str(root / 'a' / 'b' / 'tas_Amon_A_historical_r1i1p1_1950-1999.nc')]
+    assert catalogue.find_files(str(root), ['*_r2i1p1_*.nc']) == [
+        str(root / 'a' / 'tas_Amon_A_historical_r2i1p1_1850-1899.nc')
+    ]
+
+
+def test_query_outside_roots(tmp_path):
+    create_files(tmp_path, ['data/a/x.nc', 'other/y.nc'])
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    catalogue.update(str(tmp_path / 'data'))
+
+    assert catalogue.isdir(str(tmp_path / 'other'))
+    assert catalogue.listdir(str(tmp_path / 'other')) == ['y.nc']
+
+
+def test_incremental_update(tmp_path):
+    root = tmp_path / 'data'
+    create_files(root, ['a/x.nc', 'b/y.nc', 'b/c/z.nc'])
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.update(str(root)) == (4, 4)
+
+    create_files(root, ['b/c/w.nc'])
+    os.utime(str(root / 'b' / 'c'), (0, 0))
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.update(str(root)) == (1, 4)
+    assert catalogue.listdir(str(root / 'b' / 'c')) == ['w.nc', 'z.nc']
+
+
+def test_symlink_loop(tmp_path):
+    root = tmp_path / 'data'
+    create_files(root, ['a/x.nc'])
+    os.symlink(str(root), str(root / 'a' / 'loop'))
+    catalogue = Catalogue(str(tmp_path / 'catalogue'))
+    assert catalogue.update(str(root)) == (2, 2)
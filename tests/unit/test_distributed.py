@@ -0,0 +1,89 @@
+"""Unit tests for :mod:`esmvaltool._distributed`."""
+import threading
+
+import pytest
+
+from esmvaltool._distributed import Worker, WorkerPool, parse_address
+from esmvaltool._task import BaseTask, run_tasks
+
+AUTHKEY = 'test-key'
+
+
+class NameTask(BaseTask):
+    """Task that returns its name and the output of its ancestors."""
+
+    def __init__(self, ancestors=None, name=''):
+        super(NameTask, self).__init__(ancestors=ancestors, name=name)
+        self.products = set()
+
+    def _run(self, input_files):
+        if self.name == 'fail':
+            raise ValueError("Task failed")
+        return sorted(set(input_files)) + [self.name]
+
+
+@pytest.fixture
+def worker():
+    """Run a worker on localhost."""
+    worker = Worker(('localhost', 0), processes=2, authkey=AUTHKEY)
+    thread = threading.Thread(target=worker.serve_forever)
+    thread.start()
+    yield worker
+    worker.close()
+    thread.join()
+
+
+def test_worker_close_stopped():
+    """Check that a worker that no longer serves can be closed."""
+    worker = Worker(('localhost', 0), processes=1, authkey=AUTHKEY)
+    thread = threading.Thread(target=worker.serve_forever)
+    thread.start()
+    worker.close()
+    thread.join()
+    # Like after serve_forever was interrupted with Ctrl-C
+    worker.close()
+
+
+def test_parse_address():
+    assert parse_address('node1:1234') == ('node1', 1234)
+    assert parse_address(('node1', 1234)) == ('node1', 1234)
+    with pytest.raises(ValueError):
+        parse_address('node1')
+
+
+def test_worker_pool(worker):
+    pool = WorkerPool([worker.address], authkey=AUTHKEY)
+    assert pool.processes == 2
+
+    results = []
+    errors = []
+    pool.apply_async(divmod, [7, 2], callback=results.append)
+    pool.apply_async(divmod, [7, 0], error_callback=errors.append)
+    pool.close()
+    pool.join()
+
+    assert results == [(3, 1)]
+    assert len(errors) == 1
+    assert isinstance(errors[0], ZeroDivisionError)
+
+
+def test_worker_pool_wrong_key(worker):
+    with pytest.raises(Exception):
+        WorkerPool([worker.address], authkey='wrong-key')
+
+
+def test_run_tasks_on_workers(worker, monkeypatch):
+    monkeypatch.setenv('ESMVALTOOL_AUTHKEY', AUTHKEY)
+    top = NameTask(name='top')
+    left = NameTask(ancestors=[top], name='left')
+    right = NameTask(ancestors=[top], name='right')
+    bottom = NameTask(ancestors=[left, right], name='bottom')
+    address = '{}:{}'.format(*worker.address)
+
+    run_tasks({bottom}, workers=[address])
+
+    assert top.output_files == ['top']
+    assert bottom.output_files == ['left', 'right', 'top', 'bottom']
+
+    with pytest.raises(ValueError):
+        run_tasks({NameTask(name='fail')}, workers=[address])
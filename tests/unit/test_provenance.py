@@ -0,0 +1,21 @@
+"""Unit tests for :mod:`esmvaltool._provenance`."""
+from netCDF4 import Dataset
+
+from esmvaltool._provenance import TrackedFile
+
+
+def test_attributes_read_when_used(tmp_path):
+    filename = str(tmp_path / 'tas.nc')
+    with Dataset(filename, 'w') as dataset:
+        dataset.tracking_id = 'abc'
+
+    tracked_file = TrackedFile(filename)
+    assert tracked_file._attributes is None
+    assert tracked_file.attributes == {'tracking_id': 'abc'}
+
+
+def test_attributes_given():
+    attributes = {'short_name': 'tas'}
+    tracked_file = TrackedFile('/path/to/tas.nc', attributes)
+    assert tracked_file.attributes == attributes
+    assert tracked_file.attributes is not attributes
@@ -0,0 +1,127 @@
+"""Unit tests for :mod:`esmvaltool._task`."""
+import time
+
+import pytest
+
+from esmvaltool._task import (BaseTask, _run_tasks_parallel,
+                              get_flattened_tasks, get_independent_tasks,
+                              get_peak_memory, run_tasks)
+
+
+class EchoTask(BaseTask):
+    """Task that returns its name and the output of its ancestors."""
+
+    def __init__(self, ancestors=None, name='', memory=0.):
+        super(EchoTask, self).__init__(ancestors=ancestors, name=name)
+        self.products = set()
+        self.memory = memory
+
+    def _estimate_memory(self):
+        return self.memory
+
+    def _run(self, input_files):
+        if self.name == 'fail':
+            raise ValueError("Task failed")
+        return sorted(set(input_files)) + [self.name]
+
+
+class SleepTask(EchoTask):
+    """Task that takes some time and returns when it started and ended."""
+
+    def _run(self, input_files):
+        start = time.time()
+        time.sleep(0.3)
+        return [self.name, start, time.time()]
+
+
+def get_diamond():
+    """Create tasks with a diamond shaped dependency graph."""
+    top = EchoTask(name='top')
+    left = EchoTask(ancestors=[top], name='left')
+    right = EchoTask(ancestors=[top], name='right')
+    bottom = EchoTask(ancestors=[left, right], name='bottom')
+    return top, left, right, bottom
+
+
+def test_get_flattened_tasks():
+    tasks = get_diamond()
+    assert get_flattened_tasks([tasks[-1]]) == set(tasks)
+    assert tasks[-1].flatten() == set(tasks)
+
+
+def test_get_independent_tasks():
+    tasks = get_diamond()
+    assert get_independent_tasks(tasks) == {tasks[-1]}
+
+
+@pytest.mark.parametrize('max_parallel_tasks', [1, 2, None])
+def test_run_tasks(max_parallel_tasks):
+    top, left, right, bottom = get_diamond()
+    run_tasks({bottom}, max_parallel_tasks=max_parallel_tasks)
+    assert top.output_files == ['top']
+    assert left.output_files == ['top', 'left']
+    assert right.output_files == ['top', 'right']
+    assert bottom.output_files == ['left', 'right', 'top', 'bottom']
+
+
+def test_run_tasks_parallel_many():
+    roots = [EchoTask(name='root{}'.format(i)) for i in range(100)]
+    leaves = [
+        EchoTask(ancestors=roots[i:i + 2], name='leaf{}'.format(i))
+        for i in range(99)
+    ]
+    _run_tasks_parallel(set(leaves), max_parallel_tasks=4)
+    for i, leaf in enumerate(leaves):
+        assert leaf.output_files[-1] == 'leaf{}'.format(i)
+        assert set(leaf.output_files[:-1]) == {
+            'root{}'.format(i), 'root{}'.format(i + 1)
+        }
+
+
+def test_run_tasks_parallel_fail():
+    task = EchoTask(ancestors=[EchoTask(name='fail')], name='child')
+    with pytest.raises(ValueError):
+        _run_tasks_parallel({task}, max_parallel_tasks=2)
+    assert task.output_files is None
+
+
+def test_run_tasks_parallel_max_memory():
+    tasks = [SleepTask(name=str(i), memory=i) for i in range(5)]
+    _run_tasks_parallel(set(tasks), max_parallel_tasks=4, max_memory=3)
+    for i, task in enumerate(tasks):
+        assert task.output_files[0] == str(i)
+
+    # Check the estimated memory use of the tasks running at the start of
+    # every task
+    max_parallel = 1
+    for task in tasks:
+        start = task.output_files[1]
+        running = [
+            t for t in tasks
+            if t.output_files[1] <= start < t.output_files[2]
+        ]
+        max_parallel = max(max_parallel, len(running))
+        if task.memory > 3:
+            # Tasks larger than max_memory run alone
+            assert running == [task]
+        else:
+            assert sum(t.memory for t in running) <= 3
+    # Tasks 0, 1 and 2 fit in the memory together
+    assert max_parallel > 1
+
+
+def test_get_peak_memory(tmp_path):
+    resource_log = tmp_path / 'resource_usage.txt'
+    assert get_peak_memory(str(resource_log)) is None
+    resource_log.write_text(
+        'Date and time (UTC)\tReal time (s)\tCPU time (s)\tCPU (%)\t'
+        'Memory (GB)\tMemory (%)\tDisk read (GB)\tDisk write (GB)\n'
+        '2019-01-01 00:00:00\t1.0\t0.9\t90\t1.5\t10\t0.0\t0.0\n'
+        '2019-01-01 00:00:01\t2.0\t1.9\t95\t2.5\t20\t0.1\t0.0\n'
+        '2019-01-01 00:00:02\t3.0\t2.8\t90\t0.5\t5\t0.1\t0.1\n')
+    assert get_peak_memory(str(resource_log)) == 2.5
+
+    task = EchoTask(memory=1.)
+    assert task.estimate_memory() == 1.
+    task.previous_resource_log = str(resource_log)
+    assert task.estimate_memory() == 2.5